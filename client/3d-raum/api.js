@@ -101,3 +101,56 @@ export async function fetchPossibleMoves(gameId, squareId) {
     return [];
   }
 }
+
+/**
+ * 最後の count 手を戻す (待った)
+ * @param {string} gameId
+ * @param {number} count - 戻す手数 (既定 1)
+ * @returns {Promise<Object>} { success, undone, board, side_to_move, captured_pieces, ply, error, ... }
+ */
+export async function undoMove(gameId, count = 1) {
+  if (!gameId) throw new Error("No game in progress.");
+
+  try {
+    const res = await fetch(`${SERVER_URL}/undo`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ game_id: gameId, count }),
+    });
+    const data = await res.json();
+    return data;
+  } catch (err) {
+    console.error(err);
+    throw new Error("Failed to undo move.");
+  }
+}
+
+/**
+ * ゲームの指し手の差分をサーバーから受け取り続ける (Server-Sent Events)
+ * 接続が切れてもブラウザが Last-Event-ID を付けて繋ぎ直し、取りこぼした手から届く
+ * @param {string} gameId
+ * @param {function(Object): void} onMove - { ply, from, to, promotion, piece, captured, side_to_move, check, game_state } を受け取る
+ * @param {function(Object): void} [onUndo] - { ply, undone } を受け取る (undone は戻した手の差分)
+ * @param {function(): void} [onReset] - 取りこぼしを送り直せないとき。盤面を取り直す
+ * @returns {function(): void} 購読をやめる関数
+ */
+export function subscribeGame(gameId, onMove, onUndo = null, onReset = null) {
+  if (!gameId) throw new Error("No game in progress.");
+
+  const source = new EventSource(`${SERVER_URL}/games/${gameId}/events`);
+  source.addEventListener("move", (event) => {
+    onMove(JSON.parse(event.data));
+  });
+  if (onUndo) {
+    source.addEventListener("undo", (event) => {
+      onUndo(JSON.parse(event.data));
+    });
+  }
+  if (onReset) {
+    source.addEventListener("reset", () => onReset());
+  }
+  source.onerror = (err) => {
+    console.error(err);
+  };
+  return () => source.close();
+}
@@ -273,6 +273,12 @@ import { reRenderThreeBoard, highlightSquare3D, unhighlightSquare3D } from "./th
       }
     } else if (gameState === "stalemate") {
       gameStateSpan.textContent = "Stalemate!";
+    } else if (gameState === "threefold_repetition") {
+      gameStateSpan.textContent = "Draw by threefold repetition.";
+    } else if (gameState === "fifty_move_rule") {
+      gameStateSpan.textContent = "Draw by the fifty-move rule.";
+    } else if (gameState === "insufficient_material") {
+      gameStateSpan.textContent = "Draw by insufficient material.";
     } else if (check) {
       gameStateSpan.textContent = "Check!";
     } else {
@@ -0,0 +1,148 @@
+"""
+たくさんの局面の一括解析。
+
+ゲームを作らずに、局面ごとの合法手の数・王手かどうか・終局の状態を返します。
+サーバーの POST /analyze から使うほか、Python からも直接呼べます。
+
+    from analysis import analyze_batch
+    for index, result in analyze_batch([{"board": text, "side_to_move": "black"}, ...]):
+        ...
+
+局面は盤面の 125 文字の文字列 (encoding.py の "compact" と同じ、マス番号順) で、
+{"board": ..., "side_to_move": ...} の dict か、白番なら文字列だけでも渡せます。
+数が多いときはワーカープロセスに chunk_size 個ずつ配り、終わった順に返します。
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from board import BLACK_BIT, KING, Position, board_from_string
+from draws import insufficient_material
+
+# これより少なければプロセスに配らずその場で解析する
+# (プロセスとの受け渡しのほうが高くつく)
+MIN_PARALLEL_POSITIONS = 256
+DEFAULT_CHUNK_SIZE = 128
+
+# 盤面の文字列に使える文字 (空マスと白黒の 7 種の駒)
+_VALID_CODES = frozenset(b".PNBRUQKpnbruqk")
+
+
+def parse_position(item):
+    """/analyze の 1 要素から Position を作る。不正なら ValueError"""
+    if isinstance(item, str):
+        text, side_to_move = item, "white"
+    elif isinstance(item, dict):
+        text, side_to_move = item.get("board"), item.get("side_to_move", "white")
+    else:
+        raise ValueError("Invalid position")
+    if not isinstance(text, str):
+        raise ValueError("Invalid board")
+    if side_to_move not in ("white", "black"):
+        raise ValueError("Invalid side_to_move")
+    try:
+        board = board_from_string(text)
+    except (ValueError, UnicodeEncodeError):
+        raise ValueError("Invalid board")
+    # 合法手の生成はキングが 1 枚ずつあるものとして動くので、ここで弾く
+    if (not _VALID_CODES.issuperset(board)
+            or board.count(KING) != 1 or board.count(KING | BLACK_BIT) != 1):
+        raise ValueError("Invalid board")
+    return Position(board, side_to_move)
+
+
+def analyze_position(item):
+    """
+    1 局面を解析して {"legal_moves", "check", "game_state"} を返す。
+    局面が不正なら {"error": ...}。
+    game_state は "checkmate" / "stalemate" / "insufficient_material" / "continue"
+    (千日手と 50 手ルールは手の記録がないと分からないので見ない)。
+    """
+    try:
+        position = parse_position(item)
+    except ValueError as e:
+        return {"error": str(e)}
+    moves = position.generate_all_moves()
+    check = position.is_check()
+    if not moves:
+        game_state = "checkmate" if check else "stalemate"
+    elif insufficient_material(position.board):
+        game_state = "insufficient_material"
+    else:
+        game_state = "continue"
+    return {"legal_moves": len(moves), "check": check, "game_state": game_state}
+
+
+def _analyze_chunk(start, items):
+    return start, [analyze_position(item) for item in items]
+
+
+class Analyzer:
+    """
+    ワーカープロセスのプールで局面を解析する。プールは最初に必要になったときに作る。
+    workers が 0 ならいつもその場で解析する。
+    """
+
+    def __init__(self, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.chunk_size = chunk_size
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Flask のスレッドを抱えたまま fork しないよう spawn で起動する
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def analyze(self, items):
+        """
+        items の各局面を解析し、(items の添字, 結果) を終わった順に返すジェネレータ。
+        途中でジェネレータを閉じると、まだ始まっていない分はキャンセルする。
+        """
+        items = list(items)
+        if self.workers <= 0 or len(items) < MIN_PARALLEL_POSITIONS:
+            for index, item in enumerate(items):
+                yield index, analyze_position(item)
+            return
+
+        executor = self._get_executor()
+        futures = [
+            executor.submit(_analyze_chunk, start, items[start:start + self.chunk_size])
+            for start in range(0, len(items), self.chunk_size)
+        ]
+        try:
+            for future in as_completed(futures):
+                start, results = future.result()
+                for offset, result in enumerate(results):
+                    yield start + offset, result
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+_default_analyzer = None
+
+
+def analyze_batch(items, workers=None):
+    """
+    items の各局面を解析し、(添字, 結果) を終わった順に返す。
+    workers を省略するとプロセス内で共有する Analyzer (CPU の数だけのワーカー) を使う。
+    """
+    global _default_analyzer
+    if workers is not None:
+        return Analyzer(workers).analyze(items)
+    if _default_analyzer is None:
+        _default_analyzer = Analyzer()
+    return _default_analyzer.analyze(items)
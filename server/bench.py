@@ -0,0 +1,293 @@
+"""
+指し手生成・王手判定・探索・Flask ルートのベンチマーク。
+
+    python bench.py                          # 全ベンチマークを実行
+    python bench.py -k movegen               # 名前に movegen を含むものだけ
+    python bench.py --save bench.json        # 結果を JSON に保存
+    python bench.py --baseline bench.json    # 保存した結果と比べ、遅くなっていれば終了コード 1
+
+--baseline では、実行したベンチマークが baseline になかったときも
+(名前を変えた・保存し忘れたなど、比べられていないので) 終了コード 1 で終わります。
+
+各ベンチマークは timeit の autorange で 1 回 0.2 秒以上になる回数を決め、
+--repeat 回測った最小値を 1 回あたりの時間として表示します。
+局面は初期配置と、固定シードのランダム対局から取り出した中盤・終盤の局面です。
+"""
+import argparse
+import json
+import random
+import sys
+import timeit
+
+from board import (
+    Position,
+    generate_all_moves,
+    generate_all_moves_reference,
+    is_check,
+)
+
+
+def sample_positions(count=8, plies=(0, 10, 20, 30, 40, 60, 80, 100), seed=0):
+    """固定シードのランダム対局から Position を集める"""
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        position = Position.initial()
+        for ply in range(max(plies) + 1):
+            if ply in plies:
+                positions.append(position.copy())
+                if len(positions) >= count:
+                    break
+            moves = position.generate_all_moves()
+            if not moves:
+                break
+            position.apply_move(rng.choice(moves))
+    return positions
+
+
+# -----------------------------------
+# ベンチマーク本体
+# -----------------------------------
+#
+# それぞれ「計測対象の関数を返す関数」で、戻り値の関数 1 回の呼び出しが
+# ops 回分の操作 (ops は BENCHMARKS に登録した値) になるようにします。
+def bench_movegen(positions):
+    def run():
+        for position in positions:
+            generate_all_moves(position.board, position.side_to_move)
+    return run
+
+
+def bench_movegen_reference(positions):
+    def run():
+        for position in positions:
+            generate_all_moves_reference(position.board, position.side_to_move)
+    return run
+
+
+def bench_is_check(positions):
+    def run():
+        for position in positions:
+            is_check(position.board, position.side_to_move)
+    return run
+
+
+def bench_check_gameend(positions):
+    from engine import Engine
+
+    engine = Engine()
+
+    def run():
+        # 合法手キャッシュに当たらない (生成を含む) コストを測る
+        engine.move_cache.clear()
+        for position in positions:
+            engine.check_gameend(position)
+    return run
+
+
+def bench_bitboard_movegen(positions):
+    from bitboard import BitboardPosition
+
+    bitboards = [BitboardPosition.from_position(position) for position in positions]
+
+    def run():
+        for position in bitboards:
+            position.generate_all_moves()
+    return run
+
+
+def bench_bitboard_is_check(positions):
+    from bitboard import BitboardPosition
+
+    bitboards = [BitboardPosition.from_position(position) for position in positions]
+
+    def run():
+        for position in bitboards:
+            position.is_check()
+    return run
+
+
+# vectorized.py は盤面をまとめて渡すほど速いので、局面を並べて 1 回で処理する
+BATCH_REPEAT = 128
+
+
+def _batch(positions):
+    import numpy as np
+    from vectorized import to_array
+
+    arr = to_array([position.board for position in positions] * BATCH_REPEAT)
+    white = np.array([position.side_to_move == "white" for position in positions]
+                     * BATCH_REPEAT)
+    return arr, white
+
+
+def bench_batch_is_check(positions):
+    from vectorized import is_check as batch_is_check
+
+    arr, white = _batch(positions)
+
+    def run():
+        batch_is_check(arr, white)
+    return run
+
+
+def bench_batch_count_moves(positions):
+    from vectorized import count_pseudo_legal
+
+    arr, white = _batch(positions)
+
+    def run():
+        count_pseudo_legal(arr, white)
+    return run
+
+
+def bench_search_depth1(positions):
+    from search import Searcher
+
+    def run():
+        for position in positions:
+            Searcher().search(position, max_depth=1)
+    return run
+
+
+def _route_client():
+    import server
+
+    return server.create_app().test_client(), server.games
+
+
+def bench_route_new_game(positions):
+    client, games = _route_client()
+
+    def run():
+        client.post("/new_game", json={})
+        games.clear()
+    return run
+
+
+def bench_route_possible_moves(positions):
+    client, games = _route_client()
+    game_id = client.post("/new_game", json={}).get_json()["game_id"]
+
+    def run():
+        client.post("/possible_moves", json={"game_id": game_id, "square": "Ac2"})
+    return run
+
+
+def _reset_game(game, initial):
+    from draws import DrawTracker
+
+    game.update(position=initial.copy(), ply=0, moves=[], undo_stack=[], redo=[],
+                draws=DrawTracker(initial))
+
+
+def bench_route_apply_move(positions, fmt="json"):
+    client, games = _route_client()
+    game_id = client.post("/new_game", json={}).get_json()["game_id"]
+    game = games[game_id]
+    initial = game["position"]
+
+    def run():
+        _reset_game(game, initial)
+        client.post("/apply_move",
+                    json={"game_id": game_id, "from": "Ac2", "to": "Ac3", "format": fmt})
+    return run
+
+
+def bench_route_apply_move_compact(positions):
+    return bench_route_apply_move(positions, "compact")
+
+
+def bench_route_get_move(positions):
+    client, games = _route_client()
+    game_id = client.post("/new_game", json={}).get_json()["game_id"]
+    game = games[game_id]
+    initial = game["position"]
+
+    def run():
+        _reset_game(game, initial)
+        client.post("/get_move", json={"game_id": game_id, "engine": "random"})
+    return run
+
+
+# 名前: (準備関数, 1 回の呼び出しあたりの操作数 (None なら局面数))
+BENCHMARKS = {
+    "movegen": (bench_movegen, None),
+    "movegen_reference": (bench_movegen_reference, None),
+    "is_check": (bench_is_check, None),
+    "check_gameend": (bench_check_gameend, None),
+    "bitboard_movegen": (bench_bitboard_movegen, None),
+    "bitboard_is_check": (bench_bitboard_is_check, None),
+    "batch_is_check": (bench_batch_is_check, 8 * BATCH_REPEAT),
+    "batch_count_moves": (bench_batch_count_moves, 8 * BATCH_REPEAT),
+    "search_depth1": (bench_search_depth1, None),
+    "route_new_game": (bench_route_new_game, 1),
+    "route_possible_moves": (bench_route_possible_moves, 1),
+    "route_apply_move": (bench_route_apply_move, 1),
+    "route_apply_move_compact": (bench_route_apply_move_compact, 1),
+    "route_get_move": (bench_route_get_move, 1),
+}
+
+
+def measure(run, repeat):
+    """1 回の呼び出しあたりの最小秒数"""
+    timer = timeit.Timer(run)
+    number, _ = timer.autorange()
+    number = max(1, number // 2)
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-k", metavar="NAME", default="",
+                        help="名前にこの文字列を含むベンチマークだけ実行する")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", metavar="FILE", help="結果を JSON で保存する")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="保存済みの結果と比較する")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="baseline より何割遅ければ失敗とするか (既定 0.2)")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    positions = sample_positions()
+    results = {}
+    regressions = []
+    missing = []
+    for name, (setup, ops) in BENCHMARKS.items():
+        if args.k not in name:
+            continue
+        per_op = measure(setup(positions), args.repeat) / (ops or len(positions))
+        results[name] = per_op
+        line = f"{name:26s} {per_op * 1e6:12.1f} us/op {1 / per_op:12.1f} ops/s"
+        if name in baseline:
+            ratio = per_op / baseline[name]
+            line += f"  {ratio:6.2f}x baseline"
+            if ratio > 1 + args.threshold:
+                regressions.append(name)
+                line += "  REGRESSION"
+        elif args.baseline:
+            missing.append(name)
+            line += "  (no baseline)"
+        print(line)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if not results:
+        print(f"no benchmark matches -k {args.k!r}")
+        sys.exit(1)
+    if regressions:
+        print("regressions: " + ", ".join(regressions))
+    if missing:
+        print(f"not in {args.baseline}: " + ", ".join(missing))
+    if regressions or missing:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,435 @@
+"""
+125 ビットのビットボードで持つ局面 (BitboardPosition)。
+
+125 マスの盤面は Python の int 1 つに収まるので、駒の種類ごと・色ごとに
+「その駒がいるマスのビットを立てた int」を持ち、利きや移動先を
+ビット演算でまとめて求めます。マス番号とビットの位置は board.py と同じ
+(lvl * 25 + row * 5 + col 番目のビット) です。
+
+  - ナイト・キング・ポーンの利き: マスごとに前もって作ったマスク
+  - 走り駒 (ルーク・ビショップ・ユニコーン・クイーン) の利き:
+    マスと方向ごとの線のマスク ray と、「ray & 占有マス」をキーにした表
+    (線は長くても 4 マスなので、1 方向あたり高々 16 通り) を引く
+
+盤面の bytearray (board.py の表現) も並べて持つので、board.py の
+Position と同じ形の手 (from_idx, to_idx, promotion)・board.Undo・Zobrist キーを
+そのまま使えます。init_board_raumschach() の dict からも作れます。
+
+    position = BitboardPosition.from_dict(init_board_raumschach())
+    moves = position.generate_all_moves()
+    undo = position.make_move(moves[0])
+    position.unmake_move(undo)
+"""
+from board import (
+    BISHOP,
+    BISHOP_DIRS,
+    EMPTY,
+    KING,
+    KING_TARGETS,
+    KNIGHT,
+    KNIGHT_TARGETS,
+    NUM_SQUARES,
+    PAWN,
+    PAWN_CAPTURE_TARGETS,
+    PAWN_PUSH_TARGETS,
+    PROMOTION_PIECES,
+    QUEEN,
+    ROOK,
+    ROOK_DIRS,
+    UNICORN,
+    UNICORN_DIRS,
+    ZOBRIST_BLACK_TO_MOVE,
+    ZOBRIST_PIECES,
+    Undo,
+    board_from_dict,
+    board_from_string,
+    board_to_dict,
+    compute_key,
+    get_opponent_side,
+    in_range,
+    init_board_raumschach,
+    square_index,
+)
+
+PIECE_TYPES = (PAWN, KNIGHT, BISHOP, ROOK, UNICORN, QUEEN, KING)
+SIDES = ("white", "black")
+
+
+def squares_of(mask):
+    """mask の立っているビットのマス番号 (小さい順)"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+# 1 ビットだけ立った int → そのマス番号
+BIT_SQUARES = {1 << square: square for square in range(NUM_SQUARES)}
+
+
+def _mask(squares):
+    mask = 0
+    for square in squares:
+        mask |= 1 << square
+    return mask
+
+
+# -----------------------------------
+# マスごとのマスク
+# -----------------------------------
+KNIGHT_MASKS = [_mask(targets) for targets in KNIGHT_TARGETS]
+KING_MASKS = [_mask(targets) for targets in KING_TARGETS]
+PAWN_PUSH_MASKS = {side: [_mask(t) for t in PAWN_PUSH_TARGETS[side]] for side in SIDES}
+PAWN_CAPTURE_MASKS = {side: [_mask(t) for t in PAWN_CAPTURE_TARGETS[side]] for side in SIDES}
+# side のポーンがそのマスを取れる位置 (反対色のポーンの取る方向に 1 歩)
+PAWN_ATTACKER_MASKS = {side: PAWN_CAPTURE_MASKS[get_opponent_side(side)] for side in SIDES}
+# 昇格するマス (白: Level E の行 5, 黒: Level A の行 1)
+PROMOTION_MASKS = {"white": _mask(range(120, 125)), "black": _mask(range(5))}
+
+
+def _line(square, d):
+    """square から方向 d に並ぶ盤内のマス (近い順)"""
+    lvl, col, row = square // 25, square % 5, (square // 5) % 5
+    squares = []
+    while in_range(lvl + d[0], col + d[1], row + d[2]):
+        lvl, col, row = lvl + d[0], col + d[1], row + d[2]
+        squares.append(square_index(lvl, col, row))
+    return squares
+
+
+def _line_table(dirs):
+    """
+    マスごとに [(ray, {ray & 占有マス: 利き}), ...]。
+    利きは近い順に辿って最初に当たった駒 (敵味方を問わない) のマスまで
+    """
+    table = []
+    for square in range(NUM_SQUARES):
+        lines = []
+        for d in dirs:
+            ray = _line(square, d)
+            if not ray:
+                continue
+            attacks = {}
+            for blockers in range(1 << len(ray)):
+                occupied = _mask(sq for i, sq in enumerate(ray) if blockers >> i & 1)
+                reach = 0
+                for sq in ray:
+                    reach |= 1 << sq
+                    if occupied >> sq & 1:
+                        break
+                attacks[occupied] = reach
+            lines.append((_mask(ray), attacks))
+        table.append(lines)
+    return table
+
+
+ROOK_LINES = _line_table(ROOK_DIRS)
+BISHOP_LINES = _line_table(BISHOP_DIRS)
+UNICORN_LINES = _line_table(UNICORN_DIRS)
+SLIDER_LINES = {
+    ROOK: (ROOK_LINES,),
+    BISHOP: (BISHOP_LINES,),
+    UNICORN: (UNICORN_LINES,),
+    QUEEN: (ROOK_LINES, BISHOP_LINES, UNICORN_LINES),
+}
+
+
+def slider_attacks(lines, square, occupied):
+    """lines (ROOK_LINES など) の方向に square から伸びる利き"""
+    attacks = 0
+    for ray, table in lines[square]:
+        attacks |= table[ray & occupied]
+    return attacks
+
+
+# -----------------------------------
+# 局面
+# -----------------------------------
+class BitboardPosition:
+    """
+    ビットボードの局面。pieces[駒の種類] は色を問わずその種類の駒がいるマス、
+    colors["white"] / colors["black"] はその色の駒がいるマス。
+    board (bytearray)・side_to_move・key は board.Position と同じ意味。
+    make_move / unmake_move は board.Position と同じく board.Undo でやり取りする。
+    """
+
+    __slots__ = ("board", "side_to_move", "key", "pieces", "colors")
+
+    def __init__(self, board, side_to_move="white"):
+        self.board = board
+        self.side_to_move = side_to_move
+        self.key = compute_key(board, side_to_move)
+        self.pieces = dict.fromkeys(PIECE_TYPES, 0)
+        self.colors = dict.fromkeys(SIDES, 0)
+        for square, piece in enumerate(board):
+            if piece != EMPTY:
+                bit = 1 << square
+                self.pieces[piece & 0xDF] |= bit
+                self.colors["white" if piece < 96 else "black"] |= bit
+
+    @classmethod
+    def from_dict(cls, board_dict, side_to_move="white"):
+        return cls(board_from_dict(board_dict), side_to_move)
+
+    @classmethod
+    def from_string(cls, text, side_to_move="white"):
+        return cls(board_from_string(text), side_to_move)
+
+    @classmethod
+    def from_position(cls, position):
+        """board.Position から作る (盤面はコピーする)"""
+        return cls(bytearray(position.board), position.side_to_move)
+
+    @classmethod
+    def initial(cls):
+        """Raumschach の初期局面 (白番)"""
+        return cls.from_dict(init_board_raumschach())
+
+    def to_dict(self):
+        return board_to_dict(self.board)
+
+    def copy(self):
+        position = BitboardPosition.__new__(BitboardPosition)
+        position.board = bytearray(self.board)
+        position.side_to_move = self.side_to_move
+        position.key = self.key
+        position.pieces = dict(self.pieces)
+        position.colors = dict(self.colors)
+        return position
+
+    @property
+    def occupied(self):
+        return self.colors["white"] | self.colors["black"]
+
+    def king_square(self, side):
+        """side のキングのマス。いなければ None"""
+        kings = self.pieces[KING] & self.colors[side]
+        return kings.bit_length() - 1 if kings else None
+
+    def _attacked(self, square, by_side, attackers, occupied):
+        """
+        square が attackers (by_side の駒のマスク) に利かされているか。
+        attackers と occupied は、指した後の局面を試すときに差し替えて渡す
+        """
+        pieces = self.pieces
+        if KNIGHT_MASKS[square] & pieces[KNIGHT] & attackers:
+            return True
+        if KING_MASKS[square] & pieces[KING] & attackers:
+            return True
+        if PAWN_ATTACKER_MASKS[by_side][square] & pieces[PAWN] & attackers:
+            return True
+        queens = pieces[QUEEN]
+        for lines, piece in ((ROOK_LINES, ROOK), (BISHOP_LINES, BISHOP),
+                             (UNICORN_LINES, UNICORN)):
+            sliders = (pieces[piece] | queens) & attackers
+            if sliders and slider_attacks(lines, square, occupied) & sliders:
+                return True
+        return False
+
+    def is_square_attacked(self, square, by_side):
+        return self._attacked(square, by_side, self.colors[by_side], self.occupied)
+
+    def is_check(self, side=None):
+        """side (省略時は手番側) のキングが王手されているか"""
+        side = side or self.side_to_move
+        king = self.king_square(side)
+        if king is None:
+            return False
+        return self.is_square_attacked(king, get_opponent_side(side))
+
+    def attacks(self, square):
+        """square にいる駒の移動先の候補 (味方の駒のマスも含む利き)。ポーンは取る方向"""
+        piece = self.board[square]
+        if piece == EMPTY:
+            return 0
+        piece_type = piece & 0xDF
+        if piece_type == KNIGHT:
+            return KNIGHT_MASKS[square]
+        if piece_type == KING:
+            return KING_MASKS[square]
+        if piece_type == PAWN:
+            return PAWN_CAPTURE_MASKS["white" if piece < 96 else "black"][square]
+        occupied = self.occupied
+        attacks = 0
+        for lines in SLIDER_LINES[piece_type]:
+            attacks |= slider_attacks(lines, square, occupied)
+        return attacks
+
+    def _pseudo_moves(self, side):
+        """手番側の疑似合法手を (from_idx, to_idx のマスク) で返す"""
+        own = self.colors[side]
+        not_own = ~own
+        occupied = own | self.colors[get_opponent_side(side)]
+        pieces = self.pieces
+        result = []
+        push_masks, capture_masks = PAWN_PUSH_MASKS[side], PAWN_CAPTURE_MASKS[side]
+        for square in squares_of(pieces[PAWN] & own):
+            result.append((square, push_masks[square] & ~occupied
+                           | capture_masks[square] & occupied & not_own))
+        for piece_type, masks in ((KNIGHT, KNIGHT_MASKS), (KING, KING_MASKS)):
+            for square in squares_of(pieces[piece_type] & own):
+                result.append((square, masks[square] & not_own))
+        for piece_type, all_lines in SLIDER_LINES.items():
+            for square in squares_of(pieces[piece_type] & own):
+                attacks = 0
+                for lines in all_lines:
+                    for ray, table in lines[square]:
+                        attacks |= table[ray & occupied]
+                result.append((square, attacks & not_own))
+        return result
+
+    def _checks_and_pins(self, side, king):
+        """
+        (王手している駒の数, 王手を防ぐ手の行き先のマスク, {ピンされた駒のマス: 動ける線}) を返す。
+        王手を防ぐ行き先は、王手している駒とキングとの間のマス (王手がなければ全マス)。
+        キングから 26 方向の線を見て、最初の駒が相手の走り駒なら王手、
+        味方の駒でその先の駒が相手の走り駒ならピン
+        """
+        opponent = get_opponent_side(side)
+        own, them = self.colors[side], self.colors[opponent]
+        occupied = own | them
+        pieces = self.pieces
+        checkers = 0
+        evasions = 0
+        pins = {}
+
+        # キング同士が隣り合う局面も board.py と同じく王手として扱う
+        leapers = (KNIGHT_MASKS[king] & pieces[KNIGHT]
+                   | KING_MASKS[king] & pieces[KING]
+                   | PAWN_ATTACKER_MASKS[opponent][king] & pieces[PAWN]) & them
+        if leapers:
+            checkers += bin(leapers).count("1")
+            evasions |= leapers
+
+        queens = pieces[QUEEN]
+        for lines, piece in ((ROOK_LINES, ROOK), (BISHOP_LINES, BISHOP),
+                             (UNICORN_LINES, UNICORN)):
+            sliders = (pieces[piece] | queens) & them
+            if not sliders:
+                continue
+            for ray, table in lines[king]:
+                if not ray & sliders:
+                    continue
+                blockers = ray & occupied
+                reach = table[blockers]
+                first = reach & blockers
+                if first & sliders:
+                    checkers += 1
+                    evasions |= reach
+                elif first & own:
+                    # その駒をどけたときに次に当たる駒
+                    beyond = table[blockers ^ first]
+                    if beyond & blockers & sliders:
+                        pins[first.bit_length() - 1] = beyond
+        if not checkers:
+            evasions = ~0
+        return checkers, evasions, pins
+
+    def generate_all_moves(self):
+        """
+        手番側の全合法手を (from_idx, to_idx, promotion) で返す (並びは board.py と違う)。
+        board.generate_all_moves と同じく王手とピンを一度だけ求めて疑似合法手を絞り込み、
+        キングの手だけはキングを取り除いた占有マスで行き先の利きを確かめる。
+        """
+        side = self.side_to_move
+        opponent = get_opponent_side(side)
+        them = self.colors[opponent]
+        king = self.king_square(side)
+        if king is None:
+            checkers, evasions, pins = 0, ~0, {}
+        else:
+            checkers, evasions, pins = self._checks_and_pins(side, king)
+            lifted = self.occupied & ~(1 << king)
+        pawns = self.pieces[PAWN]
+        promotion_mask = PROMOTION_MASKS[side]
+        promotion_pieces = PROMOTION_PIECES[side]
+
+        moves = []
+        append = moves.append
+        for from_idx, targets in self._pseudo_moves(side):
+            if from_idx == king:
+                for to_idx in squares_of(targets):
+                    if not self._attacked(to_idx, opponent, them & ~(1 << to_idx), lifted):
+                        append((from_idx, to_idx, None))
+                continue
+            if checkers > 1:
+                continue  # 両王手はキングが動くしかない
+            targets &= evasions
+            pin_line = pins.get(from_idx)
+            if pin_line is not None:
+                targets &= pin_line
+            if pawns >> from_idx & 1 and targets & promotion_mask:
+                for to_idx in squares_of(targets):
+                    if promotion_mask >> to_idx & 1:
+                        for promotion in promotion_pieces:
+                            append((from_idx, to_idx, promotion))
+                    else:
+                        append((from_idx, to_idx, None))
+                continue
+            # ここがいちばん多く回るので squares_of を使わずに 1 ビットずつ取り出す
+            while targets:
+                low = targets & -targets
+                append((from_idx, BIT_SQUARES[low], None))
+                targets ^= low
+        return moves
+
+    def make_move(self, move):
+        """
+        move = (from_idx, to_idx, promotion) を適用して手番を交代する。
+        unmake_move に渡すと指す前に戻せる board.Undo を返す。
+        """
+        from_idx, to_idx, promotion = move
+        board = self.board
+        from_piece = moved_piece = board[from_idx]
+        target_piece = board[to_idx]
+        if promotion:
+            moved_piece = ord(promotion)
+        undo = Undo(move, from_piece, target_piece, self.key)
+
+        side = self.side_to_move
+        opponent = get_opponent_side(side)
+        from_bit, to_bit = 1 << from_idx, 1 << to_idx
+        pieces = self.pieces
+        if target_piece != EMPTY:
+            pieces[target_piece & 0xDF] ^= to_bit
+            self.colors[opponent] ^= to_bit
+        pieces[from_piece & 0xDF] ^= from_bit
+        pieces[moved_piece & 0xDF] |= to_bit
+        self.colors[side] ^= from_bit | to_bit
+
+        board[to_idx] = moved_piece
+        board[from_idx] = EMPTY
+        self.key ^= (
+            ZOBRIST_PIECES[from_piece][from_idx]
+            ^ ZOBRIST_PIECES[target_piece][to_idx]
+            ^ ZOBRIST_PIECES[moved_piece][to_idx]
+            ^ ZOBRIST_BLACK_TO_MOVE
+        )
+        self.side_to_move = opponent
+        return undo
+
+    def unmake_move(self, undo):
+        """make_move の記録 undo を使って、その手を指す前の局面に戻す"""
+        from_idx, to_idx, _ = undo.move
+        board = self.board
+        moved_piece = board[to_idx]
+        from_bit, to_bit = 1 << from_idx, 1 << to_idx
+
+        opponent = self.side_to_move
+        side = self.side_to_move = get_opponent_side(opponent)
+        pieces = self.pieces
+        pieces[moved_piece & 0xDF] ^= to_bit
+        pieces[undo.moved_piece & 0xDF] |= from_bit
+        self.colors[side] ^= from_bit | to_bit
+        if undo.captured_piece != EMPTY:
+            pieces[undo.captured_piece & 0xDF] |= to_bit
+            self.colors[opponent] |= to_bit
+
+        board[from_idx] = undo.moved_piece
+        board[to_idx] = undo.captured_piece
+        self.key = undo.key
+
+    def apply_move(self, move):
+        """move を指して手番を交代する (戻さないとき用)。取った駒の文字を返す"""
+        return self.make_move(move).captured
+
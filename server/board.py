@@ -0,0 +1,863 @@
+"""
+Raumschach の盤面コアと指し手生成。
+
+盤面は "Aa1" をキーにした dict ではなく、125 マスのフラットな bytearray で
+持ちます。各要素は駒文字の ASCII コード ("R" = 82, "." = 46 など) です。
+マスの番号は
+
+    index = レベル * 25 + 行 * 5 + 列
+
+で、dict 版の走査順 (レベル → 行 → 列) と一致します。
+
+"Aa1" 形式の dict との変換 (board_from_dict / board_to_dict) は
+Flask の JSON 境界でだけ行い、指し手生成は整数のまま動きます。
+"""
+import itertools
+import random
+
+# -----------------------------------
+# 1. 座標
+# -----------------------------------
+LEVELS = ["A", "B", "C", "D", "E"]  # z=0..4
+COLS = ["a", "b", "c", "d", "e"]  # x=0..4
+ROWS = ["1", "2", "3", "4", "5"]  # y=0..4
+
+NUM_SQUARES = 125
+
+# index → "Aa1"
+SQUARES = [lvl + col + row for lvl in LEVELS for row in ROWS for col in COLS]
+# "Aa1" → index
+SQUARE_INDEX = {square: idx for idx, square in enumerate(SQUARES)}
+
+EMPTY = ord(".")
+
+
+def in_range(lvl_idx, col_idx, row_idx):
+    """盤内かどうか判定する"""
+    return (0 <= lvl_idx < 5) and (0 <= col_idx < 5) and (0 <= row_idx < 5)
+
+
+def square_index(lvl_idx, col_idx, row_idx):
+    """(レベル, 列, 行) → マス番号"""
+    return lvl_idx * 25 + row_idx * 5 + col_idx
+
+
+def get_idx_from_square(square):
+    """
+    "Aa1" → (lvl_idx=0, col_idx=0, row_idx=0)
+    "Ec5" → (4,          2,         4)
+    """
+    idx = SQUARE_INDEX[square]
+    return idx // 25, idx % 5, (idx // 5) % 5
+
+
+def get_square_from_idx(lvl_idx, col_idx, row_idx):
+    """(0,0,0) → "Aa1" などに変換"""
+    return SQUARES[square_index(lvl_idx, col_idx, row_idx)]
+
+
+# -----------------------------------
+# 2. 駒
+# -----------------------------------
+#
+# 駒の表現例:
+#   "R" = 白 Rook
+#   "r" = 黒 Rook
+#   ...
+#   大文字: 白, 小文字: 黒
+#   "."    : 空マス(何も置かれていない)
+#
+# bytearray 上では ord(駒文字) をそのまま格納します。
+# 大文字 (白) は 96 未満、小文字 (黒) は 96 より大きいので、
+# 色の判定は整数比較 1 回です。
+
+
+def get_piece_color(piece: str) -> str:
+    """'R' (白) or 'r' (黒) -> 'white' or 'black'"""
+    if piece == ".":
+        return "none"
+    return "white" if piece.isupper() else "black"
+
+
+def fix_piece_side(piece, side):
+    """駒の側面を修正する"""
+    if side == "white":
+        return piece.upper()
+    elif side == "black":
+        return piece.lower()
+    else:
+        raise ValueError(f"Invalid side: {side}")
+
+
+def get_opponent_side(side_to_move):
+    if side_to_move == "white":
+        return "black"
+    elif side_to_move == "black":
+        return "white"
+    else:
+        raise ValueError(f"Invalid side_to_move: {side_to_move}")
+
+
+# -----------------------------------
+# 3. 初期配置と dict との変換
+# -----------------------------------
+def create_empty_board():
+    """5x5x5 をすべて "." (空) にする。"""
+    board = {}
+    for lvl in LEVELS:
+        for row in ROWS:
+            for col in COLS:
+                key = lvl + col + row  # 例: "Aa1"
+                board[key] = "."
+    return board
+
+
+def init_board_raumschach():
+    """
+    Raumschach の初期配置を返す。
+    ここでは説明文にある駒をなるべく再現した例。
+    """
+    board = create_empty_board()
+
+    # White 側初期配置 (Level A, B)
+    # Level A
+    board["Aa1"] = "R"  # Rook
+    board["Ab1"] = "N"  # Knight
+    board["Ac1"] = "K"  # King
+    board["Ad1"] = "N"
+    board["Ae1"] = "R"
+    for c in COLS:
+        key = "A" + c + "2"
+        board[key] = "P"  # Pawn
+
+    # Level B
+    board["Ba1"] = "B"  # Bishop
+    board["Bb1"] = "U"  # Unicorn (仮)
+    board["Bc1"] = "Q"  # Queen
+    board["Bd1"] = "B"
+    board["Be1"] = "U"
+    for c in COLS:
+        key = "B" + c + "2"
+        board[key] = "P"
+
+    # Black 側初期配置 (Level D, E)
+    # Level E
+    board["Ea5"] = "r"  # Rook
+    board["Eb5"] = "n"  # Knight
+    board["Ec5"] = "k"  # King
+    board["Ed5"] = "n"
+    board["Ee5"] = "r"
+    for c in COLS:
+        key = "E" + c + "4"
+        board[key] = "p"  # Pawn
+
+    # Level D
+    board["Da5"] = "b"  # Bishop
+    board["Db5"] = "u"  # Unicorn
+    board["Dc5"] = "q"  # Queen
+    board["Dd5"] = "b"
+    board["De5"] = "u"
+    for c in COLS:
+        key = "D" + c + "4"
+        board[key] = "p"
+
+    return board
+
+
+def board_from_dict(board_dict):
+    """"Aa1" キーの dict → 125 マスの bytearray"""
+    return bytearray(ord(board_dict[square]) for square in SQUARES)
+
+
+def board_to_dict(board):
+    """125 マスの bytearray → "Aa1" キーの dict (JSON 応答用)"""
+    return dict(zip(SQUARES, board.decode("ascii")))
+
+
+def board_to_string(board):
+    """125 マスの bytearray → 125 文字の文字列 (マス番号順)"""
+    return board.decode("ascii")
+
+
+def board_from_string(text):
+    """125 文字の文字列 → 125 マスの bytearray"""
+    if len(text) != NUM_SQUARES:
+        raise ValueError(f"Invalid board string length: {len(text)}")
+    return bytearray(text, "ascii")
+
+
+def move_to_squares(move):
+    """(from_idx, to_idx, promotion) → ("Aa1", "Aa2", promotion)"""
+    from_idx, to_idx, promotion = move
+    return SQUARES[from_idx], SQUARES[to_idx], promotion
+
+
+# -----------------------------------
+# 4. 方向
+# -----------------------------------
+ROOK_DIRS = [
+    (1, 0, 0),
+    (-1, 0, 0),  # レベル方向 (A->B->C->D->E)
+    (0, 1, 0),
+    (0, -1, 0),  # 横(列)
+    (0, 0, 1),
+    (0, 0, -1),  # 縦(行)
+]
+
+BISHOP_DIRS = [
+    # x-y面 (z=一定)
+    (0, 1, 1),
+    (0, 1, -1),
+    (0, -1, 1),
+    (0, -1, -1),
+    # x-z面 (y=一定)
+    (1, 0, 1),
+    (1, 0, -1),
+    (-1, 0, 1),
+    (-1, 0, -1),
+    # y-z面 (x=一定)
+    (1, 1, 0),
+    (1, -1, 0),
+    (-1, 1, 0),
+    (-1, -1, 0),
+]
+
+UNICORN_DIRS = [
+    (1, 1, 1),
+    (1, 1, -1),
+    (1, -1, 1),
+    (1, -1, -1),
+    (-1, 1, 1),
+    (-1, 1, -1),
+    (-1, -1, 1),
+    (-1, -1, -1),
+]
+QUEEN_DIRS = ROOK_DIRS + BISHOP_DIRS + UNICORN_DIRS
+KNIGHT_DELTAS = [
+    # x-y平面 (z=0)
+    (2, 1, 0),
+    (2, -1, 0),
+    (-2, 1, 0),
+    (-2, -1, 0),
+    (1, 2, 0),
+    (1, -2, 0),
+    (-1, 2, 0),
+    (-1, -2, 0),
+    # x-z平面 (y=0)
+    (2, 0, 1),
+    (2, 0, -1),
+    (-2, 0, 1),
+    (-2, 0, -1),
+    (1, 0, 2),
+    (1, 0, -2),
+    (-1, 0, 2),
+    (-1, 0, -2),
+    # y-z平面 (x=0)
+    (0, 2, 1),
+    (0, 2, -1),
+    (0, -2, 1),
+    (0, -2, -1),
+    (0, 1, 2),
+    (0, 1, -2),
+    (0, -1, 2),
+    (0, -1, -2),
+]
+
+KING_DELTAS = [
+    (0, 0, -1),
+    (0, 0, 1),
+    (0, -1, -1),
+    (0, -1, 0),
+    (0, -1, 1),
+    (0, 1, -1),
+    (0, 1, 0),
+    (0, 1, 1),
+    (1, 0, -1),
+    (1, 0, 0),
+    (1, 0, 1),
+    (1, -1, -1),
+    (1, -1, 0),
+    (1, -1, 1),
+    (1, 1, -1),
+    (1, 1, 0),
+    (1, 1, 1),
+    (-1, 0, -1),
+    (-1, 0, 0),
+    (-1, 0, 1),
+    (-1, -1, -1),
+    (-1, -1, 0),
+    (-1, -1, 1),
+    (-1, 1, -1),
+    (-1, 1, 0),
+    (-1, 1, 1),
+]
+
+PAWN_PASSIVE_DELTAS = [(1, 0, 0), (0, 0, 1)]
+PAWN_CAPTURE_DELTAS = [(1, -1, 0), (1, 1, 0), (0, -1, 1), (0, 1, 1)]
+
+
+# -----------------------------------
+# 5. マスごとの利きテーブル
+# -----------------------------------
+#
+# 方向・跳びのパターンを import 時に 125 マスすべてへ適用しておき、
+# 指し手生成では盤内判定なしにテーブルを辿るだけにします。
+#
+#   ROOK_RAYS[sq]      : sq から ROOK_DIRS の各方向へ伸びるマスのタプルのリスト
+#                        (近い順。盤外にしか伸びない方向は含めない)
+#   KNIGHT_TARGETS[sq] : sq からナイトが跳べる盤内のマス
+#   PAWN_PUSH_TARGETS["white"][sq] など : 色ごとのポーンの移動先
+def _ray(square, d_lvl, d_col, d_row):
+    lvl_idx, col_idx, row_idx = square // 25, square % 5, (square // 5) % 5
+    ray = []
+    while True:
+        lvl_idx += d_lvl
+        col_idx += d_col
+        row_idx += d_row
+        if not in_range(lvl_idx, col_idx, row_idx):
+            return tuple(ray)
+        ray.append(square_index(lvl_idx, col_idx, row_idx))
+
+
+def _ray_table(dirs):
+    table = []
+    for square in range(NUM_SQUARES):
+        rays = [_ray(square, *d) for d in dirs]
+        table.append([ray for ray in rays if ray])
+    return table
+
+
+def _leaper_table(deltas, sign=1):
+    table = []
+    for square in range(NUM_SQUARES):
+        targets = []
+        for d_lvl, d_col, d_row in deltas:
+            ray = _ray(square, sign * d_lvl, sign * d_col, sign * d_row)
+            if ray:
+                targets.append(ray[0])
+        table.append(tuple(targets))
+    return table
+
+
+ROOK_RAYS = _ray_table(ROOK_DIRS)
+BISHOP_RAYS = _ray_table(BISHOP_DIRS)
+UNICORN_RAYS = _ray_table(UNICORN_DIRS)
+QUEEN_RAYS = _ray_table(QUEEN_DIRS)
+KNIGHT_TARGETS = _leaper_table(KNIGHT_DELTAS)
+KING_TARGETS = _leaper_table(KING_DELTAS)
+# ポーンは白が +、黒が - 方向
+PAWN_PUSH_TARGETS = {
+    "white": _leaper_table(PAWN_PASSIVE_DELTAS),
+    "black": _leaper_table(PAWN_PASSIVE_DELTAS, -1),
+}
+PAWN_CAPTURE_TARGETS = {
+    "white": _leaper_table(PAWN_CAPTURE_DELTAS),
+    "black": _leaper_table(PAWN_CAPTURE_DELTAS, -1),
+}
+
+SLIDER_RAYS = {
+    ord("R"): ROOK_RAYS,
+    ord("B"): BISHOP_RAYS,
+    ord("U"): UNICORN_RAYS,
+    ord("Q"): QUEEN_RAYS,
+}
+LEAPER_TARGETS = {
+    ord("N"): KNIGHT_TARGETS,
+    ord("K"): KING_TARGETS,
+}
+
+# 白の駒コード (黒は | 0x20 で小文字になる)
+PAWN = ord("P")
+KNIGHT = ord("N")
+BISHOP = ord("B")
+ROOK = ord("R")
+UNICORN = ord("U")
+QUEEN = ord("Q")
+KING = ord("K")
+BLACK_BIT = 0x20
+
+# 各マスから 26 方向へ伸びる線と、その線を走れる駒 (クイーンは全方向)。
+# 王手・ピンの検出に使う
+LINE_RAYS = [
+    [(ray, ROOK) for ray in ROOK_RAYS[square]]
+    + [(ray, BISHOP) for ray in BISHOP_RAYS[square]]
+    + [(ray, UNICORN) for ray in UNICORN_RAYS[square]]
+    for square in range(NUM_SQUARES)
+]
+
+# 昇格先の駒 (generate_all_moves の並び順)
+PROMOTION_PIECES = {
+    "white": ["Q", "N", "U", "R", "B"],
+    "black": ["q", "n", "u", "r", "b"],
+}
+
+
+def promotion_rank(side_to_move, to_idx):
+    """ポーンが to_idx に着いたら昇格か (白: Level E の行 5, 黒: Level A の行 1)"""
+    if side_to_move == "white":
+        return to_idx >= 120
+    return to_idx < 5
+
+
+# -----------------------------------
+# 6. 指し手生成
+# -----------------------------------
+
+# generate_all_moves・is_check・can_move_to を呼んだ回数 (GET /metrics で返す)。
+# dict の += はスレッドが重なると数え落とすので itertools.count で数える。
+# next(count) は GIL を持ったままの 1 回の C 呼び出しなので、ロックなしでも
+# 数え落とさず、ロックを取るよりずっと軽い
+_GENERATE_CALLS = itertools.count()
+_IS_CHECK_CALLS = itertools.count()
+_CAN_MOVE_TO_CALLS = itertools.count()
+
+
+def call_counts():
+    """{関数名: 呼んだ回数}。count は次の値を repr ("count(n)") でしか見せない"""
+    return {
+        name: int(repr(counter)[len("count("):-1])
+        for name, counter in (("generate_all_moves", _GENERATE_CALLS),
+                              ("is_check", _IS_CHECK_CALLS),
+                              ("can_move_to", _CAN_MOVE_TO_CALLS))
+    }
+
+
+def get_king_square(board, side):
+    """指定した side の King の位置を返す"""
+    king = KING if side == "white" else KING | BLACK_BIT
+    idx = board.find(king)
+    return idx if idx >= 0 else None
+
+
+def is_square_attacked(board, square, by_side):
+    """
+    square が by_side の駒に利かされているかを判定する。
+    相手の駒を全部動かしてみるのではなく、square から各方向・跳びの
+    パターンを逆向きに辿り、そこにいるべき種類の駒がいるかだけを見る。
+    """
+    color = 0 if by_side == "white" else BLACK_BIT
+
+    # 跳び駒: ナイト・キングの利きは対称なので square からの跳び先を見る
+    knight = KNIGHT | color
+    for sq in KNIGHT_TARGETS[square]:
+        if board[sq] == knight:
+            return True
+    king = KING | color
+    for sq in KING_TARGETS[square]:
+        if board[sq] == king:
+            return True
+    # ポーン: by_side のポーンが square を取れる位置は、
+    # 反対色のポーンの取る方向に square から 1 歩進んだマス
+    pawn = PAWN | color
+    for sq in PAWN_CAPTURE_TARGETS[get_opponent_side(by_side)][square]:
+        if board[sq] == pawn:
+            return True
+
+    # 走り駒: 各方向で最初に当たった駒が、その方向に動ける種類か
+    queen = QUEEN | color
+    for rays, slider in (
+        (ROOK_RAYS, ROOK | color),
+        (BISHOP_RAYS, BISHOP | color),
+        (UNICORN_RAYS, UNICORN | color),
+    ):
+        for ray in rays[square]:
+            for sq in ray:
+                piece = board[sq]
+                if piece != EMPTY:
+                    if piece == slider or piece == queen:
+                        return True
+                    break
+    return False
+
+
+def is_check(board, side, king_square=None):
+    """
+    指定した side の King が王手かどうかを判定する。
+    king_square が分かっていれば渡すと盤面からキングを探さずに済む。
+    """
+    next(_IS_CHECK_CALLS)
+    if king_square is None:
+        king_square = get_king_square(board, side)
+        if king_square is None:
+            return False
+    return is_square_attacked(board, king_square, get_opponent_side(side))
+
+
+def get_candidate_squares(board, from_square, side_to_move, only_pawn_capture=False):
+    """
+    from_square にある駒の種類を判別し、
+    Raumschachにおける合法手(スライド or ナイトジャンプ)を返す。
+    """
+    piece = board[from_square]
+    if piece == EMPTY:
+        return []  # 空マス
+
+    # 大文字・小文字を区別せず動きは同じ
+    piece_type = piece & 0xDF  # R, B, U, Q, N など
+    is_white = side_to_move == "white"
+    moves = []
+
+    rays = SLIDER_RAYS.get(piece_type)
+    if rays is not None:
+        # 各方向を近い順に辿り、空マスは移動可能、敵駒は取って終了、
+        # 味方駒はその手前で終了
+        for ray in rays[from_square]:
+            for square in ray:
+                piece_at = board[square]
+                if piece_at == EMPTY:
+                    moves.append(square)
+                else:
+                    if (piece_at < 96) != is_white:
+                        moves.append(square)
+                    break
+        return moves
+
+    targets = LEAPER_TARGETS.get(piece_type)
+    if targets is not None:
+        # Knight / King (1stepジャンプ)
+        for square in targets[from_square]:
+            target_piece = board[square]
+            # 味方駒がいる場合はNG
+            if target_piece == EMPTY or (target_piece < 96) != is_white:
+                moves.append(square)
+        return moves
+
+    if piece_type == PAWN:
+        if not only_pawn_capture:
+            for square in PAWN_PUSH_TARGETS[side_to_move][from_square]:
+                # 味方駒、敵駒がいる場合はNG
+                if board[square] == EMPTY:
+                    moves.append(square)
+        for square in PAWN_CAPTURE_TARGETS[side_to_move][from_square]:
+            target_piece = board[square]
+            # 味方駒、空白がいる場合はNG
+            if target_piece != EMPTY and (target_piece < 96) != is_white:
+                moves.append(square)
+
+    return moves
+
+
+def can_move_to(board, from_square, to_square, side_to_move, king_square=None):
+    """
+    王手にならないかどうか。
+    king_square は動かす前の side_to_move のキングの位置 (None なら盤面から探す)。
+    board は書き換えない (他のスレッドが同じ盤面を読んでいてもよい)。
+    """
+    next(_CAN_MOVE_TO_CALLS)
+    if king_square is None:
+        king_square = get_king_square(board, side_to_move)
+        if king_square is None:
+            return True
+    if king_square == from_square:
+        king_square = to_square
+
+    # コピーの上で動かしてから王手になるかどうかを見る
+    board = bytearray(board)
+    board[to_square] = board[from_square]
+    board[from_square] = EMPTY
+    return not is_square_attacked(
+        board, king_square, get_opponent_side(side_to_move))
+
+
+def generate_all_moves_reference(board, side_to_move, king_square=None):
+    """
+    generate_all_moves と同じ結果を、疑似合法手を 1 手ずつ盤面で動かして
+    王手になるか確かめる素朴な方法で求める。perft.py の突き合わせ用。
+    """
+    if king_square is None:
+        king_square = get_king_square(board, side_to_move)
+    moves = []
+    is_white = side_to_move == "white"
+    for from_square in range(NUM_SQUARES):
+        piece = board[from_square]
+        if piece == EMPTY or (piece < 96) != is_white:
+            continue
+
+        candidate_squares = get_candidate_squares(
+            board, from_square, side_to_move
+        )
+        is_pawn = piece & 0xDF == PAWN
+
+        # move が王手にならないかどうかチェック
+        for to_square in candidate_squares:
+            if king_square is None or can_move_to(
+                board, from_square, to_square, side_to_move, king_square
+            ):
+                if is_pawn and promotion_rank(side_to_move, to_square):
+                    for promotion in PROMOTION_PIECES[side_to_move]:
+                        moves.append((from_square, to_square, promotion))
+                else:
+                    moves.append((from_square, to_square, None))
+    return moves
+
+
+def get_checks_and_pins(board, side, king_square):
+    """
+    side のキングに対する王手とピンを一度に調べる。
+
+    返り値 (checkers, evasions, pins):
+      checkers : 王手している相手の駒のマスのリスト
+      evasions : 王手が 1 つのとき、キング以外の駒が動いて王手を解けるマス
+                 (王手している駒のマスと、走り駒ならキングとの間のマス)
+      pins     : {ピンされた味方の駒のマス: その駒が動いてよいマスの集合}
+                 (キングとピンしている駒の間のマスと、ピンしている駒のマス)
+    """
+    color = BLACK_BIT if side == "white" else 0  # 相手の色
+    is_white = side == "white"
+    queen = QUEEN | color
+    checkers = []
+    evasions = set()
+    pins = {}
+
+    for ray, slider in LINE_RAYS[king_square]:
+        slider |= color
+        pinned = None
+        for i, sq in enumerate(ray):
+            piece = board[sq]
+            if piece == EMPTY:
+                continue
+            if (piece < 96) == is_white:
+                # 味方駒: 1 つ目ならピン候補、2 つ目ならこの方向は安全
+                if pinned is not None:
+                    break
+                pinned = sq
+                continue
+            if piece == slider or piece == queen:
+                if pinned is None:
+                    checkers.append(sq)
+                    evasions.update(ray[:i + 1])
+                else:
+                    pins[pinned] = set(ray[:i + 1])
+            break
+
+    for targets, attacker in (
+        (KNIGHT_TARGETS[king_square], KNIGHT | color),
+        (PAWN_CAPTURE_TARGETS[side][king_square], PAWN | color),
+        (KING_TARGETS[king_square], KING | color),
+    ):
+        for sq in targets:
+            if board[sq] == attacker:
+                checkers.append(sq)
+                evasions.add(sq)
+
+    return checkers, evasions, pins
+
+
+def generate_all_moves(board, side_to_move, king_square=None):
+    """
+    指定した手番の全ての合法手を (from_idx, to_idx, promotion) で返す。
+    promotion は昇格時の駒文字、それ以外は None。
+
+    王手とピンを局面ごとに一度だけ求め、キング以外の駒はそれで
+    疑似合法手を絞り込む (盤面を動かして王手判定はしない)。
+    キングの手だけは、キングを取り除いた盤面のコピーで利きを確かめる。
+    board は書き換えない。
+    """
+    next(_GENERATE_CALLS)
+    if king_square is None:
+        king_square = get_king_square(board, side_to_move)
+        if king_square is None:
+            # キングがいなければ王手もないので疑似合法手がそのまま合法手
+            return generate_all_moves_reference(board, side_to_move)
+
+    checkers, evasions, pins = get_checks_and_pins(
+        board, side_to_move, king_square)
+    double_check = len(checkers) > 1
+    opponent = get_opponent_side(side_to_move)
+    promotion_pieces = PROMOTION_PIECES[side_to_move]
+
+    moves = []
+    is_white = side_to_move == "white"
+    for from_square in range(NUM_SQUARES):
+        piece = board[from_square]
+        if piece == EMPTY or (piece < 96) != is_white:
+            continue
+
+        candidate_squares = get_candidate_squares(
+            board, from_square, side_to_move
+        )
+
+        if from_square == king_square:
+            # キングは動いた先が利かされていないかを直接確かめる
+            # (キング自身が利きを遮らないよう、取り除いたコピーで)
+            lifted = bytearray(board)
+            lifted[from_square] = EMPTY
+            for to_square in candidate_squares:
+                if not is_square_attacked(lifted, to_square, opponent):
+                    moves.append((from_square, to_square, None))
+            continue
+
+        if double_check:
+            continue  # 両王手はキングが動くしかない
+        if checkers:
+            candidate_squares = [sq for sq in candidate_squares if sq in evasions]
+        pin_line = pins.get(from_square)
+        if pin_line is not None:
+            candidate_squares = [sq for sq in candidate_squares if sq in pin_line]
+
+        if piece & 0xDF == PAWN:
+            for to_square in candidate_squares:
+                if promotion_rank(side_to_move, to_square):
+                    for promotion in promotion_pieces:
+                        moves.append((from_square, to_square, promotion))
+                else:
+                    moves.append((from_square, to_square, None))
+        else:
+            for to_square in candidate_squares:
+                moves.append((from_square, to_square, None))
+    return moves
+
+
+# -----------------------------------
+# 7. Zobrist ハッシュ
+# -----------------------------------
+#
+# (駒, マス) ごとと「黒番」に 64bit の乱数を割り当て、盤上の駒の乱数を
+# すべて XOR したものを局面のキーにします。1 手指すごとに
+# 動いた駒・取られた駒・手番の分だけ XOR し直せば済むので、
+# 125 マスを読み直さずにキーを更新できます。
+# 乱数は固定シードなので、プロセスをまたいでも同じ局面は同じキーです。
+ZOBRIST_SEED = 0x5A0B_2157
+
+
+def _zobrist_tables(seed):
+    rng = random.Random(seed)
+    pieces = [[0] * NUM_SQUARES for _ in range(128)]  # 駒コード → マスごとの乱数
+    for code in (PAWN, KNIGHT, BISHOP, ROOK, UNICORN, QUEEN, KING):
+        for color in (0, BLACK_BIT):
+            pieces[code | color] = [rng.getrandbits(64) for _ in range(NUM_SQUARES)]
+    return pieces, rng.getrandbits(64)
+
+
+# ZOBRIST_PIECES[EMPTY] はすべて 0 なので、空マスは XOR しても変わらない
+ZOBRIST_PIECES, ZOBRIST_BLACK_TO_MOVE = _zobrist_tables(ZOBRIST_SEED)
+
+
+def compute_key(board, side_to_move):
+    """盤面全体から Zobrist キーを計算する (差分更新の検算・初期化用)"""
+    key = ZOBRIST_BLACK_TO_MOVE if side_to_move == "black" else 0
+    for square, piece in enumerate(board):
+        key ^= ZOBRIST_PIECES[piece][square]
+    return key
+
+
+# -----------------------------------
+# 8. 局面
+# -----------------------------------
+class Undo:
+    """make_move の記録。unmake_move で指す前に戻すのに使う"""
+
+    __slots__ = ("move", "moved_piece", "captured_piece", "key")
+
+    def __init__(self, move, moved_piece, captured_piece, key):
+        self.move = move
+        self.moved_piece = moved_piece  # 動かした駒 (昇格前) のコード
+        self.captured_piece = captured_piece  # to にあった駒のコード (なければ EMPTY)
+        self.key = key  # 指す前の Zobrist キー
+
+    @property
+    def captured(self):
+        """取った駒の文字 (取らなければ None)"""
+        return None if self.captured_piece == EMPTY else chr(self.captured_piece)
+
+
+class Position:
+    """
+    盤面 (bytearray) と手番、両キングの位置、Zobrist キーをまとめたもの。
+    キングの位置とキーは make_move で差分更新するので、王手判定や
+    局面の識別のたびに盤面を走査し直すことはありません。
+    make_move / unmake_move で指す・戻すはどちらも O(1) です。
+    """
+
+    def __init__(self, board, side_to_move="white"):
+        self.board = board
+        self.side_to_move = side_to_move
+        self.king_squares = {
+            "white": get_king_square(board, "white"),
+            "black": get_king_square(board, "black"),
+        }
+        self.key = compute_key(board, side_to_move)
+
+    @classmethod
+    def from_dict(cls, board_dict, side_to_move="white"):
+        return cls(board_from_dict(board_dict), side_to_move)
+
+    @classmethod
+    def from_string(cls, text, side_to_move="white"):
+        return cls(board_from_string(text), side_to_move)
+
+    @classmethod
+    def initial(cls):
+        """Raumschach の初期局面 (白番)"""
+        return cls.from_dict(init_board_raumschach())
+
+    def copy(self):
+        position = Position.__new__(Position)
+        position.board = bytearray(self.board)
+        position.side_to_move = self.side_to_move
+        position.king_squares = dict(self.king_squares)
+        position.key = self.key
+        return position
+
+    def is_check(self, side=None):
+        """side (省略時は手番側) のキングが王手されているか"""
+        side = side or self.side_to_move
+        return is_check(self.board, side, self.king_squares[side])
+
+    def generate_all_moves(self):
+        """手番側の全合法手"""
+        return generate_all_moves(
+            self.board, self.side_to_move, self.king_squares[self.side_to_move]
+        )
+
+    def make_move(self, move):
+        """
+        move = (from_idx, to_idx, promotion) を盤面に適用して手番を交代する。
+        unmake_move に渡すと指す前に戻せる記録 (Undo) を返す。
+        """
+        from_idx, to_idx, promotion = move
+        board = self.board
+        target_piece = board[to_idx]
+        from_piece = moved_piece = board[from_idx]
+        if promotion:
+            moved_piece = ord(promotion)
+        undo = Undo(move, from_piece, target_piece, self.key)
+        board[to_idx] = moved_piece
+        board[from_idx] = EMPTY
+        self.key ^= (
+            ZOBRIST_PIECES[from_piece][from_idx]
+            ^ ZOBRIST_PIECES[target_piece][to_idx]
+            ^ ZOBRIST_PIECES[moved_piece][to_idx]
+            ^ ZOBRIST_BLACK_TO_MOVE
+        )
+
+        side = self.side_to_move
+        if self.king_squares[side] == from_idx:
+            self.king_squares[side] = to_idx
+        opponent = get_opponent_side(side)
+        if self.king_squares[opponent] == to_idx:
+            self.king_squares[opponent] = None
+        self.side_to_move = opponent
+        return undo
+
+    def unmake_move(self, undo):
+        """make_move の記録 undo を使って、その手を指す前の局面に戻す"""
+        from_idx, to_idx, _ = undo.move
+        board = self.board
+        board[from_idx] = undo.moved_piece
+        board[to_idx] = undo.captured_piece
+        self.key = undo.key
+
+        opponent = self.side_to_move
+        side = self.side_to_move = get_opponent_side(opponent)
+        if self.king_squares[side] == to_idx:
+            self.king_squares[side] = from_idx
+        if undo.captured_piece & 0xDF == KING:
+            self.king_squares[opponent] = to_idx
+
+    def apply_move(self, move):
+        """
+        move を指して手番を交代する (戻さないとき用)。
+        取った駒の文字を返す (取らなければ None)。
+        """
+        return self.make_move(move).captured
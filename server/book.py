@@ -0,0 +1,261 @@
+"""
+序盤の定跡ファイル (opening book) の作成と引き当て。
+
+初期配置はいつも同じなので、序盤の AI の手はどのゲームでも同じ探索の
+繰り返しになります。ここでは最初の数手の局面を前もって読んでおき、
+局面の Zobrist キーから最善手を引けるファイルにします。/get_move は
+探索の前にこのファイルを引き、載っていればその手を探索なしで返します。
+ただし AI の強さを変えないよう、依頼の深さ・持ち時間がその手を読んだときの
+深さ・かかった時間に届かなければ定跡は使わず探索します。
+
+    python book.py -o opening_book.bin --plies 3 --depth 3   # 作る
+    python book.py --show opening_book.bin                  # 中身の概要
+
+載せる局面: AI が白のときと黒のときのそれぞれで、AI の手番では定跡の手、
+相手の手番ではすべての合法手を辿って --plies 手目までに現れる AI の手番の局面。
+
+ファイルの形式 (ビッグエンディアン):
+
+    16 バイト  ヘッダ: "RAUMBK2\\0"・局面の数 (4 バイト)・plies (2)・depth (2)
+    20 バイト  × 局面の数: キー (8)・元のマス (1)・先のマス (1)・
+               昇格 (1, 0 なし / 1.. "QNURB" の順)・読んだ深さ (1)・評価値 (4)・
+               読むのにかかった時間 (4, ミリ秒)
+
+エントリはキーの順に並べてあり、引くときはファイルを mmap して二分探索するので、
+読み込みも、複数のプロセスで開いたときのメモリも局面の数によりません。
+"""
+import argparse
+import math
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from board import PROMOTION_PIECES, Position, move_to_squares
+from search import Searcher
+from transposition import TranspositionTable
+
+MAGIC = b"RAUMBK2\0"
+_HEADER = struct.Struct(">8sIHH")
+_ENTRY = struct.Struct(">QBBBBiI")
+
+DEFAULT_PLIES = 3
+DEFAULT_DEPTH = 3
+
+
+class BookEntry:
+    """
+    定跡の 1 局面分。move は (from_idx, to_idx, promotion)、
+    time_ms は depth まで読むのにかかった時間 (ミリ秒)
+    """
+
+    __slots__ = ("move", "score", "depth", "time_ms")
+
+    def __init__(self, move, score, depth, time_ms=0):
+        self.move = move
+        self.score = score
+        self.depth = depth
+        self.time_ms = time_ms
+
+
+def _encode_promotion(promotion):
+    return PROMOTION_PIECES["white"].index(promotion.upper()) + 1 if promotion else 0
+
+
+def _decode_promotion(code, side_to_move):
+    return PROMOTION_PIECES[side_to_move][code - 1] if code else None
+
+
+class OpeningBook:
+    """定跡ファイルを mmap で開いて引く。複数のスレッドから同時に引いてよい"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.plies, self.depth = _HEADER.unpack_from(self._data)
+        if magic != MAGIC or len(self._data) != _HEADER.size + self.count * _ENTRY.size:
+            self._data.close()
+            raise ValueError(f"Invalid opening book: {path}")
+
+    def __len__(self):
+        return self.count
+
+    def _entry(self, index):
+        return _ENTRY.unpack_from(self._data, _HEADER.size + index * _ENTRY.size)
+
+    def probe(self, position):
+        """position の定跡の BookEntry。載っていなければ None"""
+        key = position.key
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            entry_key = _ENTRY.unpack_from(self._data, _HEADER.size + mid * _ENTRY.size)[0]
+            if entry_key < key:
+                low = mid + 1
+            else:
+                high = mid
+        if low == self.count:
+            return None
+        entry_key, from_idx, to_idx, promotion, depth, score, time_ms = self._entry(low)
+        if entry_key != key:
+            return None
+        move = (from_idx, to_idx, _decode_promotion(promotion, position.side_to_move))
+        return BookEntry(move, score, depth, time_ms)
+
+    def close(self):
+        self._data.close()
+
+    def stats(self):
+        return {"path": self.path, "positions": self.count,
+                "plies": self.plies, "depth": self.depth}
+
+
+def open_book(path):
+    """path の定跡ファイルを開く。ファイルがなければ None"""
+    if not path or not os.path.exists(path):
+        return None
+    return OpeningBook(path)
+
+
+def write_book(path, entries, plies, depth):
+    """entries ({キー: BookEntry}) を path に書く (一時ファイルに書いてから置き換える)"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, len(entries), plies, depth))
+        for key in sorted(entries):
+            entry = entries[key]
+            from_idx, to_idx, promotion = entry.move
+            f.write(_ENTRY.pack(key, from_idx, to_idx, _encode_promotion(promotion),
+                                min(entry.depth, 255), entry.score,
+                                min(entry.time_ms, 0xFFFFFFFF)))
+    os.replace(tmp_path, path)
+
+
+# -----------------------------------
+# 作成
+# -----------------------------------
+
+# ワーカープロセス内の探索器 (_init_worker で作る)
+_worker_searcher = None
+
+
+def _init_worker(tt_mb):
+    global _worker_searcher
+    _worker_searcher = Searcher(TranspositionTable(tt_mb))
+
+
+def _search_position(board, side_to_move, depth, time_ms):
+    """
+    ワーカーで 1 局面を読む。
+    (キー, 最善手, 評価値, 読んだ深さ, かかった時間 (ミリ秒)) を返す
+    """
+    position = Position(bytearray(board), side_to_move)
+    result = _worker_searcher.search(position, time_ms=time_ms, max_depth=depth)
+    return (position.key, result.move, result.score, result.depth,
+            math.ceil(result.elapsed * 1000))
+
+
+def build_book(plies=DEFAULT_PLIES, depth=DEFAULT_DEPTH, time_ms=None, workers=None,
+               tt_mb=16, progress=None):
+    """
+    初期局面から plies 手目までの AI の手番の局面を読み、{キー: BookEntry} を返す。
+    1 手ごとに、その手数の局面をまとめて workers 個のプロセスで読む。
+    progress(手数, 読んだ局面の数) を渡すと 1 手ごとに呼ぶ。
+    """
+    workers = workers or os.cpu_count() or 1
+    entries = {}
+    # (局面, AI の側)。同じ局面・同じ AI の側は 1 度だけ辿る
+    frontier = [(Position.initial(), "white"), (Position.initial(), "black")]
+    seen = set()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(tt_mb,),
+    ) as executor:
+        for ply in range(plies):
+            to_search = {}
+            for position, ai_side in frontier:
+                if position.side_to_move == ai_side and position.key not in entries:
+                    to_search[position.key] = position
+            futures = [
+                executor.submit(_search_position, bytes(position.board),
+                                position.side_to_move, depth, time_ms)
+                for position in to_search.values()
+            ]
+            for future in futures:
+                key, move, score, searched_depth, elapsed_ms = future.result()
+                if move is not None:
+                    entries[key] = BookEntry(move, score, searched_depth, elapsed_ms)
+            if progress:
+                progress(ply, len(to_search))
+
+            next_frontier = []
+            for position, ai_side in frontier:
+                if position.side_to_move == ai_side:
+                    entry = entries.get(position.key)
+                    moves = [entry.move] if entry else []
+                else:
+                    moves = position.generate_all_moves()
+                for move in moves:
+                    child = position.copy()
+                    child.make_move(move)
+                    if (child.key, ai_side) not in seen:
+                        seen.add((child.key, ai_side))
+                        next_frontier.append((child, ai_side))
+            frontier = next_frontier
+    return entries
+
+
+def show_book(path):
+    book = OpeningBook(path)
+    print(f"{path}: {book.count} positions, plies {book.plies}, depth {book.depth}")
+    position = Position.initial()
+    entry = book.probe(position)
+    if entry is not None:
+        from_square, to_square, promotion = move_to_squares(entry.move)
+        print(f"initial: {from_square}-{to_square}{promotion or ''} "
+              f"(score {entry.score}, depth {entry.depth}, {entry.time_ms} ms)")
+    book.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-o", "--output", default="opening_book.bin")
+    parser.add_argument("--plies", type=int, default=DEFAULT_PLIES,
+                        help=f"何手目までの局面を載せるか (既定 {DEFAULT_PLIES})")
+    parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH,
+                        help=f"1 局面を読む深さ (既定 {DEFAULT_DEPTH})")
+    parser.add_argument("--time-ms", type=int,
+                        help="1 局面の持ち時間 (省略時は --depth まで読み切る)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--tt-mb", type=int, default=16,
+                        help="ワーカーごとの置換表の大きさ (MB)")
+    parser.add_argument("--show", metavar="FILE", help="定跡ファイルの概要を表示する")
+    args = parser.parse_args()
+
+    if args.show:
+        show_book(args.show)
+        return
+    if args.plies < 1 or args.depth < 1:
+        parser.error("--plies and --depth must be positive")
+
+    start = time.perf_counter()
+
+    def progress(ply, searched):
+        print(f"ply {ply + 1}: searched {searched} positions "
+              f"({time.perf_counter() - start:.1f} s)", file=sys.stderr)
+
+    entries = build_book(args.plies, args.depth, args.time_ms, args.workers,
+                         args.tt_mb, progress)
+    write_book(args.output, entries, args.plies, args.depth)
+    print(f"wrote {len(entries)} positions to {args.output} "
+          f"({os.path.getsize(args.output)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
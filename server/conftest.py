@@ -0,0 +1,24 @@
+"""
+server のテストで共有する設定と fixture。
+
+server.create_app は環境変数からストアなどを作るので、テストを集める前に
+一時ファイルの SQLite ストアとリクエストのスレッドで解析する設定にしておく。
+"""
+import os
+import tempfile
+
+import pytest
+
+_DB_DIR = tempfile.mkdtemp()
+os.environ["RAUM_STORE"] = "sqlite:" + os.path.join(_DB_DIR, "games.db")
+os.environ.setdefault("RAUM_ANALYSIS_WORKERS", "0")
+
+
+@pytest.fixture
+def client():
+    """ゲームが 1 つもないストアにつないだ Flask のテストクライアント"""
+    import server
+
+    app = server.create_app()
+    server.games.clear()
+    return app.test_client()
@@ -0,0 +1,94 @@
+"""
+詰み・ステイルメイト以外の引き分けの判定。
+
+  - "threefold_repetition":  同じ局面 (駒の配置と手番) が 3 回現れた
+  - "fifty_move_rule":       50 手 (両者あわせて 100 手) のあいだ、
+                             ポーンが動かず駒も取られなかった
+  - "insufficient_material": どちらも相手を詰ませられる駒が残っていない
+
+局面の出現回数・50 手ルールのカウンタ・キング以外の駒の数は DrawTracker が
+1 手ごとに差分で持つので、判定のたびに手の記録や盤面を調べ直すことはありません
+(駒が 1 枚以下になったときだけ盤面を見て駒の種類を確かめます)。
+"""
+from collections import Counter
+
+from board import BISHOP, EMPTY, KING, KNIGHT, PAWN, ROOK, UNICORN
+
+FIFTY_MOVE_PLIES = 100
+REPETITION_LIMIT = 3
+
+# キングとこのうちの 1 枚だけでは、裸のキングをどう並べても詰みの形にならない
+# (5x5x5 の盤ですべての配置を調べて確かめた)。クイーンとポーン (昇格する) は含まない
+_CANNOT_MATE_ALONE = (KNIGHT, BISHOP, UNICORN, ROOK)
+
+
+def insufficient_material(board):
+    """
+    どちらの側も詰ませられないか。裸のキング同士か、
+    裸のキングに対してキング + ナイト・ビショップ・ユニコーン・ルークの 1 枚だけ。
+    """
+    pieces = [piece for piece in board if piece != EMPTY and piece & 0xDF != KING]
+    if not pieces:
+        return True
+    if len(pieces) > 1:
+        return False
+    return pieces[0] & 0xDF in _CANNOT_MATE_ALONE
+
+
+def count_material(board):
+    """キング以外の駒の数"""
+    return sum(1 for piece in board if piece != EMPTY and piece & 0xDF != KING)
+
+
+class DrawTracker:
+    """
+    ゲームの局面キー (Position.key) の出現回数と、手数ごとの
+    50 手ルールのカウンタ・キング以外の駒の数。
+    手を指したら push、戻したら pop で、どちらも O(1) で更新する。
+    """
+
+    __slots__ = ("counts", "clocks", "material")
+
+    def __init__(self, position):
+        self.counts = Counter({position.key: 1})
+        self.clocks = [0]
+        self.material = [count_material(position.board)]
+
+    @property
+    def halfmove_clock(self):
+        return self.clocks[-1]
+
+    def push(self, key, moved_piece, captured_piece):
+        """
+        指した後の局面のキーを記録する。moved_piece / captured_piece は
+        board.Undo と同じく、動かした駒 (昇格前) と取った駒のコード
+        """
+        self.counts[key] += 1
+        captured = captured_piece != EMPTY
+        # ポーンを動かす手と駒を取る手は 50 手ルールのカウンタを 0 に戻す
+        if captured or moved_piece & 0xDF == PAWN:
+            self.clocks.append(0)
+        else:
+            self.clocks.append(self.clocks[-1] + 1)
+        self.material.append(self.material[-1] - captured)
+
+    def pop(self, key):
+        """push の取り消し。key は戻す手を指した後の局面のキー"""
+        self.counts[key] -= 1
+        if not self.counts[key]:
+            del self.counts[key]
+        self.clocks.pop()
+        self.material.pop()
+
+    def repetitions(self, key):
+        return self.counts[key]
+
+    def draw_reason(self, position):
+        """引き分けなら理由の文字列、そうでなければ None"""
+        if self.counts[position.key] >= REPETITION_LIMIT:
+            return "threefold_repetition"
+        if self.clocks[-1] >= FIFTY_MOVE_PLIES:
+            return "fifty_move_rule"
+        if self.material[-1] <= 1 and insufficient_material(position.board):
+            return "insufficient_material"
+        return None
@@ -0,0 +1,82 @@
+"""
+API レスポンスでの盤面の表し方。
+
+これまでのレスポンスは盤面を "Aa1" キーの 125 要素の dict で返していて、
+1 手ごとに 2KB 近い JSON を組み立てて送っていました。
+body に "format" を付けると、盤面の表し方を選べます。
+
+  - "json" (既定):  これまでどおり {"Aa1": "R", ...} の dict
+  - "compact":      マス番号順 (Aa1, Aa2, ..., Ee5) に並べた 125 文字の文字列。
+                    取った駒も "white": "pn" のように文字列にする
+
+さらに "since_ply" を付けると、盤面の代わりにその手数より後の
+指し手の差分 (moves) だけを返します (クライアントが手元の盤面に当てる)。
+
+GET /games/<game_id>/state?format=binary は次の形のバイト列を返します。
+
+    1 バイト   手番 (0: 白, 1: 黒)
+    2 バイト   手数 (ply, ビッグエンディアン)
+    125 バイト 盤面 (マス番号順の駒の文字の ASCII コード)
+"""
+import struct
+
+from board import NUM_SQUARES, board_to_dict, board_to_string
+
+FORMATS = ("json", "compact")
+
+_STATE_HEADER = struct.Struct(">BH")
+STATE_BYTES = _STATE_HEADER.size + NUM_SQUARES
+
+
+def parse_format(data):
+    """body から (format, since_ply) を取り出す。不正なら ValueError"""
+    fmt = data.get("format", "json")
+    if fmt not in FORMATS:
+        raise ValueError("Invalid format")
+    since_ply = data.get("since_ply")
+    if since_ply is not None and (
+        isinstance(since_ply, bool) or not isinstance(since_ply, int) or since_ply < 0
+    ):
+        raise ValueError("Invalid since_ply")
+    return fmt, since_ply
+
+
+def encode_board(board, fmt):
+    if fmt == "compact":
+        return board_to_string(board)
+    return board_to_dict(board)
+
+
+def encode_captured(captured_pieces, fmt):
+    if fmt == "compact":
+        return {side: "".join(pieces) for side, pieces in captured_pieces.items()}
+    return {side: list(pieces) for side, pieces in captured_pieces.items()}
+
+
+def encode_state(position, captured_pieces, ply, moves, fmt="json", since_ply=None):
+    """
+    レスポンスの盤面の部分 (board / side_to_move / captured_pieces / ply) の dict。
+    since_ply が手元の手数以下なら、board と captured_pieces の代わりに
+    その後の指し手の差分 moves (record_move の dict のリスト) を入れる。
+    """
+    state = {"side_to_move": position.side_to_move, "ply": ply}
+    if since_ply is not None and since_ply <= ply:
+        state["moves"] = moves[since_ply:]
+    else:
+        state["board"] = encode_board(position.board, fmt)
+        state["captured_pieces"] = encode_captured(captured_pieces, fmt)
+    return state
+
+
+def pack_state(position, ply):
+    """局面を STATE_BYTES バイトに詰める"""
+    side = 0 if position.side_to_move == "white" else 1
+    return _STATE_HEADER.pack(side, ply & 0xFFFF) + bytes(position.board)
+
+
+def unpack_state(data):
+    """pack_state の逆。(盤面の bytearray, 手番, 手数) を返す"""
+    if len(data) != STATE_BYTES:
+        raise ValueError(f"Invalid state length: {len(data)}")
+    side, ply = _STATE_HEADER.unpack_from(data)
+    return bytearray(data[_STATE_HEADER.size:]), ("white", "black")[side], ply
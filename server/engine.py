@@ -0,0 +1,186 @@
+"""
+AI の手の選択と終局の判定。
+
+server.py (/get_move・/apply_move) と selfplay.py (自己対局) の両方がここを通るので、
+API と自己対局で同じ AI・同じ終局判定になります。import しただけでは
+スレッドもプロセスも作りません。定跡・tablebase・置換表・並列探索は
+Engine を作る側が渡します (どれも省略できます)。
+
+    from engine import Engine
+    engine = Engine(tt=TranspositionTable(32))
+    move, search_info = engine.choose_ai_move(position, "search", time_ms=200)
+    state = engine.check_gameend(position, tracker)
+"""
+import os
+import random
+import time
+
+from metrics import Registry
+from movecache import MoveCache
+from search import MATE_SCORE, Searcher
+from tablebase import Tablebase
+
+# /get_move の body で受け取る探索の設定:
+#   "engine":  "search" (既定, 反復深化 alpha-beta) or "random" (ランダムに 1 手)
+#   "time_ms": 1 手の持ち時間 (ミリ秒, 既定 DEFAULT_AI_TIME_MS, 上限 MAX_AI_TIME_MS)
+#   "depth":   読む深さの上限 (省略時は持ち時間いっぱいまで)
+# 持ち時間と深さを変えることで AI の強さ (難易度) を調整できる。
+AI_ENGINES = ("search", "random")
+DEFAULT_AI_TIME_MS = 500
+MAX_AI_TIME_MS = 10000
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def default_book_path():
+    """定跡ファイル。環境変数 RAUM_OPENING_BOOK (既定はこのディレクトリの opening_book.bin)"""
+    return os.environ.get("RAUM_OPENING_BOOK", os.path.join(_HERE, "opening_book.bin"))
+
+
+def default_tablebase_dir():
+    """tablebase のディレクトリ。環境変数 RAUM_TABLEBASE_DIR (既定はこのディレクトリの tablebases)"""
+    return os.environ.get("RAUM_TABLEBASE_DIR", os.path.join(_HERE, "tablebases"))
+
+
+def parse_ai_options(data):
+    """/get_move の body から (engine, time_ms, depth) を取り出す。不正なら ValueError"""
+    engine = data.get("engine", "search")
+    if engine not in AI_ENGINES:
+        raise ValueError("Invalid engine")
+    time_ms = data.get("time_ms", DEFAULT_AI_TIME_MS)
+    if isinstance(time_ms, bool) or not isinstance(time_ms, (int, float)) or time_ms <= 0:
+        raise ValueError("Invalid time_ms")
+    depth = data.get("depth")
+    if depth is not None and (isinstance(depth, bool) or not isinstance(depth, int) or depth < 1):
+        raise ValueError("Invalid depth")
+    return engine, min(time_ms, MAX_AI_TIME_MS), depth
+
+
+class Engine:
+    """
+    AI の手を選び、終局を判定する。
+
+      - move_cache:        合法手のキャッシュ (movecache.MoveCache。省略時は専用のもの)
+      - opening_book:      序盤の定跡 (book.OpeningBook)。None なら使わない
+      - tablebase:         終盤の tablebase (tablebase.Tablebase)。省略時はキングだけの
+                           局面だけを引き分けと判定する
+      - tt:                searcher を渡されなかったときの探索で使う置換表
+      - parallel_searcher: 渡すと、searcher の代わりにいつもこれで読む (parallel.py)
+      - metrics:           ノード数・定跡/tablebase の利用数・思考時間を記録する
+                           metrics.Registry (省略時はどこにも出さない)
+    """
+
+    def __init__(self, move_cache=None, opening_book=None, tablebase=None, tt=None,
+                 parallel_searcher=None, metrics=None):
+        self.move_cache = move_cache if move_cache is not None else MoveCache()
+        self.opening_book = opening_book
+        self.tablebase = tablebase if tablebase is not None else Tablebase(None)
+        self.tt = tt
+        self.parallel_searcher = parallel_searcher
+        metrics = metrics if metrics is not None else Registry()
+        self.nodes = metrics.counter("raum_ai_nodes_total", "Nodes searched by the AI",
+                                     ("engine",))
+        self.book_hits = metrics.counter("raum_ai_book_hits_total",
+                                         "AI moves taken from the opening book")
+        self.tablebase_hits = metrics.counter("raum_ai_tablebase_hits_total",
+                                              "AI moves taken from the endgame tablebase")
+        self.move_seconds = metrics.histogram(
+            "raum_ai_move_duration_seconds", "Time spent choosing an AI move", ("engine",),
+        )
+
+    def choose_random_move(self, position):
+        """手番側の全合法手からランダムに 1手選ぶ。なければ None"""
+        moves = self.move_cache.legal_moves(position)
+        if not moves:
+            return None
+        return random.choice(moves)
+
+    def probe_book(self, position, depth=None, time_ms=None):
+        """
+        定跡に position が載っていれば (move, 探索情報) を、なければ None を返す。
+        depth (読む深さの上限) が定跡を作ったときの深さより浅いか、time_ms (持ち時間) が
+        定跡の手を読むのにかかった時間より短ければ、AI の強さを変えないよう定跡は使わない。
+        キーの衝突に備え、定跡の手が合法手かどうかも確かめる。
+        """
+        if self.opening_book is None:
+            return None
+        entry = self.opening_book.probe(position)
+        if entry is None or (depth is not None and depth < entry.depth) \
+                or (time_ms is not None and time_ms < entry.time_ms):
+            return None
+        if entry.move not in self.move_cache.legal_moves(position):
+            return None
+        self.book_hits.inc()
+        return entry.move, {"score": entry.score, "depth": entry.depth, "nodes": 0,
+                            "time_ms": 0.0, "nps": 0, "book": True}
+
+    def probe_tablebase(self, position):
+        """
+        tablebase に position が載っていれば (move, 探索情報) を、なければ None を返す。
+        勝ちなら一番早く詰む手、負けなら一番長く粘る手を選ぶ。
+        評価値は探索と同じく、詰みまでの手数 (ply) を MATE_SCORE から引いたもの。
+        """
+        if not self.tablebase:
+            return None
+        found = self.tablebase.best_move(position)
+        if found is None:
+            return None
+        move, result = found
+        if result.wdl == "win":
+            score = MATE_SCORE - result.dtm
+        elif result.wdl == "loss":
+            score = -MATE_SCORE + result.dtm
+        else:
+            score = 0
+        self.tablebase_hits.inc()
+        return move, {"score": score, "depth": 0, "nodes": 0, "time_ms": 0.0, "nps": 0,
+                      "tablebase": result.to_dict()}
+
+    def choose_ai_move(self, position, engine="search", time_ms=DEFAULT_AI_TIME_MS, depth=None,
+                       searcher=None):
+        """
+        手番側の AI の手を選ぶ。(move, 探索情報) を返す。
+        合法手がなければ move は None、engine="random" なら探索情報は None。
+        searcher を渡すと、そのゲームの前の探索の結果を引き継いで読む
+        (parallel_searcher があればワーカープロセスで、各ワーカーの置換表を使って読む)。
+        定跡や終盤の tablebase に載っている局面では読まずにその手を返す。
+        """
+        started = time.perf_counter()
+        if engine == "random":
+            move = self.choose_random_move(position)
+            self.move_seconds.observe(time.perf_counter() - started, engine=engine)
+            return move, None
+        known_move = self.probe_tablebase(position) or self.probe_book(position, depth, time_ms)
+        if known_move is not None:
+            self.move_seconds.observe(time.perf_counter() - started, engine=engine)
+            return known_move
+        if self.parallel_searcher is not None:
+            searcher = self.parallel_searcher
+        elif searcher is None:
+            searcher = Searcher(self.tt)
+        result = searcher.search(position, time_ms=time_ms, max_depth=depth)
+        self.move_seconds.observe(time.perf_counter() - started, engine=engine)
+        self.nodes.inc(result.nodes, engine=engine)
+        return result.move, result.to_dict()
+
+    def is_dead(self, position):
+        """tablebase でどちらも詰ませようのない駒の組み合わせと分かるか"""
+        return self.tablebase.is_dead(position)
+
+    def check_gameend(self, position, tracker=None):
+        """
+        "checkmate" / "stalemate" / "continue" のどれか。tracker (draws.DrawTracker) を
+        渡すと、引き分けなら "threefold_repetition" などその理由を返す。
+        tablebase でどちらも詰ませようのない駒の組み合わせと分かれば "insufficient_material"
+        """
+        is_checking = position.is_check()
+        moves = self.move_cache.legal_moves(position)
+
+        if is_checking and not moves:
+            return "checkmate"
+        elif not is_checking and not moves:
+            return "stalemate"
+        reason = tracker.draw_reason(position) if tracker is not None else None
+        if reason is None and self.is_dead(position):
+            reason = "insufficient_material"
+        return reason or "continue"
@@ -0,0 +1,167 @@
+"""
+ゲームごとの指し手のプッシュ配信 (Server-Sent Events)。
+
+クライアントは GET /games/<game_id>/events を開いたままにしておくと、
+人の手・AI の手が指されるたびに、盤面全体ではなくその 1 手の差分
+(delta) を受け取ります。
+
+    id: 3
+    event: move
+    data: {"ply": 3, "from": "Ac2", "to": "Ac3", "promotion": null, ...}
+
+イベントの種類:
+  - "move":  1 手指された (data は record_move の差分)
+  - "undo":  1 手戻された (data の ply は戻した後の手数、undone は戻した手の差分)
+  - "reset": 取りこぼしを送り直せないので、盤面を取り直してほしい
+
+id はゲームごとに 1 から振る通し番号です (待ったで手数が戻っても
+番号は戻りません)。接続が切れたクライアントが Last-Event-ID を付けて
+繋ぎ直すと、直近 history 件までは取りこぼしたイベントから送り直し、
+それより古ければ "reset" を送ります。
+"""
+import json
+import queue
+import threading
+from collections import deque
+
+# 購読者ごとの未送信イベントの上限。溢れた購読者は切断する
+# (クライアントは Last-Event-ID で繋ぎ直して追いつく)
+MAX_PENDING_EVENTS = 256
+
+# 接続を保つためのコメントを送る間隔 (秒)
+KEEPALIVE_SECONDS = 15
+
+# 購読を終わらせる印
+_CLOSE = object()
+
+
+def format_event(event_type, data, event_id=None):
+    """1 件の SSE メッセージの文字列"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append("data: " + json.dumps(data, separators=(",", ":")))
+    return "\n".join(lines) + "\n\n"
+
+
+class Subscription:
+    __slots__ = ("game_id", "queue")
+
+    def __init__(self, game_id):
+        self.game_id = game_id
+        self.queue = queue.Queue(MAX_PENDING_EVENTS)
+
+    def _put(self, item):
+        """入らなければ False"""
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            return False
+
+    def stream(self, keepalive=KEEPALIVE_SECONDS):
+        """SSE の文字列を順に返すジェネレータ。閉じられるまで続く"""
+        yield ": connected\n\n"
+        while True:
+            try:
+                item = self.queue.get(timeout=keepalive)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            if item is _CLOSE:
+                return
+            yield item
+
+
+class EventBroker:
+    """
+    game_id ごとの購読者に指し手の差分を配る。
+    各ゲームの直近 history 件のイベントを覚えておき、繋ぎ直しに使う。
+    """
+
+    def __init__(self, history=64):
+        self.history = history
+        self._subscribers = {}  # game_id → [Subscription]
+        self._recent = {}  # game_id → deque[(イベント番号, SSE 文字列)]
+        self._last_id = {}  # game_id → 最後に振ったイベント番号
+        self._lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0  # 溢れて切断した購読者の数
+
+    def subscribe(self, game_id, last_event_id=None):
+        """
+        購読を始める。last_event_id を渡すと、それより後のイベントを先に積んでおく
+        (覚えている範囲より前なら "reset" を積む)。
+        """
+        subscription = Subscription(game_id)
+        with self._lock:
+            if last_event_id is not None:
+                recent = self._recent.get(game_id, ())
+                last_id = self._last_id.get(game_id, 0)
+                oldest = recent[0][0] if recent else last_id + 1
+                if last_event_id < oldest - 1 or last_event_id > last_id:
+                    subscription._put(format_event("reset", {}))
+                else:
+                    for event_id, message in recent:
+                        if event_id > last_event_id:
+                            subscription._put(message)
+            self._subscribers.setdefault(game_id, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.game_id)
+            if subscribers and subscription in subscribers:
+                subscribers.remove(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.game_id]
+
+    def publish(self, game_id, data, event_type="move"):
+        """イベントに番号を振って、そのゲームの購読者全員に送る。番号を返す"""
+        with self._lock:
+            event_id = self._last_id.get(game_id, 0) + 1
+            self._last_id[game_id] = event_id
+            message = format_event(event_type, data, event_id)
+            recent = self._recent.get(game_id)
+            if recent is None:
+                recent = self._recent[game_id] = deque(maxlen=self.history)
+            recent.append((event_id, message))
+            self.published += 1
+            for subscription in list(self._subscribers.get(game_id, ())):
+                if not subscription._put(message):
+                    self._drop(subscription)
+            return event_id
+
+    def _drop(self, subscription):
+        self._subscribers[subscription.game_id].remove(subscription)
+        if not self._subscribers[subscription.game_id]:
+            del self._subscribers[subscription.game_id]
+        self._close(subscription)
+        self.dropped += 1
+
+    @staticmethod
+    def _close(subscription):
+        # キューが一杯でも終わりの印が入るよう、未送信のイベントは捨てる
+        while not subscription._put(_CLOSE):
+            try:
+                subscription.queue.get_nowait()
+            except queue.Empty:
+                pass
+
+    def close_game(self, game_id):
+        """ゲームがなくなったとき、購読者の接続を閉じて履歴を捨てる"""
+        with self._lock:
+            self._recent.pop(game_id, None)
+            self._last_id.pop(game_id, None)
+            for subscription in self._subscribers.pop(game_id, ()):
+                self._close(subscription)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "games": len(self._subscribers),
+                "subscribers": sum(len(s) for s in self._subscribers.values()),
+                "published": self.published,
+                "dropped": self.dropped,
+            }
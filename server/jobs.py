@@ -0,0 +1,154 @@
+"""
+AI の手をバックグラウンドで計算するジョブ。
+
+/get_move は AI の手を読み終えるまでレスポンスを返さないので、
+持ち時間の間ずっとリクエストのスレッドを塞いでいました。
+ジョブにすると、受け付けたらすぐに job_id を返し、計算はスレッドプールで行い、
+クライアントは GET /jobs/<job_id> で結果を取りに来ます (wait を付けると
+終わるまでその秒数だけ待つ long-poll になります)。
+
+ジョブの状態:
+  - "pending": 受け付けてまだ始まっていない
+  - "running": 計算中
+  - "done":    終わった (result に結果)
+  - "failed":  失敗した (error に理由)
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobError(Exception):
+    """ジョブの関数が投げると、そのメッセージを error にして failed で終わる"""
+
+
+class Job:
+    __slots__ = ("id", "game_id", "status", "result", "error",
+                 "created", "finished", "_event")
+
+    def __init__(self, game_id):
+        self.id = str(uuid.uuid4())
+        self.game_id = game_id
+        self.status = PENDING
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self._event = threading.Event()
+
+    @property
+    def is_finished(self):
+        return self.status in (DONE, FAILED)
+
+    def wait(self, timeout=None):
+        """終わるまで最大 timeout 秒待つ。終わっていれば True"""
+        return self._event.wait(timeout)
+
+    def to_dict(self):
+        data = {"job_id": self.id, "game_id": self.game_id, "status": self.status}
+        if self.status == DONE:
+            data["result"] = self.result
+        elif self.status == FAILED:
+            data["error"] = self.error
+        return data
+
+
+class JobManager:
+    """
+    ジョブをスレッドプールで実行し、job_id で引けるようにする。
+    1 つのゲームで同時に動くジョブは 1 つまで。
+    終わったジョブは keep_seconds 秒だけ結果を残し、新しいジョブを
+    受け付けるときに古いものから消す。
+    """
+
+    def __init__(self, max_workers=4, keep_seconds=300):
+        self.keep_seconds = keep_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="ai-job")
+        self._jobs = OrderedDict()  # job_id → Job (受け付けた順)
+        self._active = {}  # game_id → 終わっていない Job
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def submit(self, game_id, fn):
+        """
+        fn() をバックグラウンドで実行するジョブを作る。fn の戻り値が result になる。
+        (job, created) を返し、そのゲームのジョブが動いていれば
+        新しく作らずにそのジョブと False を返す。
+        """
+        with self._lock:
+            self._purge()
+            active = self._active.get(game_id)
+            if active is not None:
+                return active, False
+            job = Job(game_id)
+            self._jobs[job.id] = job
+            self._active[game_id] = job
+            self.submitted += 1
+        self._executor.submit(self._run, job, fn)
+        return job, True
+
+    def _run(self, job, fn):
+        job.status = RUNNING
+        try:
+            job.result = fn()
+            job.status = DONE
+        except JobError as e:
+            job.error = str(e)
+            job.status = FAILED
+        except Exception as e:  # ワーカースレッドを巻き込んで落とさない
+            job.error = f"{type(e).__name__}: {e}"
+            job.status = FAILED
+        job.finished = time.time()
+        with self._lock:
+            if self._active.get(job.game_id) is job:
+                del self._active[job.game_id]
+            if job.status == DONE:
+                self.completed += 1
+            else:
+                self.failed += 1
+        job._event.set()
+
+    def active_job(self, game_id):
+        """そのゲームで終わっていないジョブ。なければ None"""
+        with self._lock:
+            return self._active.get(game_id)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _purge(self):
+        # 受け付けた順に並んでいるので、先頭から期限切れのものを消す
+        limit = time.time() - self.keep_seconds
+        for job_id in list(self._jobs):
+            job = self._jobs[job_id]
+            if job.created >= limit:
+                break
+            if job.is_finished and job.finished < limit:
+                del self._jobs[job_id]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "jobs": len(self._jobs),
+                "active": len(self._active),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+            }
@@ -0,0 +1,104 @@
+"""
+局面ごとの合法手リストの LRU キャッシュ。
+
+/possible_moves はクリックのたびに、/apply_move は指し手の検証に、
+check_gameend は相手番の詰み判定に、同じ局面の合法手を生成し直していました。
+ここでは Position.key (Zobrist キー、手番込み) をキーにして
+合法手リストを保持し、これらのエンドポイントで共有します。
+
+キーが衝突しても誤った手を返さないよう、エントリには盤面のコピーも
+持たせておき、ヒット時に盤面が一致するかを確かめます。
+"""
+import sys
+import threading
+from collections import OrderedDict
+
+# 1 エントリあたりの見積もりに使う固定部分 (OrderedDict のノードとキー、
+# エントリのタプル、盤面 bytes のヘッダ) のおおよそのバイト数
+_ENTRY_OVERHEAD = 200
+_MOVE_SIZE = sys.getsizeof((0, 0, None))
+
+
+def estimate_entry_size(board, moves):
+    """エントリ 1 つのおおよそのメモリ使用量 (バイト)"""
+    return _ENTRY_OVERHEAD + len(board) + sys.getsizeof(moves) + len(moves) * _MOVE_SIZE
+
+
+class MoveCache:
+    """
+    合法手リストの LRU キャッシュ。エントリ数 (max_entries) と
+    見積もりメモリ量 (max_bytes) のどちらかを超えたら古いものから捨てる。
+    複数スレッドから呼ばれても壊れないよう、操作はロックで守る。
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key → (board bytes, moves, size)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, position):
+        """キャッシュにあれば合法手のタプルを、なければ None を返す"""
+        with self._lock:
+            entry = self._entries.get(position.key)
+            if entry is not None and entry[0] == position.board:
+                self._entries.move_to_end(position.key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, position, moves):
+        """合法手を登録する。登録したタプルを返す"""
+        moves = tuple(moves)
+        board = bytes(position.board)
+        size = estimate_entry_size(board, moves)
+        with self._lock:
+            old = self._entries.pop(position.key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self._entries[position.key] = (board, moves, size)
+            self.bytes += size
+            while self._entries and (
+                len(self._entries) > self.max_entries or self.bytes > self.max_bytes
+            ):
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+        return moves
+
+    def legal_moves(self, position):
+        """
+        position の手番側の合法手をタプルで返す。キャッシュになければ生成して登録する。
+        返したタプルは他のリクエストと共有されるので書き換えないこと。
+        """
+        moves = self.get(position)
+        if moves is None:
+            moves = self.put(position, position.generate_all_moves())
+        return moves
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,164 @@
+"""
+AI 探索の並列化 (ルート分割)。
+
+Flask のリクエストスレッドで探索すると、GIL のせいで 1 つの重い AI の手番が
+他のリクエストをすべて待たせます。ここではルートの合法手をワーカー
+プロセスの数に分け、各プロセスが自分の担当の手だけを同じ持ち時間で
+反復深化して、全員が読み切った一番深い深さの結果から最善手を選びます。
+
+  - ワーカーはプロセスごとに置換表を 1 つ持ち、探索をまたいで使い回す
+  - 持ち時間が切れると各ワーカーの探索は自分で打ち切られる。
+    まだ始まっていない分担はキャンセルし、返ってこないワーカーは待たない
+  - 返ってこなかった分担・落ちたワーカーの分担・深さ 1 も読み切れなかった
+    分担は、ほかのワーカーが読み切った深さまでこのプロセスで読み直す。
+    どのルートの手も読まずに捨てることはない
+"""
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from board import EMPTY, Position
+from search import Searcher, SearchResult, piece_value
+from transposition import TranspositionTable
+
+# 持ち時間を過ぎてからワーカーの結果を待つ猶予 (秒)
+RESULT_GRACE_SECONDS = 0.5
+
+# ワーカープロセス内の探索器 (_init_worker で作る)
+_worker_searcher = None
+
+
+def _init_worker(tt_mb):
+    global _worker_searcher
+    _worker_searcher = Searcher(TranspositionTable(tt_mb))
+
+
+def _search_subset(board, side_to_move, root_moves, deadline, max_depth):
+    """
+    ワーカーで root_moves だけを読む。deadline は time.time() の絶対時刻
+    (None なら max_depth まで読む)。(深さごとの結果, ノード数) を返す。
+    """
+    position = Position(bytearray(board), side_to_move)
+    time_ms = None
+    if deadline is not None:
+        time_ms = max(1.0, (deadline - time.time()) * 1000)
+    result = _worker_searcher.search(position, time_ms, max_depth, root_moves)
+    return result.iterations, result.nodes
+
+
+def split_root_moves(board, moves, parts):
+    """
+    ルートの手を parts 個に分ける。取る手を価値の高い順に並べてから
+    順番に配るので、有望な手が 1 つのワーカーに偏らない。
+    """
+    ordered = sorted(
+        moves,
+        key=lambda move: piece_value(board[move[1]]) if board[move[1]] != EMPTY else 0,
+        reverse=True,
+    )
+    chunks = [ordered[i::parts] for i in range(parts)]
+    return [chunk for chunk in chunks if chunk]
+
+
+def combine_results(results):
+    """
+    各ワーカーの (深さごとの結果, ノード数) から、全員が読み切った
+    一番深い深さで点数が最も高い手を選ぶ。(move, score, depth, nodes) を返す。
+    1 つも深さを読み切っていない分担があれば、その手を比べられないので move は None。
+    """
+    nodes = sum(n for _, n in results)
+    if not results or not all(iterations for iterations, _ in results):
+        return None, 0, 0, nodes
+    depth = min(iterations[-1][0] for iterations, _ in results)
+    best = max(
+        (iterations[depth - 1] for iterations, _ in results),
+        key=lambda iteration: iteration[2],
+    )
+    return best[1], best[2], depth, nodes
+
+
+class ParallelSearcher:
+    """
+    ワーカープロセスのプールでルート分割探索を行う。Searcher と同じく
+    search(position, time_ms, max_depth) で SearchResult を返す。
+    プールは最初の探索で作り、shutdown で止める。
+    tt (TranspositionTable) を渡すと、ワーカーの結果がなくこのプロセスで読むときに使う。
+    """
+
+    def __init__(self, workers, tt_mb=16, tt=None):
+        self.workers = workers
+        self.tt_mb = tt_mb
+        self.tt = tt
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Flask のスレッドを抱えたまま fork しないよう spawn で起動する
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.tt_mb,),
+                )
+            return self._executor
+
+    def shutdown(self, wait=False):
+        """プールを止める。wait ならワーカープロセスが終わるまで待つ"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait, cancel_futures=True)
+                self._executor = None
+
+    def search(self, position, time_ms=None, max_depth=None):
+        start = time.perf_counter()
+        moves = position.generate_all_moves()
+        if not moves:
+            return SearchResult(None, 0, 0, 0, time.perf_counter() - start)
+
+        deadline = None if time_ms is None else time.time() + time_ms / 1000
+        board = bytes(position.board)
+        chunks = split_root_moves(board, moves, self.workers)
+        results = [None] * len(chunks)
+        broken = False
+        try:
+            executor = self._get_executor()
+            futures = [
+                executor.submit(_search_subset, board, position.side_to_move,
+                                chunk, deadline, max_depth)
+                for chunk in chunks
+            ]
+        except BrokenProcessPool:
+            futures, broken = [], True
+
+        if futures:
+            timeout = None if time_ms is None else time_ms / 1000 + RESULT_GRACE_SECONDS
+            done, not_done = wait(futures, timeout=timeout)
+            for future in not_done:
+                future.cancel()
+            for i, future in enumerate(futures):
+                if future not in done or future.cancelled():
+                    continue
+                error = future.exception()
+                if error is None:
+                    results[i] = future.result()
+                elif isinstance(error, BrokenProcessPool):
+                    broken = True
+        if broken:
+            # ワーカーが落ちていたらプールを捨て、次の探索で作り直す
+            self.shutdown()
+
+        # 結果のない分担は、ほかのワーカーが読み切った深さ (なければ 1) まで
+        # このプロセスで読む。深さで止めるので必ず読み切った結果が返る
+        depth = min((r[0][-1][0] for r in results if r is not None and r[0]), default=1)
+        for i, chunk in enumerate(chunks):
+            if results[i] is None or not results[i][0]:
+                nodes = results[i][1] if results[i] is not None else 0
+                result = Searcher(self.tt).search(position, None, depth, chunk)
+                results[i] = (result.iterations, nodes + result.nodes)
+
+        move, score, depth, nodes = combine_results(results)
+        return SearchResult(move, score, depth, nodes, time.perf_counter() - start)
@@ -0,0 +1,272 @@
+"""
+指し手生成の perft (ノード数計測) と検証ツール。
+
+    python perft.py                 # 初期配置で depth 1..3 のノード数と nodes/s
+    python perft.py -d 4 --divide   # 初手ごとの内訳 (divide) を表示
+    python perft.py --suite         # 保存局面のノード数を期待値と照合
+    python perft.py --compare 500   # 速い生成器と参照実装、Zobrist キーの差分更新を検算
+    python perft.py --reference     # 参照実装 (1 手ずつ動かす版) で数える
+    python perft.py --bitboard      # ビットボードの局面 (bitboard.py) で数える
+
+--suite / --compare は食い違いがあれば終了コード 1 で終わるので、
+生成器を書き換えたときの回帰チェックに使えます。
+"""
+import argparse
+import random
+import sys
+import time
+
+from bitboard import BitboardPosition
+from board import (
+    EMPTY,
+    NUM_SQUARES,
+    Position,
+    board_to_string,
+    compute_key,
+    generate_all_moves,
+    generate_all_moves_reference,
+    is_check,
+    move_to_squares,
+)
+
+RANDOM_PIECES = "PNBRUQ"
+
+# 保存局面: (名前, 125 文字の盤面, 手番, {depth: ノード数})
+# 盤面はマス番号順 (board.board_to_string)。
+# ノード数は generate_all_moves と generate_all_moves_reference の両方で確認済み。
+PERFT_POSITIONS = [
+    (
+        "initial",
+        "RNKNRPPPPP...............BUQBUPPPPP..............."
+        "........................................pppppbuqbu"
+        "...............ppppprnknr",
+        "white",
+        {1: 61, 2: 3608, 3: 236510},
+    ),
+    (
+        "opening",
+        "RNKNRPqPPP...............B..BUPPPPPb.............."
+        "...................................Q..p.ppp.p.u.Uu"
+        "................ppp.rnknr",
+        "white",
+        {1: 1, 2: 62, 3: 4797},
+    ),
+    (
+        "middlegame",
+        "RN.N.P.PPP...............B....PPPPP..........n...."
+        ".....U.K........p..p..b......R..........p.pp.bu.Bu"
+        ".....p........prUpp..k.nr",
+        "white",
+        {1: 76, 2: 4460, 3: 298744},
+    ),
+    (
+        "endgame",
+        ".n.NRPP.Pu..P.....uQ......K..U.P..P..............."
+        "......pP.....P....p....B................R....b...."
+        "..............Bpppppr.kqr",
+        "white",
+        {1: 90, 2: 4745, 3: 409886},
+    ),
+    (
+        "pins_promotion",
+        "KU....................b.p.......N........p........"
+        "....r.......R.........................P.......P..."
+        "............k..........nq",
+        "white",
+        {1: 31, 2: 445, 3: 14709},
+    ),
+    (
+        "double_check",
+        "KU......................p.....b.N........p........"
+        "r...........R..............................P..P..."
+        "............k..........nq",
+        "white",
+        {1: 3, 2: 39, 3: 1642},
+    ),
+]
+
+
+def perft(position, depth, generate=None):
+    """
+    depth 手先までの葉の数 (最後の 1 手は生成した手の数で数える)。
+    generate を省略すると position.generate_all_moves で生成する
+    """
+    if generate is None:
+        moves = position.generate_all_moves()
+    else:
+        moves = generate(position.board, position.side_to_move)
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+    nodes = 0
+    for move in moves:
+        undo = position.make_move(move)
+        nodes += perft(position, depth - 1, generate)
+        position.unmake_move(undo)
+    return nodes
+
+
+def divide(position, depth, generate=None):
+    """初手ごとの perft(depth - 1) を [(move, nodes), ...] で返す"""
+    if generate is None:
+        moves = position.generate_all_moves()
+    else:
+        moves = generate(position.board, position.side_to_move)
+    result = []
+    for move in moves:
+        undo = position.make_move(move)
+        result.append((move, perft(position, depth - 1, generate)))
+        position.unmake_move(undo)
+    return result
+
+
+def format_move(move):
+    from_sq, to_sq, promotion = move_to_squares(move)
+    return f"{from_sq}{to_sq}{promotion or ''}"
+
+
+def run_perft(position, max_depth, show_divide, generate):
+    for depth in range(1, max_depth + 1):
+        start = time.perf_counter()
+        if show_divide and depth == max_depth:
+            rows = divide(position, depth, generate)
+            for move, nodes in rows:
+                print(f"  {format_move(move):8s} {nodes}")
+            nodes = sum(n for _, n in rows)
+        else:
+            nodes = perft(position, depth, generate)
+        elapsed = time.perf_counter() - start
+        nps = nodes / elapsed if elapsed > 0 else float("inf")
+        print(f"depth {depth}: {nodes:12d} nodes {elapsed:8.3f} s {nps:12.0f} nodes/s")
+
+
+def run_suite(max_depth, generate, position_class=Position):
+    ok = True
+    total_nodes = 0
+    start = time.perf_counter()
+    for name, text, side_to_move, expected in PERFT_POSITIONS:
+        position = position_class.from_string(text, side_to_move)
+        for depth, nodes in sorted(expected.items()):
+            if depth > max_depth:
+                continue
+            got = perft(position, depth, generate)
+            total_nodes += got
+            status = "ok" if got == nodes else f"FAIL (expected {nodes})"
+            ok = ok and got == nodes
+            print(f"{name:16s} depth {depth}: {got:10d} {status}")
+    elapsed = time.perf_counter() - start
+    print(f"suite: {total_nodes} nodes in {elapsed:.3f} s "
+          f"({total_nodes / elapsed:.0f} nodes/s)")
+    return ok
+
+
+# -----------------------------------
+# 生成器の突き合わせ
+# -----------------------------------
+def random_board(rng, max_pieces=40):
+    """両キング + ランダムな駒 (最大 max_pieces 個) を置いた盤面"""
+    board = bytearray([EMPTY] * NUM_SQUARES)
+    squares = rng.sample(range(NUM_SQUARES), max_pieces + 2)
+    board[squares[0]] = ord("K")
+    board[squares[1]] = ord("k")
+    for square in squares[2:2 + rng.randint(0, max_pieces)]:
+        piece = rng.choice(RANDOM_PIECES)
+        board[square] = ord(piece if rng.random() < 0.5 else piece.lower())
+    return board
+
+
+def compare_moves(board, side_to_move):
+    """
+    生成器の結果が一致しなければ (速い版, 参照版) を返す。
+    ビットボードの生成器は手の並びが違うので集合で比べる
+    """
+    fast = generate_all_moves(board, side_to_move)
+    reference = generate_all_moves_reference(board, side_to_move)
+    if fast != reference:
+        return fast, reference
+    bitboard = BitboardPosition(bytearray(board), side_to_move).generate_all_moves()
+    if sorted(bitboard) != sorted(reference):
+        return bitboard, reference
+    return None
+
+
+def iter_compare_positions(count, seed=0, game_plies=80):
+    """
+    突き合わせに使う Position を作る。ランダム対局の局面は
+    apply_move で差分更新した Zobrist キーも検算の対象になる。
+    """
+    rng = random.Random(seed)
+    for _ in range(count):
+        board = random_board(rng)
+        yield Position(board, "white")
+        yield Position(board, "black")
+    # 実戦に近い局面: 初期配置からのランダム対局
+    for _ in range(max(1, count // 50)):
+        position = Position.initial()
+        for _ in range(game_plies):
+            yield position
+            moves = position.generate_all_moves()
+            if not moves:
+                break
+            position.apply_move(rng.choice(moves))
+
+
+def run_compare(count, seed=0):
+    checked = 0
+    for position in iter_compare_positions(count, seed):
+        board, side_to_move = position.board, position.side_to_move
+        if position.key != compute_key(board, side_to_move):
+            print(f"zobrist key mismatch: {board_to_string(board)}")
+            return False
+        if BitboardPosition(bytearray(board), side_to_move).is_check() \
+                != is_check(board, side_to_move):
+            print(f"bitboard is_check mismatch ({side_to_move} to move): "
+                  f"{board_to_string(board)}")
+            return False
+        mismatch = compare_moves(board, side_to_move)
+        checked += 1
+        if mismatch is not None:
+            fast, reference = mismatch
+            print(f"mismatch ({side_to_move} to move): {board_to_string(board)}")
+            print("  only fast:     ", sorted(set(fast) - set(reference)))
+            print("  only reference:", sorted(set(reference) - set(fast)))
+            return False
+    print(f"compare: {checked} positions OK")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-d", "--depth", type=int, default=3)
+    parser.add_argument("--divide", action="store_true",
+                        help="最深の depth で初手ごとの内訳を表示する")
+    parser.add_argument("--board", metavar="TEXT",
+                        help="125 文字の盤面 (省略時は初期配置)")
+    parser.add_argument("--side", default="white", choices=["white", "black"])
+    parser.add_argument("--suite", action="store_true",
+                        help="保存局面のノード数を期待値と照合する")
+    parser.add_argument("--compare", type=int, metavar="N",
+                        help="ランダム局面 N 個で生成器を突き合わせる")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--reference", action="store_true",
+                        help="参照実装の生成器で数える")
+    parser.add_argument("--bitboard", action="store_true",
+                        help="ビットボードの局面 (bitboard.py) で数える")
+    args = parser.parse_args()
+
+    generate = generate_all_moves_reference if args.reference else None
+    position_class = BitboardPosition if args.bitboard else Position
+
+    if args.compare is not None:
+        sys.exit(0 if run_compare(args.compare, args.seed) else 1)
+    if args.suite:
+        sys.exit(0 if run_suite(args.depth, generate, position_class) else 1)
+
+    if args.board:
+        position = position_class.from_string(args.board, args.side)
+    else:
+        position = position_class.initial()
+    run_perft(position, args.depth, args.divide, generate)
+
+
+if __name__ == "__main__":
+    main()
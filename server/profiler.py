@@ -0,0 +1,128 @@
+"""
+遅いリクエストを見つけるためのサンプリングプロファイラ。
+
+有効にすると、処理中のリクエストのスレッドのスタックを interval 秒ごとに
+別スレッドから覗いて数えます。リクエストが slow 秒以上かかったときだけ、
+集めたスタックを flamegraph.pl / speedscope でそのまま読める
+"折りたたみ形式" (1 行に "外側;...;内側 回数") でファイルに書き出します。
+
+    profiler = SamplingProfiler(out_dir="profiles")
+    profiler.configure(enabled=True, slow_seconds=0.2)
+    token = profiler.start()          # リクエストの始め (そのスレッドで呼ぶ)
+    ...
+    path = profiler.stop(token, "/get_move", elapsed)   # 遅ければ書き出したパス
+
+無効のあいだは start / stop は何もしないので、普段のコストはほぼありません。
+"""
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+DEFAULT_INTERVAL = 0.005
+DEFAULT_SLOW_SECONDS = 0.5
+# 書き出したファイルのうち、status で返す件数
+RECENT_DUMPS = 20
+
+
+def fold_stack(frame):
+    """フレームから "モジュール:関数:行;..." (外側が先) の文字列を作る"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        module = os.path.splitext(os.path.basename(code.co_filename))[0]
+        names.append(f"{module}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    def __init__(self, out_dir="profiles", interval=DEFAULT_INTERVAL,
+                 slow_seconds=DEFAULT_SLOW_SECONDS):
+        self.out_dir = out_dir
+        self.interval = interval
+        self.slow_seconds = slow_seconds
+        self.enabled = False
+        self.dumps = deque(maxlen=RECENT_DUMPS)
+        # スレッド ID → そのリクエストで集めたスタックの Counter
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def configure(self, enabled=None, interval=None, slow_seconds=None):
+        with self._lock:
+            if interval is not None:
+                self.interval = interval
+            if slow_seconds is not None:
+                self.slow_seconds = slow_seconds
+            if enabled is not None:
+                self.enabled = enabled
+            if self.enabled and self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def start(self):
+        """呼んだスレッドのサンプリングを始める。無効なら None"""
+        if not self.enabled:
+            return None
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._active[thread_id] = Counter()
+        return thread_id
+
+    def stop(self, token, name, elapsed):
+        """
+        start の続き。elapsed が slow_seconds 以上でサンプルがあれば書き出して
+        そのパスを返す (そうでなければ None)
+        """
+        if token is None:
+            return None
+        with self._lock:
+            stacks = self._active.pop(token, None)
+        if not stacks or elapsed < self.slow_seconds:
+            return None
+        return self._dump(name, elapsed, stacks)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self.enabled and not self._active:
+                    self._thread = None
+                    return
+                interval = self.interval
+                thread_ids = list(self._active)
+            frames = sys._current_frames()
+            sampled = [(thread_id, fold_stack(frames[thread_id]))
+                       for thread_id in thread_ids if thread_id in frames]
+            with self._lock:
+                for thread_id, stack in sampled:
+                    stacks = self._active.get(thread_id)
+                    if stacks is not None:
+                        stacks[stack] += 1
+            time.sleep(interval)
+
+    def _dump(self, name, elapsed, stacks):
+        os.makedirs(self.out_dir, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9.-]+", "_", name).strip("_") or "root"
+        filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(elapsed * 1000)}ms-{slug}.folded"
+        path = os.path.join(self.out_dir, filename)
+        with open(path, "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        self.dumps.append({"path": path, "name": name,
+                           "elapsed_ms": round(elapsed * 1000, 1),
+                           "samples": sum(stacks.values())})
+        return path
+
+    def status(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "interval_ms": self.interval * 1000,
+                "slow_ms": self.slow_seconds * 1000,
+                "out_dir": self.out_dir,
+                "active": len(self._active),
+                "dumps": list(self.dumps),
+            }
@@ -0,0 +1,586 @@
+"""
+後退解析 (retrograde analysis) で tablebase ファイルを作る。
+
+    python retrograde.py KQvK KRvK KUBvK -o tablebases   # 作る (駒を取った後の組み合わせも作る)
+    python retrograde.py --show tablebases/KQvK.rtb      # 中身の概要
+
+ファイルの形式と引き当ては tablebase.py にあります。ここでは組み合わせの
+全局面を NumPy の配列にして、局面の番号の配列のまままとめて計算します。
+
+  1. はじめ: 全局面の合法性・詰み・合法手の数と、駒を取る手の行き先の値
+     (駒の少ない組み合わせのファイルから引く) を調べる。局面の番号を区切り、
+     workers 個のプロセスで分けて計算する。
+  2. 手数 d = 1, 2, ... ごとに:
+       d が奇数: 手数 d-1 で負けになった局面の 1 手前 (指し手を逆に辿る) は d 手で勝ち。
+       d が偶数: 手数 d-1 で勝ちになった局面の 1 手前のうち、すべての手の行き先が
+                 相手の勝ちになった局面は d 手で負け (d は行き先の DTM の最大 + 1)。
+     新しく決まった局面がなくなれば終わり。残った局面は引き分け。
+
+白キングが対称な面の上にあると、同じ局面に番号が複数あります。値を決めるたびに
+同じ局面の番号すべてに同じ値を入れる (_closure) ので、どの番号で引いても同じ値です。
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from board import (
+    BISHOP_DIRS,
+    KING_DELTAS,
+    KNIGHT_DELTAS,
+    NUM_SQUARES,
+    QUEEN_DIRS,
+    ROOK_DIRS,
+    UNICORN_DIRS,
+    in_range,
+    square_index,
+)
+from tablebase import (
+    CANONICAL_SYMMETRY,
+    DOMAIN,
+    DOMAIN_INDEX,
+    FLAG_DECISIVE,
+    HEADER,
+    MAGIC,
+    MAX_DTM,
+    STABILIZERS,
+    SYMMETRIES,
+    VALUE_DRAW,
+    VALUE_DTM_BASE,
+    VALUE_INVALID,
+    Material,
+    TableFile,
+    table_path,
+)
+
+# 盤外・取られた駒のマス (番兵)。どの表でもこのマスは利きも遮りもしない
+_OFF = NUM_SQUARES
+DEFAULT_CHUNK_SIZE = 1 << 18
+_SIDES = ("white", "black")
+_OTHER = {"white": "black", "black": "white"}
+
+
+# -----------------------------------
+# 表
+# -----------------------------------
+def _ray(square, d):
+    lvl_idx, col_idx, row_idx = square // 25, square % 5, (square // 5) % 5
+    ray = []
+    while True:
+        lvl_idx, col_idx, row_idx = lvl_idx + d[0], col_idx + d[1], row_idx + d[2]
+        if not in_range(lvl_idx, col_idx, row_idx):
+            return ray
+        ray.append(square_index(lvl_idx, col_idx, row_idx))
+
+
+_SLIDER_DIRS = {"R": ROOK_DIRS, "B": BISHOP_DIRS, "U": UNICORN_DIRS, "Q": QUEEN_DIRS}
+_LEAPER_DELTAS = {"N": KNIGHT_DELTAS, "K": KING_DELTAS}
+
+
+def _vectors(piece):
+    """駒の移動ごとの (126,) の表 (元のマス → 先のマス、なければ _OFF) のリスト"""
+    if piece in _SLIDER_DIRS:
+        moves = [(d, step) for d in _SLIDER_DIRS[piece] for step in range(4)]
+    else:
+        moves = [(d, 0) for d in _LEAPER_DELTAS[piece]]
+    vectors = []
+    for d, step in moves:
+        table = np.full(NUM_SQUARES + 1, _OFF, dtype=np.int16)
+        for square in range(NUM_SQUARES):
+            ray = _ray(square, d)
+            if step < len(ray):
+                table[square] = ray[step]
+        if (table[:NUM_SQUARES] != _OFF).any():
+            vectors.append(table)
+    return vectors
+
+
+VECTORS = {piece: _vectors(piece) for piece in "KQRUBN"}
+SLIDERS = frozenset(_SLIDER_DIRS)
+
+# ATTACKS[駒][a, b]: 空の盤で a の駒が b に利くか
+ATTACKS = {}
+for _piece, _vecs in VECTORS.items():
+    ATTACKS[_piece] = np.zeros((NUM_SQUARES + 1, NUM_SQUARES + 1), dtype=bool)
+    for _table in _vecs:
+        _valid = _table[:NUM_SQUARES] != _OFF
+        ATTACKS[_piece][np.arange(NUM_SQUARES)[_valid], _table[:NUM_SQUARES][_valid]] = True
+
+# BETWEEN[a, b, c]: c が a と b を結ぶ直線の (両端を除く) 間にあるか
+BETWEEN = np.zeros((NUM_SQUARES + 1,) * 3, dtype=bool)
+for _square in range(NUM_SQUARES):
+    for _d in QUEEN_DIRS:
+        _line = _ray(_square, _d)
+        for _end in range(1, len(_line)):
+            BETWEEN[_square, _line[_end], _line[:_end]] = True
+
+_SYMMETRIES = np.array([table + [_OFF] for table in SYMMETRIES], dtype=np.int16)
+_CANONICAL = np.array(CANONICAL_SYMMETRY + [0], dtype=np.intp)
+_DOMAIN = np.array(DOMAIN, dtype=np.int16)
+_DOMAIN_INDEX = np.array(DOMAIN_INDEX + [-1], dtype=np.int64)
+
+
+# -----------------------------------
+# 局面の番号とマス
+# -----------------------------------
+def encode(material, squares):
+    """(駒の数, M) のマス番号 → (M,) の局面の番号"""
+    squares = _SYMMETRIES[_CANONICAL[squares[0]], squares]
+    for start, end in material.groups:
+        squares[start:end] = np.sort(squares[start:end], axis=0)
+    index = _DOMAIN_INDEX[squares[0]]
+    for column in range(1, material.count):
+        index = index * NUM_SQUARES + squares[column]
+    return index
+
+
+def decode(material, index):
+    """(M,) の局面の番号 → (駒の数, M) のマス番号"""
+    squares = np.empty((material.count, len(index)), dtype=np.int16)
+    rest = np.asarray(index, dtype=np.int64)
+    for column in range(material.count - 1, 0, -1):
+        squares[column] = rest % NUM_SQUARES
+        rest = rest // NUM_SQUARES
+    squares[0] = _DOMAIN[rest]
+    return squares
+
+
+def _well_formed(material, squares):
+    """駒が重ならず、同じ駒がマス番号の小さい順に並んでいる番号か"""
+    ok = np.ones(squares.shape[1], dtype=bool)
+    for a in range(material.count):
+        for b in range(a + 1, material.count):
+            ok &= squares[a] != squares[b]
+    for start, end in material.groups:
+        for column in range(start, end - 1):
+            ok &= squares[column] < squares[column + 1]
+    return ok
+
+
+def _attacked(material, squares, target, by_side):
+    """by_side の駒が target のマスに利いているか ((M,) bool)"""
+    hit = np.zeros(squares.shape[1], dtype=bool)
+    for column, (piece, side) in enumerate(zip(material.types, material.colors)):
+        if side != by_side:
+            continue
+        attacks = ATTACKS[piece][squares[column], target]
+        if piece in SLIDERS:
+            for other in range(material.count):
+                if other != column:
+                    attacks &= ~BETWEEN[squares[column], target, squares[other]]
+        hit |= attacks
+    return hit
+
+
+def _king_square(material, squares, side):
+    return squares[0] if side == "white" else squares[1]
+
+
+def _moves(material, squares, side):
+    """
+    side の指し手を移動ごとにまとめて生成する。
+    (指した後のマス, 取った駒の列 (なければ -1), 合法か) を順に返す
+    """
+    enemy = _OTHER[side]
+    for column, (piece, color) in enumerate(zip(material.types, material.colors)):
+        if color != side:
+            continue
+        for table in VECTORS[piece]:
+            to = table[squares[column]]
+            ok = to != _OFF
+            if piece in SLIDERS:
+                for other in range(material.count):
+                    if other != column:
+                        ok &= ~BETWEEN[squares[column], to, squares[other]]
+            captured = np.full(squares.shape[1], -1, dtype=np.int8)
+            for other in range(material.count):
+                if other == column:
+                    continue
+                same = squares[other] == to
+                if material.colors[other] == side or material.types[other] == "K":
+                    ok &= ~same
+                else:
+                    captured[same] = other
+            if not ok.any():
+                continue
+            after = squares.copy()
+            after[column] = to
+            for other in range(2, material.count):
+                if material.colors[other] == enemy:
+                    after[other][captured == other] = _OFF
+            ok &= ~_attacked(material, after, _king_square(material, after, side), enemy)
+            yield after, captured, ok
+
+
+def _predecessors(material, index, side):
+    """
+    side の手番の局面 index の 1 手前 (相手が駒を取らずに指した) の局面の番号。
+    合法かどうかは呼ぶ側で値の表を見て確かめる
+    """
+    squares = decode(material, index)
+    mover = _OTHER[side]
+    found = []
+    for column, (piece, color) in enumerate(zip(material.types, material.colors)):
+        if color != mover:
+            continue
+        for table in VECTORS[piece]:
+            # ポーンがないので、駒は指した手の逆向きに戻れる
+            origin = table[squares[column]]
+            ok = origin != _OFF
+            for other in range(material.count):
+                if other != column:
+                    ok &= squares[other] != origin
+                    if piece in SLIDERS:
+                        ok &= ~BETWEEN[squares[column], origin, squares[other]]
+            if not ok.any():
+                continue
+            before = squares[:, ok]
+            before[column] = origin[ok]
+            found.append(encode(material, before))
+    if not found:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(np.concatenate(found))
+
+
+def _closure(material, index):
+    """index と同じ局面を表す番号すべて (白キングを動かさない対称で移したもの)"""
+    if not len(index):
+        return index
+    squares = decode(material, index)
+    domain = _DOMAIN_INDEX[squares[0]]
+    found = [index]
+    for domain_index, stabilizer in enumerate(STABILIZERS):
+        if len(stabilizer) == 1:
+            continue
+        selected = domain == domain_index
+        if not selected.any():
+            continue
+        subset = squares[:, selected]
+        for g in stabilizer[1:]:
+            found.append(encode(material, _SYMMETRIES[g][subset]))
+    return np.unique(np.concatenate(found))
+
+
+# -----------------------------------
+# 値の表
+# -----------------------------------
+class TableSet:
+    """作成済みの組み合わせの値を np.memmap で引く (駒を取る手の行き先用)"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._values = {}
+
+    def values(self, material):
+        """{手番: (局面の数,) uint8}"""
+        values = self._values.get(material.name)
+        if values is None:
+            path = table_path(self.directory, material)
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Tablebase for {material.name} is missing: {path}")
+            TableFile(path).close()  # ヘッダを確かめる
+            data = np.memmap(path, dtype=np.uint8, mode="r", offset=HEADER.size,
+                             shape=(2, material.size))
+            values = self._values[material.name] = {"white": data[0], "black": data[1]}
+        return values
+
+    def lookup(self, material, squares, side):
+        """駒を取った後の局面 ((駒の数, M) のマス) の side の手番の値"""
+        if material.count == 2:
+            return np.full(squares.shape[1], VALUE_DRAW, dtype=np.uint8)
+        return self.values(material)[side][encode(material, squares)]
+
+
+def _successor_values(material, after, captured, ok, side, values, tables):
+    """指した後の局面の値 (相手の手番)。ok でない手は VALUE_INVALID"""
+    result = np.full(after.shape[1], VALUE_INVALID, dtype=np.uint8)
+    enemy = _OTHER[side]
+    quiet = ok & (captured < 0)
+    if quiet.any():
+        result[quiet] = values[enemy][encode(material, after[:, quiet])]
+    for column in range(2, material.count):
+        taken = ok & (captured == column)
+        if not taken.any():
+            continue
+        sub, columns, swapped = material.without(column)
+        result[taken] = tables.lookup(sub, after[columns][:, taken],
+                                      side if swapped else enemy)
+    return result
+
+
+def _is_win(value):
+    return (value >= VALUE_DTM_BASE) & ((value - VALUE_DTM_BASE) % 2 == 1)
+
+
+def _is_loss(value):
+    return (value >= VALUE_DTM_BASE) & ((value - VALUE_DTM_BASE) % 2 == 0)
+
+
+# -----------------------------------
+# はじめの計算 (ワーカー)
+# -----------------------------------
+
+# ワーカープロセス内の作成済みの表 (_init_worker で作る)
+_worker_tables = None
+
+
+def _init_worker(directory):
+    global _worker_tables
+    _worker_tables = TableSet(directory)
+
+
+def _initial_chunk(name, start, end):
+    """
+    局面の番号 [start, end) の、手番ごとの (値, 駒を取って勝つ手数, 負けが決まる手数)。
+    値は VALUE_INVALID / VALUE_DRAW (未定) / 詰み (DTM 0)。手数は 0 なら未定
+    """
+    material = Material.parse(name)
+    squares = decode(material, np.arange(start, end, dtype=np.int64))
+    well_formed = _well_formed(material, squares)
+    result = {}
+    for side in _SIDES:
+        enemy = _OTHER[side]
+        # 手番でない側が王手されている局面はありえない
+        legal = well_formed & ~_attacked(
+            material, squares, _king_square(material, squares, enemy), side)
+        subset = squares[:, legal]
+        count = subset.shape[1]
+        legal_moves = np.zeros(count, dtype=np.int32)
+        quiet_moves = np.zeros(count, dtype=np.int32)
+        capture_loss = np.full(count, 255, dtype=np.int32)   # 取った先の相手の負けの最短
+        capture_win = np.zeros(count, dtype=np.int32)        # 取った先の相手の勝ちの最長
+        captures_lose = np.ones(count, dtype=bool)           # 取る手がすべて相手の勝ちか
+        for after, captured, ok in _moves(material, subset, side):
+            legal_moves += ok
+            quiet_moves += ok & (captured < 0)
+            taking = ok & (captured >= 0)
+            if not taking.any():
+                continue
+            value = _successor_values(material, after, captured, taking, side,
+                                      None, _worker_tables).astype(np.int32)
+            loss, win = taking & _is_loss(value), taking & _is_win(value)
+            capture_loss = np.where(loss, np.minimum(capture_loss, value - VALUE_DTM_BASE),
+                                    capture_loss)
+            capture_win = np.where(win, np.maximum(capture_win, value - VALUE_DTM_BASE),
+                                   capture_win)
+            captures_lose &= ~taking | win
+        in_check = _attacked(material, subset, _king_square(material, subset, side), enemy)
+
+        value = np.full(end - start, VALUE_INVALID, dtype=np.uint8)
+        value[legal] = np.where((legal_moves == 0) & in_check, VALUE_DTM_BASE, VALUE_DRAW)
+        win_at = np.zeros(end - start, dtype=np.uint8)
+        win_at[legal] = np.where(capture_loss < 255, np.minimum(capture_loss + 1, MAX_DTM), 0)
+        loss_at = np.zeros(end - start, dtype=np.uint8)
+        loss_at[legal] = np.where((quiet_moves == 0) & (legal_moves > 0) & captures_lose,
+                                  np.minimum(capture_win + 1, MAX_DTM), 0)
+        result[side] = (value, win_at, loss_at)
+    return start, result
+
+
+# -----------------------------------
+# 作成
+# -----------------------------------
+def _chunks(index, size):
+    for start in range(0, len(index), size):
+        yield index[start:start + size]
+
+
+def _check_losses(material, candidates, side, values, tables, chunk_size):
+    """candidates のうち、すべての手の行き先が相手の勝ちのものと、その DTM"""
+    losing, dtms = [], []
+    for chunk in _chunks(candidates, chunk_size):
+        squares = decode(material, chunk)
+        all_win = np.ones(len(chunk), dtype=bool)
+        longest = np.zeros(len(chunk), dtype=np.int32)
+        for after, captured, ok in _moves(material, squares, side):
+            value = _successor_values(material, after, captured, ok, side, values, tables)
+            win = _is_win(value)
+            all_win &= ~ok | win
+            longest = np.where(ok & win, np.maximum(longest, value.astype(np.int32)
+                                                    - VALUE_DTM_BASE), longest)
+        losing.append(chunk[all_win])
+        dtms.append(longest[all_win] + 1)
+    if not losing:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32)
+    return np.concatenate(losing), np.concatenate(dtms)
+
+
+def generate(material, directory, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """
+    material の値の表 {手番: (局面の数,) uint8} を作る。駒を取った後の
+    組み合わせのファイルが directory にあること。
+    progress(手数, その手数で決まった局面の数) を渡すと手数ごとに呼ぶ。
+    """
+    workers = workers or os.cpu_count() or 1
+    size = material.size
+    values = {side: np.empty(size, dtype=np.uint8) for side in _SIDES}
+    win_at = {side: np.empty(size, dtype=np.uint8) for side in _SIDES}
+    loss_at = {side: np.empty(size, dtype=np.uint8) for side in _SIDES}
+    bounds = [(start, min(start + chunk_size, size)) for start in range(0, size, chunk_size)]
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(directory,),
+    ) as executor:
+        futures = [executor.submit(_initial_chunk, material.name, start, end)
+                   for start, end in bounds]
+        for future in futures:
+            start, result = future.result()
+            for side in _SIDES:
+                value, win, loss = result[side]
+                end = start + len(value)
+                values[side][start:end] = value
+                win_at[side][start:end] = win
+                loss_at[side][start:end] = loss
+
+    tables = TableSet(directory)
+    newest = {side: np.flatnonzero(values[side] == VALUE_DTM_BASE) for side in _SIDES}
+    if progress:
+        progress(0, sum(len(index) for index in newest.values()))
+    scheduled = max(int(win_at[side].max(initial=0)) for side in _SIDES)
+    scheduled = max([scheduled] + [int(loss_at[side].max(initial=0)) for side in _SIDES])
+    dtm = 0
+    while any(len(index) for index in newest.values()) or dtm < scheduled:
+        dtm += 1
+        if dtm > MAX_DTM:
+            raise ValueError(f"DTM exceeds {MAX_DTM} in {material.name}")
+        assigned = {}
+        for side in _SIDES:
+            enemy = _OTHER[side]
+            candidates = [_predecessors(material, chunk, enemy)
+                          for chunk in _chunks(newest[enemy], chunk_size // 16 or 1)]
+            candidates = (np.unique(np.concatenate(candidates)) if candidates
+                          else np.empty(0, dtype=np.int64))
+            candidates = candidates[values[side][candidates] == VALUE_DRAW]
+            if dtm % 2:
+                # 相手が負けになる局面へ指せれば勝ち
+                scheduled_here = np.flatnonzero((win_at[side] == dtm)
+                                                & (values[side] == VALUE_DRAW))
+                decided = np.union1d(candidates, scheduled_here)
+            else:
+                scheduled_here = np.flatnonzero((loss_at[side] == dtm)
+                                                & (values[side] == VALUE_DRAW))
+                candidates = np.union1d(candidates, scheduled_here)
+                losing, dtms = _check_losses(material, candidates, side, values, tables,
+                                             chunk_size // 16 or 1)
+                decided = losing[dtms == dtm]
+                # 駒を取った先の勝ちが長ければ、その手数になってから決める
+                later = losing[dtms > dtm]
+                loss_at[side][later] = np.minimum(dtms[dtms > dtm], MAX_DTM)
+                if len(later):
+                    scheduled = max(scheduled, int(dtms.max()))
+            decided = _closure(material, decided)
+            decided = decided[values[side][decided] == VALUE_DRAW]
+            assigned[side] = decided
+        for side in _SIDES:
+            values[side][assigned[side]] = VALUE_DTM_BASE + dtm
+        newest = assigned
+        if progress:
+            progress(dtm, sum(len(index) for index in newest.values()))
+    return values
+
+
+def write_table(path, material, values):
+    """値の表を path に書く (一時ファイルに書いてから置き換える)"""
+    decisive = any((values[side] >= VALUE_DTM_BASE).any() for side in _SIDES)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, material.name.encode("ascii"), material.count,
+                            FLAG_DECISIVE if decisive else 0, material.size))
+        for side in _SIDES:
+            values[side].tofile(f)
+    os.replace(tmp_path, path)
+
+
+def build_order(materials):
+    """materials と、駒を取った後の組み合わせすべてを、作る順 (駒の少ない順) に並べる"""
+    order = []
+
+    def visit(material):
+        if material in order:
+            return
+        for sub in material.sub_materials():
+            visit(sub)
+        order.append(material)
+
+    for material in materials:
+        visit(material)
+    return order
+
+
+def build_tables(materials, directory, workers=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 rebuild=False, log=None):
+    """materials (と必要な組み合わせ) のファイルを directory に作り、作ったパスを返す"""
+    os.makedirs(directory, exist_ok=True)
+    written = []
+    for material in build_order(materials):
+        path = table_path(directory, material)
+        if os.path.exists(path) and not rebuild and material not in materials:
+            continue
+        start = time.perf_counter()
+
+        def progress(dtm, decided):
+            if log:
+                log(f"{material.name}: dtm {dtm}: {decided} positions "
+                    f"({time.perf_counter() - start:.1f} s)")
+
+        values = generate(material, directory, workers, chunk_size, progress)
+        write_table(path, material, values)
+        written.append(path)
+    return written
+
+
+def show_table(path):
+    table = TableFile(path)
+    material = table.material
+    print(f"{path}: {material.name}, {material.size} positions per side, "
+          f"{'decisive' if table.decisive else 'no decisive positions'}")
+    data = np.memmap(path, dtype=np.uint8, mode="r", offset=HEADER.size,
+                     shape=(2, material.size))
+    for side, values in zip(_SIDES, data):
+        counts = np.bincount(values, minlength=256)
+        dtms = np.flatnonzero(counts[VALUE_DTM_BASE:])
+        wins, losses = dtms[dtms % 2 == 1], dtms[dtms % 2 == 0]
+        print(f"  {side} to move: win {counts[VALUE_DTM_BASE + wins].sum()}, "
+              f"draw {counts[VALUE_DRAW]}, loss {counts[VALUE_DTM_BASE + losses].sum()}, "
+              f"longest win {wins.max() if len(wins) else '-'}, "
+              f"longest loss {losses.max() if len(losses) else '-'}")
+    table.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("materials", nargs="*", help="組み合わせ (KQvK, KUBvK など)")
+    parser.add_argument("-o", "--output", default="tablebases", help="ファイルを置くディレクトリ")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="まとめて計算する局面の数")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="駒を取った後の組み合わせのファイルもあれば作り直す")
+    parser.add_argument("--show", metavar="FILE", help="tablebase ファイルの概要を表示する")
+    args = parser.parse_args()
+
+    if args.show:
+        show_table(args.show)
+        return
+    if not args.materials:
+        parser.error("no materials given")
+    try:
+        materials = [Material.parse(name) for name in args.materials]
+    except ValueError as e:
+        parser.error(str(e))
+    if any(material.count == 2 for material in materials):
+        parser.error("bare kings need no table")
+
+    for path in build_tables(materials, args.output, args.workers, args.chunk_size,
+                             args.rebuild, lambda line: print(line, file=sys.stderr)):
+        print(f"wrote {path} ({os.path.getsize(path)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
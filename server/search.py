@@ -0,0 +1,392 @@
+"""
+AI の探索エンジン。
+
+  - 評価関数: 駒の価値 + 静的な機動力 (空の盤でそのマスから動けるマスの数) +
+    ポーンの前進度。マスごとに前計算した表を引いて足すだけ
+  - negamax + alpha-beta。手の並べ替えは 取る手 (MVV-LVA) → 昇格 →
+    キラー手 → ヒストリー
+  - 末端では取る手だけを読む静止探索
+  - 反復深化。1 手あたりの持ち時間 (ミリ秒) を超えたら、最後に読み切った
+    深さの最善手を返す
+  - 置換表 (transposition.py) があれば、読んだ局面の結果と最善手を使い回す
+"""
+import time
+
+from board import (
+    BISHOP,
+    BLACK_BIT,
+    BISHOP_RAYS,
+    EMPTY,
+    KING,
+    KNIGHT,
+    KNIGHT_TARGETS,
+    NUM_SQUARES,
+    PAWN,
+    QUEEN,
+    QUEEN_RAYS,
+    ROOK,
+    ROOK_RAYS,
+    UNICORN,
+    UNICORN_RAYS,
+)
+from transposition import BOUND_EXACT, BOUND_LOWER, BOUND_UPPER
+
+# -----------------------------------
+# 1. 評価関数
+# -----------------------------------
+PIECE_VALUES = {
+    PAWN: 100,
+    UNICORN: 250,
+    KNIGHT: 320,
+    BISHOP: 350,
+    ROOK: 500,
+    QUEEN: 1000,
+    KING: 0,
+}
+
+# 空の盤でそのマスから動けるマス 1 つあたりの加点
+MOBILITY_WEIGHTS = {
+    KNIGHT: 4,
+    BISHOP: 3,
+    UNICORN: 4,
+    ROOK: 2,
+    QUEEN: 1,
+}
+# ポーンの前進 1 段 (レベル or 行) あたりの加点
+PAWN_ADVANCE_WEIGHT = 8
+
+MATE_SCORE = 100000
+MAX_PLY = 64
+INFINITY = MATE_SCORE + 1
+
+
+def _static_mobility(piece_type, square):
+    if piece_type == KNIGHT:
+        return len(KNIGHT_TARGETS[square])
+    rays = {
+        BISHOP: BISHOP_RAYS,
+        UNICORN: UNICORN_RAYS,
+        ROOK: ROOK_RAYS,
+        QUEEN: QUEEN_RAYS,
+    }.get(piece_type)
+    if rays is None:
+        return 0
+    return sum(len(ray) for ray in rays[square])
+
+
+def _piece_square_tables():
+    """
+    PIECE_SQUARE[駒コード][マス] = 白から見たその駒の点数。
+    黒の駒は符号を反転して入れておくので、盤面の全マスを足せば評価値になる。
+    """
+    tables = [[0] * NUM_SQUARES for _ in range(128)]
+    for piece_type, value in PIECE_VALUES.items():
+        for square in range(NUM_SQUARES):
+            lvl_idx, row_idx = square // 25, (square // 5) % 5
+            score = value + MOBILITY_WEIGHTS.get(piece_type, 0) * _static_mobility(
+                piece_type, square)
+            if piece_type == PAWN:
+                tables[piece_type][square] = (
+                    score + PAWN_ADVANCE_WEIGHT * (lvl_idx + row_idx))
+                tables[piece_type | BLACK_BIT][square] = -(
+                    score + PAWN_ADVANCE_WEIGHT * (8 - lvl_idx - row_idx))
+            else:
+                tables[piece_type][square] = score
+                tables[piece_type | BLACK_BIT][square] = -score
+    return tables
+
+
+PIECE_SQUARE = _piece_square_tables()
+
+
+def evaluate(board, side_to_move):
+    """side_to_move から見た評価値 (センチポーン)"""
+    tables = PIECE_SQUARE
+    score = 0
+    for square, piece in enumerate(board):
+        score += tables[piece][square]
+    return score if side_to_move == "white" else -score
+
+
+def piece_value(piece):
+    """駒コード (色は問わない) → 駒の価値"""
+    return PIECE_VALUES.get(piece & 0xDF, 0)
+
+
+def score_to_tt(score, ply):
+    """詰みの点数を「この局面から何手で詰むか」に直して置換表に入れる"""
+    if score >= MATE_SCORE - MAX_PLY:
+        return score + ply
+    if score <= -MATE_SCORE + MAX_PLY:
+        return score - ply
+    return score
+
+
+def score_from_tt(score, ply):
+    """score_to_tt の逆。置換表の詰みの点数をルートからの手数に直す"""
+    if score >= MATE_SCORE - MAX_PLY:
+        return score - ply
+    if score <= -MATE_SCORE + MAX_PLY:
+        return score + ply
+    return score
+
+
+# -----------------------------------
+# 2. 探索
+# -----------------------------------
+class SearchTimeout(Exception):
+    """持ち時間切れで探索を打ち切る"""
+
+
+class SearchResult:
+    """
+    探索結果。move は (from_idx, to_idx, promotion) か、合法手がなければ None。
+    iterations は読み切った深さごとの (depth, move, score)。
+    """
+
+    def __init__(self, move, score, depth, nodes, elapsed, iterations=()):
+        self.move = move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+        self.iterations = list(iterations)
+
+    def to_dict(self):
+        return {
+            "score": self.score,
+            "depth": self.depth,
+            "nodes": self.nodes,
+            "time_ms": round(self.elapsed * 1000, 1),
+            "nps": int(self.nodes / self.elapsed) if self.elapsed > 0 else 0,
+        }
+
+
+class Searcher:
+    """
+    反復深化 alpha-beta 探索。
+
+    tt (TranspositionTable) を渡すと読んだ局面を置換表に残す。置換表は
+    プロセス内で共有してよい。1 つのゲームで同じ Searcher を使い続けると、
+    置換表に加えてヒストリーも前の手の探索から引き継がれる。
+    """
+
+    # 時間切れかを見るノード間隔 (2 のべき乗 - 1)
+    TIME_CHECK_MASK = 255
+
+    def __init__(self, tt=None):
+        self.tt = tt
+        self.nodes = 0
+        self.deadline = None
+        self.killers = [[None, None] for _ in range(MAX_PLY + 1)]
+        self.history = {}
+
+    def search(self, position, time_ms=None, max_depth=None, root_moves=None):
+        """
+        position の手番側の最善手を探す。time_ms (ミリ秒) と max_depth の
+        どちらかに達したら、最後に読み切った深さの結果を返す。
+        root_moves を渡すと、ルートではその手だけを読む (並列探索の分担用)。
+        """
+        start = time.perf_counter()
+        # 探索中は make_move / unmake_move で局面を書き換えるので、コピーの上で読む
+        # (時間切れで途中から抜けても呼び出し元の局面は壊れない)
+        position = position.copy()
+        self.nodes = 0
+        self.deadline = None
+        max_depth = min(max_depth or MAX_PLY, MAX_PLY)
+        # キラー手は手数がずれると意味がないので捨て、ヒストリーは半減させて残す
+        self.killers = [[None, None] for _ in range(MAX_PLY + 1)]
+        self.history = {move: count // 2 for move, count in self.history.items() if count > 1}
+        if self.tt is not None:
+            self.tt.new_search()
+
+        # ルートの一部の手だけを読むときは、その最善手を置換表に残さない
+        store_root = root_moves is None
+        if root_moves is None:
+            root_moves = position.generate_all_moves()
+        root_moves = list(root_moves)
+        if not root_moves:
+            return SearchResult(None, 0, 0, 0, time.perf_counter() - start)
+        tt_move = self._probe_move(position)
+        if tt_move in root_moves:
+            root_moves.remove(tt_move)
+            root_moves.insert(0, tt_move)
+
+        # 深さ 1 の途中で時間切れになっても、並べた先頭の手 (置換表の手があればそれ) を返す
+        best_move, best_score, completed = root_moves[0], 0, 0
+        iterations = []
+        if time_ms is not None:
+            self.deadline = start + time_ms / 1000
+        for depth in range(1, max_depth + 1):
+            try:
+                score, move = self._search_root(position, root_moves, depth, store_root)
+            except SearchTimeout:
+                break
+            best_move, best_score, completed = move, score, depth
+            iterations.append((depth, move, score))
+            # 最善手を先頭にして次の深さへ
+            root_moves.remove(move)
+            root_moves.insert(0, move)
+            if abs(score) >= MATE_SCORE - MAX_PLY:
+                break  # 詰みを読み切った
+            if self.deadline is not None:
+                # 残り時間で次の深さを読み切れる見込みが薄ければやめる
+                elapsed = time.perf_counter() - start
+                if elapsed * 2 > time_ms / 1000:
+                    break
+
+        return SearchResult(best_move, best_score, completed, self.nodes,
+                            time.perf_counter() - start, iterations)
+
+    def _search_root(self, position, root_moves, depth, store=True):
+        alpha, beta = -INFINITY, INFINITY
+        best_move, best_score = root_moves[0], -INFINITY
+        for move in root_moves:
+            undo = position.make_move(move)
+            score = -self._negamax(position, depth - 1, -beta, -alpha, 1)
+            position.unmake_move(undo)
+            if score > best_score:
+                best_move, best_score = move, score
+            if score > alpha:
+                alpha = score
+        if store and self.tt is not None:
+            self.tt.store(position.key, best_move, score_to_tt(best_score, 0),
+                          depth, BOUND_EXACT)
+        return best_score, best_move
+
+    def _probe_move(self, position):
+        if self.tt is None:
+            return None
+        entry = self.tt.probe(position.key, position.side_to_move)
+        return entry.move if entry is not None else None
+
+    def _tick(self):
+        self.nodes += 1
+        if (
+            self.deadline is not None
+            and self.nodes & self.TIME_CHECK_MASK == 0
+            and time.perf_counter() > self.deadline
+        ):
+            raise SearchTimeout()
+
+    def _negamax(self, position, depth, alpha, beta, ply):
+        if depth <= 0 or ply >= MAX_PLY:
+            return self._quiesce(position, alpha, beta, ply)
+        self._tick()
+
+        tt = self.tt
+        tt_move = None
+        if tt is not None:
+            entry = tt.probe(position.key, position.side_to_move)
+            if entry is not None:
+                tt_move = entry.move
+                if entry.depth >= depth:
+                    score = score_from_tt(entry.score, ply)
+                    if (
+                        entry.bound == BOUND_EXACT
+                        or (entry.bound == BOUND_LOWER and score >= beta)
+                        or (entry.bound == BOUND_UPPER and score <= alpha)
+                    ):
+                        return score
+
+        moves = position.generate_all_moves()
+        if not moves:
+            # 詰み (早い詰みほど点が高い) かステイルメイト
+            return -MATE_SCORE + ply if position.is_check() else 0
+
+        board = position.board
+        original_alpha = alpha
+        best, best_move = -INFINITY, None
+        for move in self._order_moves(board, moves, ply, tt_move):
+            undo = position.make_move(move)
+            score = -self._negamax(position, depth - 1, -beta, -alpha, ply + 1)
+            position.unmake_move(undo)
+            if score > best:
+                best, best_move = score, move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if board[move[1]] == EMPTY:
+                    self._remember_quiet_cutoff(move, depth, ply)
+                break
+
+        if tt is not None:
+            if best >= beta:
+                bound = BOUND_LOWER
+            elif best <= original_alpha:
+                bound = BOUND_UPPER
+                best_move = None  # α を超えなかったので最善手は当てにならない
+            else:
+                bound = BOUND_EXACT
+            tt.store(position.key, best_move, score_to_tt(best, ply), depth, bound)
+        return best
+
+    def _quiesce(self, position, alpha, beta, ply):
+        """取る手 (と昇格) だけを読んで、駒の取り合いが落ち着いた点で評価する"""
+        self._tick()
+        board = position.board
+        stand_pat = evaluate(board, position.side_to_move)
+        if stand_pat >= beta:
+            return stand_pat
+
+        moves = position.generate_all_moves()
+        if not moves:
+            return -MATE_SCORE + ply if position.is_check() else 0
+        if ply >= MAX_PLY:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        captures = [
+            move for move in moves
+            if board[move[1]] != EMPTY or move[2] in ("Q", "q")
+        ]
+        captures.sort(key=lambda move: self._capture_order(board, move), reverse=True)
+        for move in captures:
+            undo = position.make_move(move)
+            score = -self._quiesce(position, -beta, -alpha, ply + 1)
+            position.unmake_move(undo)
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    # -----------------------------------
+    # 手の並べ替え
+    # -----------------------------------
+    @staticmethod
+    def _capture_order(board, move):
+        """MVV-LVA: 高い駒を安い駒で取る手ほど先に読む"""
+        from_idx, to_idx, promotion = move
+        score = piece_value(board[to_idx]) * 16 - piece_value(board[from_idx])
+        if promotion:
+            score += piece_value(ord(promotion))
+        return score
+
+    def _order_moves(self, board, moves, ply, tt_move=None):
+        killers = self.killers[ply]
+        history = self.history
+
+        def order(move):
+            from_idx, to_idx, promotion = move
+            if move == tt_move:
+                return 4_000_000
+            if board[to_idx] != EMPTY:
+                return 3_000_000 + self._capture_order(board, move)
+            if promotion:
+                return 2_000_000 + piece_value(ord(promotion))
+            if move == killers[0] or move == killers[1]:
+                return 1_000_000
+            return history.get((from_idx, to_idx), 0)
+
+        return sorted(moves, key=order, reverse=True)
+
+    def _remember_quiet_cutoff(self, move, depth, ply):
+        """β カットを起こした取らない手をキラー手・ヒストリーに記録する"""
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        key = (move[0], move[1])
+        self.history[key] = self.history.get(key, 0) + depth * depth
@@ -0,0 +1,356 @@
+"""
+AI 同士の自己対局 (トーナメント) で、AI・指し手生成・終局判定を通しで測る。
+
+    python selfplay.py -n 20                              # search 対 random を 20 局
+    python selfplay.py -n 40 -1 search:depth=2 -2 search:time_ms=100
+    python selfplay.py -n 100 --workers 8 --pgn games.txt # 棋譜を保存
+    python selfplay.py --save selfplay.json               # 結果を JSON に保存
+    python selfplay.py --baseline selfplay.json           # 保存した結果より遅い・弱いと終了コード 1
+
+対局者は "エンジン[:設定=値,...]" で指定します。エンジンは engine.AI_ENGINES の
+"search" か "random"、設定は /get_move の body と同じ time_ms と depth です。
+手を選ぶのは engine.Engine.choose_ai_move、終局の判定は Engine.check_gameend と
+draws.DrawTracker で、API と同じコードを通ります (定跡と tablebase もサーバーと
+同じ環境変数のものを使います)。探索はいつも対局者ごとの Searcher で、
+サーバーの RAUM_AI_WORKERS のような並列探索は使いません。
+対局は --workers 個のプロセスに配り、先後は 1 局ごとに入れ替えます。
+
+games/s・nodes/s・1 手の思考時間の分布 (p50/p90/p99/max)・勝敗と終局理由の内訳を表示します。
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from board import EMPTY, Position, move_to_squares
+from book import open_book
+from draws import DrawTracker
+from engine import (
+    AI_ENGINES,
+    DEFAULT_AI_TIME_MS,
+    Engine,
+    default_book_path,
+    default_tablebase_dir,
+    parse_ai_options,
+)
+from search import Searcher
+from tablebase import Tablebase
+from transposition import TranspositionTable
+
+DEFAULT_MAX_PLIES = 300
+
+# 対局者の探索が共有する置換表の大きさ (MB)
+TT_MB = 32
+
+# ワーカープロセスごとの Engine (_get_engine で作る)
+_engine = None
+
+# 対局ごとの結果 → (白の得点, PGN の結果)
+RESULTS = {
+    "checkmate": None,  # 詰ませた側の勝ち
+    "stalemate": (0.5, "1/2-1/2"),
+    "threefold_repetition": (0.5, "1/2-1/2"),
+    "fifty_move_rule": (0.5, "1/2-1/2"),
+    "insufficient_material": (0.5, "1/2-1/2"),
+    "max_plies": (0.5, "*"),
+}
+
+
+def parse_player(spec):
+    """
+    "search:depth=2,time_ms=100" → {"engine": "search", "depth": 2, "time_ms": 100}。
+    不正なら ValueError
+    """
+    engine, _, options = spec.partition(":")
+    data = {"engine": engine}
+    for option in filter(None, options.split(",")):
+        key, sep, value = option.partition("=")
+        if not sep or key not in ("depth", "time_ms"):
+            raise ValueError(f"Invalid player option: {option}")
+        data[key] = int(value)
+    if engine not in AI_ENGINES:
+        raise ValueError(f"Invalid engine: {engine}")
+    data.setdefault("time_ms", DEFAULT_AI_TIME_MS)
+    engine, time_ms, depth = parse_ai_options(data)
+    return {"name": spec, "engine": engine, "time_ms": time_ms, "depth": depth}
+
+
+def format_move(position, move, check, mate):
+    """"Ac2-Ac3"、取る手は "Bb2xCc3"、昇格は "=Q"、王手は "+"、詰みは "#" を付ける"""
+    from_square, to_square, promotion = move_to_squares(move)
+    capture = position.board[move[1]] != EMPTY
+    text = from_square + ("x" if capture else "-") + to_square
+    if promotion:
+        text += "=" + promotion.upper()
+    if mate:
+        text += "#"
+    elif check:
+        text += "+"
+    return text
+
+
+def _get_engine():
+    global _engine
+    if _engine is None:
+        _engine = Engine(opening_book=open_book(default_book_path()),
+                         tablebase=Tablebase(default_tablebase_dir()),
+                         tt=TranspositionTable(TT_MB))
+    return _engine
+
+
+def play_game(index, white, black, max_plies, seed):
+    """
+    1 局指して結果の dict を返す (ワーカープロセスで動く)。
+    latencies は 1 手ごとの思考時間 (秒)、nodes は探索したノード数の合計。
+    """
+    engine = _get_engine()
+    random.seed(seed + index)
+    engine.tt.clear()
+    players = {
+        "white": dict(white, searcher=Searcher(engine.tt)),
+        "black": dict(black, searcher=Searcher(engine.tt)),
+    }
+    position = Position.initial()
+    tracker = DrawTracker(position)
+    moves, latencies = [], []
+    nodes = 0
+    started = time.perf_counter()
+    game_state = engine.check_gameend(position, tracker)
+    while game_state == "continue" and len(moves) < max_plies:
+        player = players[position.side_to_move]
+        t = time.perf_counter()
+        move, search_info = engine.choose_ai_move(position, player["engine"],
+                                                  player["time_ms"], player["depth"],
+                                                  player["searcher"])
+        latencies.append(time.perf_counter() - t)
+        if search_info is not None:
+            nodes += search_info["nodes"]
+
+        before = position.copy()
+        undo = position.make_move(move)
+        tracker.push(position.key, undo.moved_piece, undo.captured_piece)
+        game_state = engine.check_gameend(position, tracker)
+        moves.append(format_move(before, move, position.is_check(),
+                                 game_state == "checkmate"))
+
+    if game_state == "continue":
+        game_state = "max_plies"
+    if game_state == "checkmate":
+        # 詰まされたのは手番側
+        white_score = 0.0 if position.side_to_move == "white" else 1.0
+        result = "0-1" if white_score == 0.0 else "1-0"
+    else:
+        white_score, result = RESULTS[game_state]
+    return {
+        "index": index,
+        "white": white["name"],
+        "black": black["name"],
+        "result": result,
+        "white_score": white_score,
+        "termination": game_state,
+        "moves": moves,
+        "nodes": nodes,
+        "latencies": latencies,
+        "elapsed": time.perf_counter() - started,
+    }
+
+
+def format_pgn(game):
+    """PGN に似た棋譜の文字列 (手は format_move の "Ac2-Ac3" 形式)"""
+    lines = [
+        '[Event "raum selfplay"]',
+        f'[Round "{game["index"] + 1}"]',
+        f'[White "{game["white"]}"]',
+        f'[Black "{game["black"]}"]',
+        f'[Result "{game["result"]}"]',
+        f'[Termination "{game["termination"]}"]',
+        f'[PlyCount "{len(game["moves"])}"]',
+        "",
+    ]
+    tokens = []
+    for ply, move in enumerate(game["moves"]):
+        if ply % 2 == 0:
+            tokens.append(f"{ply // 2 + 1}.")
+        tokens.append(move)
+    tokens.append(game["result"])
+    # 1 行 80 文字程度で折り返す
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > 80:
+            lines.append(line)
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def percentile(sorted_values, p):
+    """ソート済みのリストの p パーセンタイル (最近傍)"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(games, elapsed, players):
+    """対局結果のリストから集計の dict を作る"""
+    latencies = sorted(t for game in games for t in game["latencies"])
+    nodes = sum(game["nodes"] for game in games)
+    plies = sum(len(game["moves"]) for game in games)
+    search_time = sum(latencies)
+    scores = {}
+    for name in players:
+        record = Counter()
+        for game in games:
+            for side, score in (("white", game["white_score"]),
+                                ("black", 1 - game["white_score"])):
+                if game[side] == name:
+                    record["win" if score == 1 else "loss" if score == 0 else "draw"] += 1
+                    record["score"] += score
+        scores[name] = {"win": record["win"], "draw": record["draw"],
+                        "loss": record["loss"], "score": record["score"]}
+    return {
+        "games": len(games),
+        "plies": plies,
+        "elapsed": elapsed,
+        "games_per_second": len(games) / elapsed if elapsed > 0 else 0.0,
+        "plies_per_second": plies / elapsed if elapsed > 0 else 0.0,
+        "nodes": nodes,
+        "nodes_per_second": nodes / search_time if search_time > 0 else 0.0,
+        "latency_ms": {
+            "mean": search_time / len(latencies) * 1000 if latencies else 0.0,
+            "p50": percentile(latencies, 50) * 1000,
+            "p90": percentile(latencies, 90) * 1000,
+            "p99": percentile(latencies, 99) * 1000,
+            "max": latencies[-1] * 1000 if latencies else 0.0,
+        },
+        "results": dict(Counter(game["result"] for game in games)),
+        "terminations": dict(Counter(game["termination"] for game in games)),
+        "players": scores,
+    }
+
+
+def print_summary(summary):
+    print(f"games      {summary['games']:8d}   {summary['games_per_second']:10.2f} games/s")
+    print(f"plies      {summary['plies']:8d}   {summary['plies_per_second']:10.1f} plies/s")
+    print(f"nodes      {summary['nodes']:8d}   {summary['nodes_per_second']:10.0f} nodes/s")
+    latency = summary["latency_ms"]
+    print("move ms    " + "  ".join(f"{key} {latency[key]:.1f}"
+                                    for key in ("mean", "p50", "p90", "p99", "max")))
+    print("results    " + "  ".join(f"{key} {count}"
+                                    for key, count in sorted(summary["results"].items())))
+    print("endings    " + "  ".join(f"{key} {count}"
+                                    for key, count in sorted(summary["terminations"].items())))
+    for name, record in summary["players"].items():
+        played = record["win"] + record["draw"] + record["loss"]
+        print(f"{name:24s} +{record['win']} ={record['draw']} -{record['loss']}"
+              f"  score {record['score']:.1f}/{played}")
+
+
+def compare_baseline(summary, baseline, threshold):
+    """baseline より threshold の割合以上悪くなった項目の名前のリスト"""
+    regressions = []
+    for key in ("games_per_second", "nodes_per_second"):
+        if baseline.get(key) and summary[key] < baseline[key] * (1 - threshold):
+            regressions.append(key)
+    for name, record in summary["players"].items():
+        before = baseline.get("players", {}).get(name)
+        if before and record["score"] < before["score"] * (1 - threshold):
+            regressions.append(f"score:{name}")
+    return regressions
+
+
+def run_tournament(count, player1, player2, workers, max_plies, seed, on_game=None):
+    """
+    count 局を workers 個のプロセスで指し、(対局結果のリスト, 経過秒数) を返す。
+    偶数局目は player1 が白、奇数局目は player2 が白。on_game は 1 局終わるごとに呼ぶ。
+    """
+    pairings = [(player1, player2) if i % 2 == 0 else (player2, player1)
+                for i in range(count)]
+    games = []
+    started = time.perf_counter()
+    if workers <= 1:
+        for index, (white, black) in enumerate(pairings):
+            games.append(play_game(index, white, black, max_plies, seed))
+            if on_game:
+                on_game(games[-1])
+    else:
+        # サーバーのモジュールはスレッドを起こすので、fork ではなく spawn で起動する
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = [
+                executor.submit(play_game, index, white, black, max_plies, seed)
+                for index, (white, black) in enumerate(pairings)
+            ]
+            for future in as_completed(futures):
+                games.append(future.result())
+                if on_game:
+                    on_game(games[-1])
+    elapsed = time.perf_counter() - started
+    games.sort(key=lambda game: game["index"])
+    return games, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", "--games", type=int, default=10)
+    parser.add_argument("-1", "--player1", default="search:depth=2",
+                        help='対局者 1 (既定 "search:depth=2")')
+    parser.add_argument("-2", "--player2", default="random",
+                        help='対局者 2 (既定 "random")')
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="対局を配るプロセス数 (1 ならこのプロセスで指す)")
+    parser.add_argument("--max-plies", type=int, default=DEFAULT_MAX_PLIES,
+                        help=f"この手数で打ち切る (既定 {DEFAULT_MAX_PLIES})")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pgn", metavar="FILE", help="棋譜を保存する")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="1 局ごとに結果を表示する")
+    parser.add_argument("--save", metavar="FILE", help="集計を JSON で保存する")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="保存済みの集計と比較する")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="baseline より何割悪ければ失敗とするか (既定 0.2)")
+    args = parser.parse_args()
+
+    try:
+        player1 = parse_player(args.player1)
+        player2 = parse_player(args.player2)
+    except ValueError as e:
+        parser.error(str(e))
+    if player1["name"] == player2["name"]:
+        player2["name"] += "#2"
+
+    def on_game(game):
+        if args.verbose:
+            print(f"game {game['index'] + 1:4d}: {game['white']} vs {game['black']}"
+                  f"  {game['result']:7s} {game['termination']} ({len(game['moves'])} plies)")
+
+    games, elapsed = run_tournament(args.games, player1, player2, args.workers,
+                                    args.max_plies, args.seed, on_game)
+    summary = summarize(games, elapsed, [player1["name"], player2["name"]])
+    print_summary(summary)
+
+    if args.pgn:
+        with open(args.pgn, "w") as f:
+            f.write("\n".join(format_pgn(game) for game in games))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(summary, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_baseline(summary, json.load(f), args.threshold)
+        if regressions:
+            print("regressions: " + ", ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
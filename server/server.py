@@ -1,12 +1,59 @@
+import atexit
+import json
+import os
+import threading
 import uuid
-import random
-from flask import Flask, request, jsonify
+import time
+from contextlib import contextmanager
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+
+from analysis import Analyzer
+from book import open_book
+from board import (
+    EMPTY,
+    SQUARE_INDEX,
+    Position,
+    Undo,
+    call_counts,
+    compute_key,
+    get_opponent_side,
+    get_piece_color,
+    move_to_squares,
+)
+from draws import DrawTracker
+from encoding import encode_state, pack_state, parse_format
+from engine import Engine, default_book_path, default_tablebase_dir, parse_ai_options
+from events import EventBroker
+from jobs import JobError, JobManager
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Registry
+from movecache import MoveCache
+from parallel import ParallelSearcher
+from profiler import SamplingProfiler
+from search import Searcher
+from store import open_store, start_sweeper
+from tablebase import Tablebase
+from transposition import TranspositionTable
 
 app = Flask(__name__)
 
 
+@app.before_request
+def before_request():
+    g.request_started = time.perf_counter()
+    g.profile_token = profiler.start()
+
+
 @app.after_request
 def after_request(response):
+    # ルートごとのレイテンシを記録し、遅ければプロファイラのスタックを書き出す
+    started = g.pop("request_started", None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        request_latency.observe(elapsed, method=request.method, route=route,
+                                status=str(response.status_code))
+        profiler.stop(g.pop("profile_token", None), f"{request.method} {route}", elapsed)
+
     # 必要なヘッダーを追加
     response.headers.add("Access-Control-Allow-Origin", "*")
     response.headers.add("Access-Control-Allow-Headers",
@@ -17,649 +64,439 @@ def after_request(response):
 
 
 # -----------------------------------
-# 1. データ構造・初期配置
+# 1. 盤面・指し手生成
 # -----------------------------------
 #
 # Raumschach は 5x5x5 のキューブ状のボードです。
-# 単純化のため、「レベル (A-E) x 行 (1-5) x 列 (a-e)」を
-# 文字列キー "Aa1", "Ee5" のように扱うことにします。
-#
-# 駒の表現例:
-#   "R" = 白 Rook
-#   "r" = 黒 Rook
-#   "N" = 白 Knight
-#   "n" = 黒 Knight
-#   ...
-#   大文字: 白, 小文字: 黒
-#   "."    : 空マス(何も置かれていない)
-#
-# 実際に Raumschach での正式な初期配置を再現しますが、簡単にするため
-# そこまで厳密にチェックしないコード例にします。
-LEVELS = ["A", "B", "C", "D", "E"]  # z=0..4
-COLS = ["a", "b", "c", "d", "e"]  # x=0..4
-ROWS = ["1", "2", "3", "4", "5"]  # y=0..4
-
-
-def in_range(lvl_idx, col_idx, row_idx):
-    """盤内かどうか判定する"""
-    return (0 <= lvl_idx < 5) and (0 <= col_idx < 5) and (0 <= row_idx < 5)
-
-
-def get_idx_from_square(square):
-    """
-    "Aa1" → (lvl_idx=0, col_idx=0, row_idx=0)
-    "Ec5" → (4,          2,         4)
-    """
-    lvl = square[0]  # A..E
-    col = square[1]  # a..e
-    row = square[2]  # 1..5
-
-    lvl_idx = LEVELS.index(lvl)
-    col_idx = COLS.index(col)
-    row_idx = ROWS.index(row)
-    return lvl_idx, col_idx, row_idx
-
-
-def get_square_from_idx(lvl_idx, col_idx, row_idx):
-    """(0,0,0) → "Aa1" などに変換"""
-    return LEVELS[lvl_idx] + COLS[col_idx] + ROWS[row_idx]
-
-
-def fix_piece_side(piece, side):
-    """駒の側面を修正する"""
-    if side == "white":
-        return piece.upper()
-    elif side == "black":
-        return piece.lower()
-    else:
-        raise ValueError(f"Invalid side: {side}")
-
-
-def create_empty_board():
-    """5x5x5 をすべて "." (空) にする。"""
-    board = {}
-    for lvl in LEVELS:
-        for row in ROWS:
-            for col in COLS:
-                key = lvl + col + row  # 例: "Aa1"
-                board[key] = "."
-    return board
-
-
-def init_board_raumschach():
-    """
-    Raumschach の初期配置を返す。
-    ここでは説明文にある駒をなるべく再現した例。
-    """
-    board = create_empty_board()
-
-    # White 側初期配置 (Level A, B)
-    # Level A
-    board["Aa1"] = "R"  # Rook
-    board["Ab1"] = "N"  # Knight
-    board["Ac1"] = "K"  # King
-    board["Ad1"] = "N"
-    board["Ae1"] = "R"
-    for c in COLS:
-        key = "A" + c + "2"
-        board[key] = "P"  # Pawn
-
-    # Level B
-    board["Ba1"] = "B"  # Bishop
-    board["Bb1"] = "U"  # Unicorn (仮)
-    board["Bc1"] = "Q"  # Queen
-    board["Bd1"] = "B"
-    board["Be1"] = "U"
-    for c in COLS:
-        key = "B" + c + "2"
-        board[key] = "P"
-
-    # Black 側初期配置 (Level D, E)
-    # Level E
-    board["Ea5"] = "r"  # Rook
-    board["Eb5"] = "n"  # Knight
-    board["Ec5"] = "k"  # King
-    board["Ed5"] = "n"
-    board["Ee5"] = "r"
-    for c in COLS:
-        key = "E" + c + "4"
-        board[key] = "p"  # Pawn
-
-    # Level D
-    board["Da5"] = "b"  # Bishop
-    board["Db5"] = "u"  # Unicorn
-    board["Dc5"] = "q"  # Queen
-    board["Dd5"] = "b"
-    board["De5"] = "u"
-    for c in COLS:
-        key = "D" + c + "4"
-        board[key] = "p"
-
-    return board
-
-
-# ゲームの状態を管理する簡易的な辞書
+# 盤面と指し手生成の本体は board.py にあり、125 マスの bytearray と
+# 整数のマス番号で動きます。"Aa1" キーの dict との変換は
+# このファイルの Flask ルーティング (JSON 境界) でだけ行います。
+
+# ゲームの状態を管理するストア (store.py)。環境変数 RAUM_STORE で
+# "memory" (既定) か "sqlite:<path>" を選ぶ。
 # key: game_id (UUID)
 # value: {
-#   "board": 盤面 (dict),
-#   "side_to_move": "white" or "black"
+#   "position": 局面 (board.Position: 盤面・手番・キングの位置・Zobrist キー),
+#   "captured_pieces": {"white": [...], "black": [...]},
+#   "ply": これまでに指された手数,
+#   "moves": 指された手の差分 (record_move の dict) のリスト,
+#   "undo_stack": moves と同じ順の board.Undo のリスト。待ったで局面を O(1) で戻す
+#                 (ストアには保存しない。undo_stack で取ると、ない分は差分から作り直す),
+#   "redo": 待ったで戻した手 (次にやり直す手が末尾) のリスト,
+#   "draws": 千日手・50 手ルール・駒不足の判定 (draws.DrawTracker。draw_tracker で取る。
+#            ストアには保存しない),
+#   "searcher": AI の探索 (search.Searcher)。同じゲームの次の手で
+#               置換表とヒストリーを引き継ぐ (ストアには保存しない)
 # }
-games = {}
+# 局面を書き換えたら games.save(game_id, game, delta) でストアに知らせる
+#
+# スレッドをまたいだ状態の扱い:
+#   - ゲームの状態 (局面・取った駒・手数・指し手) はゲームごとのロックの中でだけ
+#     読み書きする (locked_game でロックを取ってからストアで引く)。
+#     別のゲームへのリクエストは互いに待たない
+#   - AI はロックの外で局面のコピーを読み、指すときだけロックを取る
+#   - 合法手の生成・王手判定は盤面を書き換えない (board.py)
+#
+# 放置されたゲームは消す。上限は環境変数で指定する:
+#   RAUM_MAX_GAMES:         ゲーム数の上限 (既定 10000)
+#   RAUM_GAME_IDLE_SECONDS: この秒数使われなかったゲームを消す (既定 3600)
+MAX_GAMES = int(os.environ.get("RAUM_MAX_GAMES", "10000"))
+GAME_IDLE_SECONDS = float(os.environ.get("RAUM_GAME_IDLE_SECONDS", "3600"))
+
+
+def on_game_evicted(game_id):
+    # 消したゲームの購読者の接続を閉じる
+    game_events.close_game(game_id)
+
+
+@contextmanager
+def locked_game(game_id):
+    """
+    game_id のゲームのロックを取り、その中でストアから引いたゲームの dict
+    (なければ None) を返す。ロックを持っている間はストアのキャッシュから
+    追い出されないので、ほかのリクエストも同じ dict を読み書きする
+    """
+    lock = games.lock(game_id) if game_id else None
+    if lock is None:
+        yield None
+        return
+    with lock:
+        yield games.get(game_id)
+
+
+# 指し手の差分を GET /games/<game_id>/events の購読者に配る
+game_events = EventBroker()
+
+# 局面 (Zobrist キー) ごとの合法手リストのキャッシュ。
+# /possible_moves・/apply_move・/get_move・check_gameend で共有する
+move_cache = MoveCache()
+
+# GET /metrics で返すメトリクス (metrics.py)。キャッシュなどの今の値は
+# collect_metrics で render のたびに読む。AI のメトリクスは ai_engine が足す
+metrics = Registry()
+request_latency = metrics.histogram(
+    "raum_http_request_duration_seconds", "HTTP request latency by route",
+    ("method", "route", "status"),
+)
+
+# ストア・置換表・ワーカープロセスなど、スレッドやプロセスを持つものは
+# create_app で作る。ワーカープロセス (spawn) はこのファイルを __main__ として
+# import し直すので、import しただけでは作らない
+games = None
+transposition_table = None
+parallel_searcher = None
+ai_jobs = None
+opening_book = None
+tablebase = None
+analyzer = None
+profiler = None
+ai_engine = None
+
+
+def create_app():
+    """
+    ストアやワーカーを作って app を返す。2 回目以降は何もせず同じ app を返す。
+    python server.py で起動するときはここから呼ぶ。WSGI サーバーでは
+    "server:create_app()" を指定する。
+    """
+    global games, transposition_table, parallel_searcher, ai_jobs
+    global opening_book, tablebase, analyzer, profiler, ai_engine
+    if games is not None:
+        return app
+
+    # ゲームの状態を管理するストア (store.py)。環境変数 RAUM_STORE で
+    # "memory" (既定) か "sqlite:<path>" を選ぶ
+    games = open_store(
+        os.environ.get("RAUM_STORE", "memory"),
+        max_games=MAX_GAMES,
+        idle_seconds=GAME_IDLE_SECONDS,
+        on_evict=on_game_evicted,
+    )
+    atexit.register(games.close)
+    start_sweeper(games)
+
+    # AI の探索で使う置換表。プロセス内の全ゲームで共有する。
+    # サイズ (MB) は起動時に環境変数 RAUM_TT_MB で指定する
+    tt_mb = int(os.environ.get("RAUM_TT_MB", "32"))
+    transposition_table = TranspositionTable(tt_mb)
+
+    # AI の探索をワーカープロセスに分担させる数 (環境変数 RAUM_AI_WORKERS)。
+    # 0 (既定) ならリクエストのスレッドで探索する
+    ai_workers = int(os.environ.get("RAUM_AI_WORKERS", "0"))
+    if ai_workers > 0:
+        parallel_searcher = ParallelSearcher(ai_workers, tt_mb, transposition_table)
+        atexit.register(parallel_searcher.shutdown, wait=True)
+
+    # /get_move の AI の手を読むジョブ。"async": true でなければ終わるまで待って返す。
+    # 同時に計算するジョブの数は環境変数 RAUM_AI_JOB_THREADS で指定する
+    ai_jobs = JobManager(int(os.environ.get("RAUM_AI_JOB_THREADS", "4")))
+    # ジョブのスレッド (ThreadPoolExecutor) は atexit より前の threading の終了処理で
+    # 待たれるので、待ち行列のジョブを捨てる shutdown はそこに登録する
+    threading._register_atexit(ai_jobs.shutdown)
+
+    # 序盤の定跡 (book.py で作る)。環境変数 RAUM_OPENING_BOOK でファイルを指定する
+    # (既定はこのファイルと同じディレクトリの opening_book.bin。なければ使わない)
+    opening_book = open_book(default_book_path())
+
+    # 駒の少ない終盤の tablebase (retrograde.py で作る)。環境変数 RAUM_TABLEBASE_DIR で
+    # ディレクトリを指定する (既定はこのファイルと同じディレクトリの tablebases。なければ使わない)
+    tablebase = Tablebase(default_tablebase_dir())
+
+    # AI の手を選び、終局を判定する (engine.py)
+    ai_engine = Engine(move_cache, opening_book, tablebase, transposition_table,
+                       parallel_searcher, metrics)
+
+    # POST /analyze で局面を解析するワーカープロセスの数 (環境変数 RAUM_ANALYSIS_WORKERS)。
+    # 省略時は CPU の数。0 ならリクエストのスレッドで解析する
+    analyzer = Analyzer(
+        int(os.environ["RAUM_ANALYSIS_WORKERS"])
+        if "RAUM_ANALYSIS_WORKERS" in os.environ else None
+    )
+    atexit.register(analyzer.shutdown)
+
+    # 遅いリクエストのスタックを書き出すサンプリングプロファイラ (profiler.py)。
+    # 既定は無効。環境変数 RAUM_PROFILE_SLOW_MS (この時間以上かかったリクエストを書き出す)
+    # を指定するか、POST /profiler で有効にする。書き出し先は RAUM_PROFILE_DIR
+    profiler = SamplingProfiler(os.environ.get("RAUM_PROFILE_DIR", "profiles"))
+    if "RAUM_PROFILE_SLOW_MS" in os.environ:
+        profiler.configure(enabled=True,
+                           slow_seconds=float(os.environ["RAUM_PROFILE_SLOW_MS"]) / 1000)
+    return app
 
 
 # -----------------------------------
-# 2. 合法手(らしきもの)生成 (非常に簡易版)
+# 2. AI
 # -----------------------------------
 #
-# Raumschach の完全な動きを実装しようとすると膨大になります。
-# ここではあくまで「存在する駒の位置から、適当に数マス先へ動かせる」
-# 程度の例で、AI はその中からランダムに一手を選ぶだけです。
-#
+# /get_move の body で探索の設定を受け取る (engine.parse_ai_options):
+#   "engine":  "search" (既定, 反復深化 alpha-beta) or "random" (ランダムに 1 手)
+#   "time_ms": 1 手の持ち時間 (ミリ秒, 既定 DEFAULT_AI_TIME_MS, 上限 MAX_AI_TIME_MS)
+#   "depth":   読む深さの上限 (省略時は持ち時間いっぱいまで)
+#   "async":   true ならすぐに job_id を返し、結果は GET /jobs/<job_id> で受け取る
+# 持ち時間と深さを変えることで AI の強さ (難易度) を調整できる。
+# 手の選び方 (定跡・tablebase・探索) と終局の判定は engine.py の Engine (ai_engine)
 
+# GET /jobs/<job_id>?wait=秒 で待てる上限 (秒)
+MAX_JOB_WAIT_SECONDS = 30
 
-def get_piece_color(piece: str) -> str:
-    """'R' (白) or 'r' (黒) -> 'white' or 'black'"""
-    if piece == ".":
-        return "none"
-    return "white" if piece.isupper() else "black"
-
-
-ROOK_DIRS = [
-    (1, 0, 0),
-    (-1, 0, 0),  # レベル方向 (A->B->C->D->E)
-    (0, 1, 0),
-    (0, -1, 0),  # 横(列)
-    (0, 0, 1),
-    (0, 0, -1),  # 縦(行)
-]
-
-BISHOP_DIRS = [
-    # x-y面 (z=一定)
-    (0, 1, 1),
-    (0, 1, -1),
-    (0, -1, 1),
-    (0, -1, -1),
-    # x-z面 (y=一定)
-    (1, 0, 1),
-    (1, 0, -1),
-    (-1, 0, 1),
-    (-1, 0, -1),
-    # y-z面 (x=一定)
-    (1, 1, 0),
-    (1, -1, 0),
-    (-1, 1, 0),
-    (-1, -1, 0),
-]
-
-UNICORN_DIRS = [
-    (1, 1, 1),
-    (1, 1, -1),
-    (1, -1, 1),
-    (1, -1, -1),
-    (-1, 1, 1),
-    (-1, 1, -1),
-    (-1, -1, 1),
-    (-1, -1, -1),
-]
-QUEEN_DIRS = ROOK_DIRS + BISHOP_DIRS + UNICORN_DIRS
-KNIGHT_DELTAS = [
-    # x-y平面 (z=0)
-    (2, 1, 0),
-    (2, -1, 0),
-    (-2, 1, 0),
-    (-2, -1, 0),
-    (1, 2, 0),
-    (1, -2, 0),
-    (-1, 2, 0),
-    (-1, -2, 0),
-    # x-z平面 (y=0)
-    (2, 0, 1),
-    (2, 0, -1),
-    (-2, 0, 1),
-    (-2, 0, -1),
-    (1, 0, 2),
-    (1, 0, -2),
-    (-1, 0, 2),
-    (-1, 0, -2),
-    # y-z平面 (x=0)
-    (0, 2, 1),
-    (0, 2, -1),
-    (0, -2, 1),
-    (0, -2, -1),
-    (0, 1, 2),
-    (0, 1, -2),
-    (0, -1, 2),
-    (0, -1, -2),
-]
-
-KING_DELTAS = [
-    (0, 0, -1),
-    (0, 0, 1),
-    (0, -1, -1),
-    (0, -1, 0),
-    (0, -1, 1),
-    (0, 1, -1),
-    (0, 1, 0),
-    (0, 1, 1),
-    (1, 0, -1),
-    (1, 0, 0),
-    (1, 0, 1),
-    (1, -1, -1),
-    (1, -1, 0),
-    (1, -1, 1),
-    (1, 1, -1),
-    (1, 1, 0),
-    (1, 1, 1),
-    (-1, 0, -1),
-    (-1, 0, 0),
-    (-1, 0, 1),
-    (-1, -1, -1),
-    (-1, -1, 0),
-    (-1, -1, 1),
-    (-1, 1, -1),
-    (-1, 1, 0),
-    (-1, 1, 1),
-]
-
-PAWN_PASSIVE_DELTAS = [(1, 0, 0), (0, 0, 1)]
-PAWN_CAPTURE_DELTAS = [(1, -1, 0), (1, 1, 0), (0, -1, 1), (0, 1, 1)]
-
-
-# get_candidate_squares_3d(board, from_square, side_to_move) するときは
-# 1. 現在、自分のkingがチェックされているか確認する
-# 2. その手をしたときに、自分のkingがチェックされるかを確認する
-# 必要な関数は、boardとsideを受け取って、そのsideのkingがチェックされているかを返す関数
-# is_check(board, side) -> bool
-
-def get_king_square(board, side):
-    """指定した side の King の位置を返す"""
-    for lvl in LEVELS:
-        for row in ROWS:
-            for col in COLS:
-                square = lvl + col + row
-                piece = board[square]
-                if piece == fix_piece_side("K", side):
-                    return square
-    return None
-
-
-def is_check(board, side):
-    """指定した side の King が王手かどうかを判定する"""
-    king_square = get_king_square(board, side)
-    for lvl in LEVELS:
-        for row in ROWS:
-            for col in COLS:
-                square = lvl + col + row
-                piece = board[square]
-                if piece == ".":
-                    continue
-                if get_piece_color(piece) == side:
-                    continue
-                candidate_squares = get_candidate_squares_3d(
-                    board, square, get_opponent_side(side), only_pawn_capture=True)
-                if king_square in candidate_squares:
-                    return True
-    return False
-
-
-def slide_in_direction(board, from_square, d_lvl, d_col, d_row, side_to_move):
-    """
-    from_square から (d_lvl, d_col, d_row) 方向へ
-    1マスずつ進み、行けるマス(相手駒ならそこまで含む)を返す。
-    味方駒があった場合はその手前まで。
-    """
-    moves = []
-    lvl_idx, col_idx, row_idx = get_idx_from_square(from_square)
-
-    while True:
-        lvl_idx += d_lvl
-        col_idx += d_col
-        row_idx += d_row
-        if not in_range(lvl_idx, col_idx, row_idx):
-            break  # 盤外に出たので終了
-
-        square = get_square_from_idx(lvl_idx, col_idx, row_idx)
-        piece_at = board[square]
-        if piece_at == ".":
-            # 空マス → 移動可能
-            moves.append(square)
-        else:
-            # 駒がある
-            if get_piece_color(piece_at) != side_to_move:
-                # 敵駒なら 取って終了
-                moves.append(square)
-            # 味方駒 or 敵駒 いずれにせよこの先には進めない
-            break
-    return moves
-
-
-def get_candidate_squares_3d(board, from_square, side_to_move, only_pawn_capture=False):
-    """
-    from_square にある駒の種類を判別し、
-    Raumschachにおける合法手(スライド or ナイトジャンプ)を返す。
-    """
-    piece = board[from_square]
-    if piece == ".":
-        return []  # 空マス
-
-    # 大文字・小文字を区別せず動きは同じ
-    piece_type = piece.upper()  # R, B, U, Q, N など
-
-    moves = []
-
-    if piece_type == "R":
-        # Rook
-        for d in ROOK_DIRS:
-            moves.extend(
-                slide_in_direction(board, from_square,
-                                   d[0], d[1], d[2], side_to_move)
-            )
-
-    elif piece_type == "B":
-        # Bishop
-        for d in BISHOP_DIRS:
-            moves.extend(
-                slide_in_direction(board, from_square,
-                                   d[0], d[1], d[2], side_to_move)
-            )
-
-    elif piece_type == "U":
-        # Unicorn
-        for d in UNICORN_DIRS:
-            moves.extend(
-                slide_in_direction(board, from_square,
-                                   d[0], d[1], d[2], side_to_move)
-            )
-
-    elif piece_type == "Q":
-        # Queen = Rook + Bishop + Unicorn
-        for d in QUEEN_DIRS:
-            moves.extend(
-                slide_in_direction(board, from_square,
-                                   d[0], d[1], d[2], side_to_move)
-            )
-
-    elif piece_type == "N":
-        # Knight (1stepジャンプ)
-        lvl_idx, col_idx, row_idx = get_idx_from_square(from_square)
-        for dL, dC, dR in KNIGHT_DELTAS:
-            L2 = lvl_idx + dL
-            C2 = col_idx + dC
-            R2 = row_idx + dR
-            if in_range(L2, C2, R2):
-                sq2 = get_square_from_idx(L2, C2, R2)
-                target_piece = board[sq2]
-                # 味方駒がいる場合はNG
-                if target_piece == ".":
-                    moves.append(sq2)
-                else:
-                    if get_piece_color(target_piece) != side_to_move:
-                        moves.append(sq2)
-                # Knightはジャンプなのでそれ以上続かない
-
-    elif piece_type == "K":
-        lvl_idx, col_idx, row_idx = get_idx_from_square(from_square)
-        for dL, dC, dR in KING_DELTAS:
-            L2 = lvl_idx + dL
-            C2 = col_idx + dC
-            R2 = row_idx + dR
-            if in_range(L2, C2, R2):
-                sq2 = get_square_from_idx(L2, C2, R2)
-                target_piece = board[sq2]
-                # 味方駒がいる場合はNG
-                if target_piece == ".":
-                    moves.append(sq2)
-                else:
-                    if get_piece_color(target_piece) != side_to_move:
-                        moves.append(sq2)
-
-    elif piece_type == "P":
-        lvl_idx, col_idx, row_idx = get_idx_from_square(from_square)
-        if not only_pawn_capture:
-            for dL, dC, dR in PAWN_PASSIVE_DELTAS:
-                if side_to_move == "white":
-                    L2 = lvl_idx + dL
-                    C2 = col_idx + dC
-                    R2 = row_idx + dR
-                else:
-                    L2 = lvl_idx - dL
-                    C2 = col_idx - dC
-                    R2 = row_idx - dR
-                if in_range(L2, C2, R2):
-                    sq2 = get_square_from_idx(L2, C2, R2)
-                    target_piece = board[sq2]
-                    # 味方駒、敵駒がいる場合はNG
-                    if target_piece == ".":
-                        moves.append(sq2)
-        for dL, dC, dR in PAWN_CAPTURE_DELTAS:
-            if side_to_move == "white":
-                L2 = lvl_idx + dL
-                C2 = col_idx + dC
-                R2 = row_idx + dR
-            else:
-                L2 = lvl_idx - dL
-                C2 = col_idx - dC
-                R2 = row_idx - dR
-            if in_range(L2, C2, R2):
-                sq2 = get_square_from_idx(L2, C2, R2)
-                target_piece = board[sq2]
-                # 味方駒、空白がいる場合はNG
-                if (
-                    target_piece != "."
-                    and get_piece_color(target_piece) != side_to_move
-                ):
-                    moves.append(sq2)
-
-    return moves
-
-
-def get_opponent_side(side_to_move):
-    if side_to_move == "white":
-        return "black"
-    elif side_to_move == "black":
-        return "white"
-    else:
-        raise ValueError(f"Invalid side_to_move: {side_to_move}")
-
-
-def generate_all_moves(board, side_to_move):
-    """指定した手番の全ての(雑な)可能手を生成して返す。"""
-    moves = []
-    for lvl in LEVELS:
-        for row in ROWS:
-            for col in COLS:
-                from_square = lvl + col + row
-                piece = board[from_square]
-                if piece == "." or get_piece_color(piece) != side_to_move:
-                    continue
-
-                candidate_squares = get_candidate_squares_3d(
-                    board, from_square, side_to_move
-                )
-
-                # move が王手にならないかどうかチェック
-                for to_square in candidate_squares:
-                    if can_move_to(board, from_square, to_square, side_to_move):
-                        if piece == "P" and to_square[0] == "E" and to_square[2] == "5":
-                            moves.append((from_square, to_square, "Q"))
-                            moves.append((from_square, to_square, "N"))
-                            moves.append((from_square, to_square, "U"))
-                            moves.append((from_square, to_square, "R"))
-                            moves.append((from_square, to_square, "B"))
-                        elif piece == "p" and to_square[0] == "A" and to_square[2] == "1":
-                            moves.append((from_square, to_square, "q"))
-                            moves.append((from_square, to_square, "n"))
-                            moves.append((from_square, to_square, "u"))
-                            moves.append((from_square, to_square, "r"))
-                            moves.append((from_square, to_square, "b"))
-                        else:
-                            moves.append((from_square, to_square, None))
-    return moves
-
-
-def get_candidate_squares_around(board, square):
-    """
-    square の周囲数マス(上下左右前後 + 斜め)を
-    適当に返すだけ。実際の Raumschach の動きとは異なります。
-    """
-    lvl = square[0]  # 'A' ~ 'E'
-    col = square[1]  # 'a' ~ 'e'
-    row = square[2]  # '1' ~ '5'
-
-    lvl_idx = LEVELS.index(lvl)
-    col_idx = COLS.index(col)
-    row_idx = ROWS.index(row)
-
-    offsets = [
-        (-1, 0, 0),
-        (1, 0, 0),  # 上下 (Level A->B->C->D->E)
-        (0, -1, 0),
-        (0, 1, 0),  # 左右
-        (0, 0, -1),
-        (0, 0, 1),  # 前後
-        # 斜め方向(各軸 +/-1 組み合わせ)
-        (-1, -1, 0),
-        (-1, 1, 0),
-        (1, -1, 0),
-        (1, 1, 0),
-        (-1, 0, -1),
-        (-1, 0, 1),
-        (1, 0, -1),
-        (1, 0, 1),
-        (0, -1, -1),
-        (0, -1, 1),
-        (0, 1, -1),
-        (0, 1, 1),
-        # 3D 斜め (レベルも含む)
-        (-1, -1, -1),
-        (-1, -1, 1),
-        (-1, 1, -1),
-        (-1, 1, 1),
-        (1, -1, -1),
-        (1, -1, 1),
-        (1, 1, -1),
-        (1, 1, 1),
-    ]
 
-    result = []
-    for d_lvl, d_col, d_row in offsets:
-        new_lvl_idx = lvl_idx + d_lvl
-        new_col_idx = col_idx + d_col
-        new_row_idx = row_idx + d_row
-        if 0 <= new_lvl_idx < 5 and 0 <= new_col_idx < 5 and 0 <= new_row_idx < 5:
-            new_lvl = LEVELS[new_lvl_idx]
-            new_col = COLS[new_col_idx]
-            new_row = ROWS[new_row_idx]
-            result.append(new_lvl + new_col + new_row)
-    return result
+def play_ai_move(game_id, snapshot, engine, time_ms, depth, fmt="json", since_ply=None):
+    """
+    game_id のゲームで AI の手を読んで指し、/get_move のレスポンスの dict を返す。
+    盤面は fmt / since_ply に従って encode_state で表す。
+    snapshot は依頼を受けた時点の局面のコピーで、読むのはこちら。
+    指す直前に局面が snapshot のままかをゲームのロックの中で確かめ、
+    途中で人が指していたら JobError。
+    """
+    with locked_game(game_id) as game:
+        if game is None:
+            raise JobError("Invalid game_id")
+        if "searcher" not in game:
+            game["searcher"] = Searcher(transposition_table)
+        searcher = game["searcher"]
+
+    move, search_info = ai_engine.choose_ai_move(snapshot, engine, time_ms, depth, searcher)
+    if move is None:
+        return {"move": None}
+
+    with locked_game(game_id) as game:
+        if game is None:
+            raise JobError("Game expired during AI search")
+        position = game["position"]
+        if position.board != snapshot.board or position.side_to_move != snapshot.side_to_move:
+            raise JobError("Position changed during AI search")
+
+        # 駒を動かして手番交代。取った駒があれば捕獲リストに追加
+        draw_tracker(game)
+        delta = record_move(game_id, game, position.make_move(move))
+
+        return {
+            "move": {"from": delta["from"], "to": delta["to"], "piece": delta["piece"]},
+            **encode_game(game, fmt, since_ply),
+            "search": search_info,
+        }
+
+
+def encode_game(game, fmt="json", since_ply=None):
+    """ゲームの盤面・手番・取った駒・手数をレスポンス用の dict にする"""
+    return encode_state(game["position"], game["captured_pieces"], game["ply"],
+                        game["moves"], fmt, since_ply)
 
 
-def can_move_to(board, from_square, to_square, side_to_move):
-    """ 王手にならないかどうか """
+def record_move(game_id, game, undo, clear_redo=True):
+    """
+    game["position"].make_move で指し終えた手 (undo はその記録) をゲームに記録し、
+    その差分を購読者に配る。差分の dict を返す。
+    ゲームのロックの中で呼ぶこと (購読者に届く順番が指した順になるように)。
+    """
+    position = game["position"]
+    move, captured = undo.move, undo.captured
+    side_to_move = get_opponent_side(position.side_to_move)
+    game["ply"] += 1
+    if captured:
+        game["captured_pieces"][side_to_move].append(captured)
+    tracker = game["draws"]  # 指す前に draw_tracker(game) で作ってある
+    tracker.push(position.key, undo.moved_piece, undo.captured_piece)
+    undo_stack(game).append(undo)
+    if clear_redo:
+        game["redo"] = []
+
+    from_sq, to_sq, promotion = move_to_squares(move)
+    delta = {
+        "ply": game["ply"],
+        "from": from_sq,
+        "to": to_sq,
+        "promotion": promotion,
+        "piece": chr(position.board[move[1]]),
+        "captured": captured,
+        "side_to_move": position.side_to_move,
+        "check": position.is_check(),
+        "game_state": ai_engine.check_gameend(position, tracker),
+    }
+    game["moves"].append(delta)
+    games.save(game_id, game, delta)
+    game_events.publish(game_id, delta)
+    return delta
 
-    old_piece = board[to_square]
-    board[to_square] = board[from_square]
-    board[from_square] = "."
 
-    # 王手になるかどうか
-    is_checking = is_check(board, side_to_move)
+def undo_from_delta(delta):
+    """
+    差分から board.Undo を作り直す (ストアから読み直したゲーム用)。
+    指す前の Zobrist キーは分からないので key は None にする
+    """
+    move = (SQUARE_INDEX[delta["from"]], SQUARE_INDEX[delta["to"]], delta["promotion"])
+    moved_piece = delta["piece"]
+    if delta["promotion"]:
+        moved_piece = "P" if moved_piece.isupper() else "p"
+    captured_piece = ord(delta["captured"]) if delta["captured"] else EMPTY
+    return Undo(move, ord(moved_piece), captured_piece, None)
 
-    # 元に戻す
-    board[from_square] = board[to_square]
-    board[to_square] = old_piece
 
-    return not is_checking
+def undo_stack(game):
+    """
+    ゲームの board.Undo のスタック (moves と 1 手ずつ対応)。ストアから読み直した
+    ゲームにはないか手数が合わないので、手の記録から作り直す。ゲームのロックの中で呼ぶこと。
+    """
+    stack = game.get("undo_stack")
+    if stack is None or len(stack) != len(game["moves"]):
+        stack = game["undo_stack"] = [undo_from_delta(delta) for delta in game["moves"]]
+    return stack
 
 
-# -----------------------------------
-# 3. AI (最弱: ランダムに動く)
-# -----------------------------------
-def choose_ai_move(board, side_to_move):
-    """side_to_move の全合法手(らしきもの)からランダムに 1手選ぶ。なければ None"""
-    moves = generate_all_moves(board, side_to_move)
-    if not moves:
+def draw_tracker(game):
+    """
+    ゲームの引き分け判定 (draws.DrawTracker)。ストアから読み直したゲームには
+    ないので、手の記録を初手までたどって作り直す。ゲームのロックの中で呼ぶこと。
+    """
+    tracker = game.get("draws")
+    if tracker is None:
+        position = game["position"].copy()
+        undos = []
+        for delta in reversed(game["moves"]):
+            undo = undo_from_delta(delta)
+            position.unmake_move(undo)
+            position.key = compute_key(position.board, position.side_to_move)
+            undos.append(undo)
+        tracker = DrawTracker(position)
+        for undo in reversed(undos):
+            position.make_move(undo.move)
+            tracker.push(position.key, undo.moved_piece, undo.captured_piece)
+        game["draws"] = tracker
+    return tracker
+
+
+def unrecord_move(game_id, game):
+    """
+    game の最後の手を戻し、"undo" イベントを配る。戻した手の差分を返す
+    (戻す手がなければ None)。ゲームのロックの中で呼ぶこと。
+    """
+    if not game["moves"]:
         return None
-    return random.choice(moves)
+    draw_tracker(game).pop(game["position"].key)
+    undo = undo_stack(game).pop()
+    delta = game["moves"].pop()
+
+    position = game["position"]
+    position.unmake_move(undo)
+    if undo.key is None:
+        position.key = compute_key(position.board, position.side_to_move)
+    if delta["captured"]:
+        game["captured_pieces"][position.side_to_move].pop()
+    game["ply"] -= 1
+    game.setdefault("redo", []).append(undo.move)
+
+    games.save(game_id, game)
+    game_events.publish(game_id, {"ply": game["ply"], "undone": delta}, "undo")
+    return delta
 
 
 # -----------------------------------
-# 4. Flask ルーティング
+# 3. Flask ルーティング
 # -----------------------------------
 @app.route("/new_game", methods=["POST"])
 def new_game():
+    data = request.get_json(silent=True) or {}
+    try:
+        fmt, _ = parse_format(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     game_id = str(uuid.uuid4())
-    board = init_board_raumschach()
-    games[game_id] = {
-        "board": board,
-        "side_to_move": "white",
+    position = Position.initial()
+    game = {
+        "position": position,
         "captured_pieces": {"white": [], "black": []},  # 白が取った駒  # 黒が取った駒
+        "ply": 0,
+        "moves": [],
+        "undo_stack": [],
+        "redo": [],
+        "draws": DrawTracker(position),
+        "searcher": Searcher(transposition_table),
     }
-    return jsonify(
-        {
-            "game_id": game_id,
-            "board": board,
-            "side_to_move": "white",
-            "captured_pieces": {"white": [], "black": []},
-        }
-    )
+    games.add(game_id, game)
+    return jsonify({"game_id": game_id, **encode_game(game, fmt)})
+
+
+def profiled_job(name, fn, *args):
+    """
+    ジョブのスレッドで fn(*args) を呼ぶ。プロファイラが有効なら、
+    リクエストと同じくこのスレッドのスタックも集めて遅ければ書き出す
+    """
+    token = profiler.start()
+    started = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        profiler.stop(token, name, time.perf_counter() - started)
 
 
 @app.route("/get_move", methods=["POST"])
 def get_move():
     data = request.json
     game_id = data.get("game_id")
-    if not game_id or game_id not in games:
-        return jsonify({"error": "Invalid game_id"}), 400
-
-    board = games[game_id]["board"]
-    side_to_move = games[game_id]["side_to_move"]
-    captured_pieces = games[game_id]["captured_pieces"]
-
-    move = choose_ai_move(board, side_to_move)
-    if move is None:
-        return jsonify({"move": None})
-
-    from_sq, to_sq, promotion = move
-    target_piece = board[to_sq]  # 移動先の駒(取る駒かもしれない)
-    moved_piece = board[from_sq]
-
-    # もし駒があれば、それを取る(＝捕獲リストに追加)
-    if target_piece != ".":
-        if side_to_move == "white":
-            captured_pieces["white"].append(target_piece)  # 白が黒駒を取った
-        else:
-            captured_pieces["black"].append(target_piece)  # 黒が白駒を取った
+    try:
+        engine, time_ms, depth = parse_ai_options(data)
+        fmt, since_ply = parse_format(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    with locked_game(game_id) as game:
+        if game is None:
+            return jsonify({"error": "Invalid game_id"}), 400
+        over = game_over_response(game)
+        if over is not None:
+            return over
+        snapshot = game["position"].copy()
+
+    # 同期でもジョブとして読むので、1 つのゲームで AI が同時に読むのは
+    # (同じ searcher を使うのは) いつも 1 つだけ
+    job, created = ai_jobs.submit(
+        game_id,
+        lambda: profiled_job("job /get_move", play_ai_move,
+                             game_id, snapshot, engine, time_ms, depth, fmt, since_ply),
+    )
+    if not created:
+        return jsonify({"error": "AI move already in progress", **job.to_dict()}), 409
+    if data.get("async"):
+        return jsonify(job.to_dict()), 202
 
-    if promotion:
-        moved_piece = promotion
-    board[to_sq] = moved_piece
-    board[from_sq] = "."
+    job.wait()
+    if job.error is not None:
+        return jsonify({"error": job.error}), 409
+    return jsonify(job.result)
 
-    # 手番交代
-    next_side = "black" if side_to_move == "white" else "white"
-    games[game_id]["side_to_move"] = next_side
 
-    return jsonify(
-        {
-            "move": {"from": from_sq, "to": to_sq, "piece": moved_piece},
-            "board": board,
-            "side_to_move": next_side,
-            "captured_pieces": captured_pieces,
-        }
-    )
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """
+    AI のジョブの状態を返す。終わっていれば result に /get_move と同じ形の結果が入る。
+    ?wait=秒 を付けると、終わるまで最大その秒数待ってから返す (long-poll)。
+    """
+    job = ai_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Invalid job_id"}), 404
 
+    try:
+        wait = float(request.args.get("wait", 0))
+    except ValueError:
+        return jsonify({"error": "Invalid wait"}), 400
+    if wait > 0:
+        job.wait(min(wait, MAX_JOB_WAIT_SECONDS))
+    return jsonify(job.to_dict())
 
-def check_gameend(board, next_side):
-    is_cheking = is_check(board, next_side)
-    moves = generate_all_moves(board, next_side)
-    is_no_move = len(moves) == 0
 
-    if is_cheking and not moves:
-        return "checkmate"
-    elif not is_cheking and not moves:
-        return "stalemate"
-    else:
-        return "continue"
+def game_over_response(game):
+    """
+    引き分けで終わったゲームならエラーのレスポンスを、続けられるなら None を返す。
+    (詰み・ステイルメイトは合法手がないので、指そうとしても Illegal move になる)
+    ゲームのロックの中で呼ぶこと。
+    """
+    reason = draw_tracker(game).draw_reason(game["position"])
+    if reason is None and ai_engine.is_dead(game["position"]):
+        reason = "insufficient_material"
+    if reason is None:
+        return None
+    return jsonify({"error": "Game is over", "game_state": reason}), 400
 
 
 @app.route("/apply_move", methods=["POST"])
@@ -669,47 +506,34 @@ def apply_move():
     from_sq = data.get("from")
     to_sq = data.get("to")
     promotion = data.get("promotion")
-    print(promotion)
 
-    if not game_id or game_id not in games:
-        return jsonify({"error": "Invalid game_id"}), 400
-
-    board = games[game_id]["board"]
-    side_to_move = games[game_id]["side_to_move"]
-    captured_pieces = games[game_id]["captured_pieces"]
-
-    all_moves = generate_all_moves(board, side_to_move)
-    if (from_sq, to_sq, promotion) not in all_moves:
-        return jsonify({"error": "Illegal move"}), 400
-
-    target_piece = board[to_sq]  # 移動先にある駒
-    moved_piece = board[from_sq]
-
-    # もしそこに相手の駒がいたら取る
-    if target_piece != ".":
-        if side_to_move == "white":
-            captured_pieces["white"].append(target_piece)
-        else:
-            captured_pieces["black"].append(target_piece)
-
-    # 駒を動かす
-    if promotion:
-        moved_piece = promotion
-    board[to_sq] = moved_piece
-    board[from_sq] = "."
-
-    # 手番交代
-    next_side = "black" if side_to_move == "white" else "white"
-    games[game_id]["side_to_move"] = next_side
+    try:
+        fmt, since_ply = parse_format(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    move = (SQUARE_INDEX.get(from_sq), SQUARE_INDEX.get(to_sq), promotion)
+    with locked_game(game_id) as game:
+        if game is None:
+            return jsonify({"error": "Invalid game_id"}), 400
+        position = game["position"]
+        over = game_over_response(game)
+        if over is not None:
+            return over
+        all_moves = move_cache.legal_moves(position)
+        if move not in all_moves:
+            return jsonify({"error": "Illegal move"}), 400
+
+        # 駒を動かして手番交代。そこに相手の駒がいたら取る
+        delta = record_move(game_id, game, position.make_move(move))
+        state = encode_game(game, fmt, since_ply)
 
     return jsonify(
         {
             "success": True,
-            "board": board,
-            "side_to_move": next_side,
-            "captured_pieces": captured_pieces,
-            "check": is_check(board, next_side),
-            "game_state": check_gameend(board, next_side)
+            **state,
+            "check": delta["check"],
+            "game_state": delta["game_state"]
         }
     )
 
@@ -729,26 +553,311 @@ def possible_moves():
     game_id = data.get("game_id")
     from_sq = data.get("square")
 
-    if not game_id or game_id not in games:
-        return jsonify({"error": "Invalid game_id"}), 400
-
-    board = games[game_id]["board"]
-    side_to_move = games[game_id]["side_to_move"]
+    with locked_game(game_id) as game:
+        if game is None:
+            return jsonify({"error": "Invalid game_id"}), 400
+        position = game["position"]
+        side_to_move = position.side_to_move
 
-    # 駒の色が現在の手番(side_to_move)と一致しているか簡易チェック
-    piece = board.get(from_sq, ".")
-    if piece == "." or get_piece_color(piece) != side_to_move:
-        return jsonify({"error": "Not your piece"}), 400
+        # 駒の色が現在の手番(side_to_move)と一致しているか簡易チェック
+        from_idx = SQUARE_INDEX.get(from_sq)
+        piece = "." if from_idx is None else chr(position.board[from_idx])
+        if piece == "." or get_piece_color(piece) != side_to_move:
+            return jsonify({"error": "Not your piece"}), 400
 
-    # 現在の手番(side_to_move)が指せる全ての手を取得
-    all_moves = generate_all_moves(board, side_to_move)
+        # 現在の手番(side_to_move)が指せる全ての手を取得
+        all_moves = move_cache.legal_moves(position)
 
     # from_sq が一致する(移動元が同じ)手のみフィルタ
-    possible_moves = [move[1] for move in all_moves if move[0] == from_sq]
+    possible_moves = [
+        move_to_squares(move)[1] for move in all_moves if move[0] == from_idx
+    ]
 
     return jsonify({"possible_moves": possible_moves})
 
 
+def parse_count(data):
+    count = data.get("count", 1)
+    if isinstance(count, bool) or not isinstance(count, int) or count < 1:
+        raise ValueError("Invalid count")
+    return count
+
+
+@app.route("/undo", methods=["POST"])
+def undo():
+    """
+    最後の count 手 (既定 1) を戻す。戻した手の差分を undone に新しい順で入れ、
+    盤面は /apply_move と同じ形で返す。
+
+    body: {"game_id": "<uuid>", "count": 2}
+    """
+    data = request.json
+    game_id = data.get("game_id")
+    try:
+        count = parse_count(data)
+        fmt, since_ply = parse_format(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    with locked_game(game_id) as game:
+        if game is None:
+            return jsonify({"error": "Invalid game_id"}), 400
+        if count > game["ply"]:
+            return jsonify({"error": "Nothing to undo"}), 400
+        undone = [unrecord_move(game_id, game) for _ in range(count)]
+        state = encode_game(game, fmt, since_ply)
+    return jsonify({"success": True, "undone": undone, **state})
+
+
+@app.route("/redo", methods=["POST"])
+def redo():
+    """
+    /undo で戻した手を count 手 (既定 1) 指し直す。指し直した手の差分を redone に入れる。
+    戻した後に別の手を指していたら、指し直す手はない。
+
+    body: {"game_id": "<uuid>", "count": 1}
+    """
+    data = request.json
+    game_id = data.get("game_id")
+    try:
+        count = parse_count(data)
+        fmt, since_ply = parse_format(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    with locked_game(game_id) as game:
+        if game is None:
+            return jsonify({"error": "Invalid game_id"}), 400
+        redo_moves = game.get("redo", [])
+        if count > len(redo_moves):
+            return jsonify({"error": "Nothing to redo"}), 400
+        over = game_over_response(game)
+        if over is not None:
+            return over
+        redone = []
+        for _ in range(count):
+            move = redo_moves.pop()
+            undo_record = game["position"].make_move(move)
+            redone.append(record_move(game_id, game, undo_record, clear_redo=False))
+        state = encode_game(game, fmt, since_ply)
+    return jsonify({"success": True, "redone": redone, **state})
+
+
+@app.route("/history", methods=["POST"])
+def history():
+    """
+    ゲームの指し手の記録を返す。moves は record_move の差分を指した順に並べたもの、
+    redo は /redo で指し直せる手の数。
+
+    body: {"game_id": "<uuid>"}
+    """
+    data = request.json
+    game_id = data.get("game_id")
+    with locked_game(game_id) as game:
+        if game is None:
+            return jsonify({"error": "Invalid game_id"}), 400
+        moves = list(game["moves"])
+        redo_count = len(game.get("redo", ()))
+        ply = game["ply"]
+    return jsonify({"ply": ply, "moves": moves, "redo": redo_count})
+
+
+@app.route("/games/<game_id>/state", methods=["GET"])
+def game_state(game_id):
+    """
+    ゲームの今の盤面を返す。?format= と ?since_ply= は /apply_move の body と同じ。
+    ?format=binary なら encoding.pack_state のバイト列を返す。
+    """
+    if request.args.get("format") == "binary":
+        with locked_game(game_id) as game:
+            if game is None:
+                return jsonify({"error": "Invalid game_id"}), 400
+            data = pack_state(game["position"], game["ply"])
+        return Response(data, mimetype="application/octet-stream")
+
+    query = {"format": request.args.get("format", "json")}
+    if "since_ply" in request.args:
+        try:
+            query["since_ply"] = int(request.args["since_ply"])
+        except ValueError:
+            return jsonify({"error": "Invalid since_ply"}), 400
+    try:
+        fmt, since_ply = parse_format(query)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    with locked_game(game_id) as game:
+        if game is None:
+            return jsonify({"error": "Invalid game_id"}), 400
+        state = encode_game(game, fmt, since_ply)
+    return jsonify(state)
+
+
+@app.route("/games/<game_id>/events", methods=["GET"])
+def game_event_stream(game_id):
+    """
+    そのゲームで指された手・戻された手を Server-Sent Events で送り続ける (events.py)。
+    Last-Event-ID ヘッダ (または ?last_event_id=) を付けると、
+    そのイベントより後の取りこぼしから送る。
+    """
+    if game_id not in games:
+        return jsonify({"error": "Invalid game_id"}), 400
+
+    last_event_id = request.headers.get("Last-Event-ID",
+                                        request.args.get("last_event_id"))
+    try:
+        last_event_id = None if last_event_id is None else int(last_event_id)
+    except ValueError:
+        return jsonify({"error": "Invalid last_event_id"}), 400
+
+    subscription = game_events.subscribe(game_id, last_event_id)
+
+    def stream():
+        try:
+            yield from subscription.stream()
+        finally:
+            game_events.unsubscribe(subscription)
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# 1 回の /analyze で受け付ける局面の数の上限
+MAX_ANALYZE_POSITIONS = 10000
+
+
+@app.route("/analyze", methods=["POST"])
+def analyze():
+    """
+    ゲームを作らずに局面をまとめて解析する (analysis.py)。
+    body: {"positions": [{"board": 125 文字の盤面, "side_to_move": "white"}, ...],
+           "stream": true/false}
+    局面ごとに {"index", "legal_moves", "check", "game_state"} (不正な局面は
+    {"index", "error"}) を返す。"stream": true なら解析が終わった順に 1 行 1 件の
+    NDJSON で送り、そうでなければ positions の順に並べた "results" を返す。
+    """
+    data = request.get_json(silent=True) or {}
+    positions = data.get("positions")
+    if not isinstance(positions, list):
+        return jsonify({"error": "Invalid positions"}), 400
+    if len(positions) > MAX_ANALYZE_POSITIONS:
+        return jsonify({"error": "Too many positions",
+                        "max_positions": MAX_ANALYZE_POSITIONS}), 400
+
+    if not data.get("stream"):
+        results = [None] * len(positions)
+        for index, result in analyzer.analyze(positions):
+            results[index] = dict(result, index=index)
+        return jsonify({"results": results})
+
+    def stream():
+        results = analyzer.analyze(positions)
+        try:
+            for index, result in results:
+                yield json.dumps(dict(result, index=index)) + "\n"
+        finally:
+            results.close()
+
+    return Response(stream(), mimetype="application/x-ndjson",
+                    headers={"X-Accel-Buffering": "no"})
+
+
+@app.route("/games/stats", methods=["GET"])
+def games_stats():
+    """生きているゲームの数と、そのおおよそのメモリ使用量 (バイト) を返す"""
+    stats = games.stats()
+    stats["memory_bytes"] = games.memory_usage()
+    return jsonify(stats)
+
+
+@app.route("/cache_stats", methods=["GET"])
+def cache_stats():
+    """合法手キャッシュと置換表のヒット・ミス・追い出しの件数などを返す"""
+    return jsonify({
+        "move_cache": move_cache.stats(),
+        "transposition_table": transposition_table.stats(),
+        "ai_jobs": ai_jobs.stats(),
+        "game_events": game_events.stats(),
+        "game_store": games.stats(),
+        "opening_book": opening_book.stats() if opening_book is not None else None,
+        "tablebase": tablebase.stats(),
+    })
+
+
+def collect_metrics():
+    """キャッシュ・置換表・ジョブ・ゲームなどの今の値 (metrics.Registry.collector)"""
+    cache = move_cache.stats()
+    tt = transposition_table.stats()
+    jobs = ai_jobs.stats()
+    events = game_events.stats()
+    store = games.stats()
+    families = [
+        ("raum_board_calls_total", "counter",
+         "Calls to generate_all_moves, is_check and can_move_to",
+         [({"function": name}, count) for name, count in sorted(call_counts().items())]),
+        ("raum_move_cache_lookups_total", "counter", "Legal move cache lookups",
+         [({"result": "hit"}, cache["hits"]), ({"result": "miss"}, cache["misses"])]),
+        ("raum_move_cache_hit_ratio", "gauge", "Legal move cache hit rate",
+         [({}, cache["hit_rate"])]),
+        ("raum_move_cache_entries", "gauge", "Positions in the legal move cache",
+         [({}, cache["entries"])]),
+        ("raum_transposition_probes_total", "counter", "Transposition table probes",
+         [({"result": "hit"}, tt["hits"]), ({"result": "miss"}, tt["probes"] - tt["hits"])]),
+        ("raum_transposition_hit_ratio", "gauge", "Transposition table hit rate",
+         [({}, tt["hit_rate"])]),
+        ("raum_ai_jobs_total", "counter", "AI move jobs by outcome",
+         [({"status": "submitted"}, jobs["submitted"]),
+          ({"status": "completed"}, jobs["completed"]),
+          ({"status": "failed"}, jobs["failed"])]),
+        ("raum_ai_jobs_active", "gauge", "AI move jobs pending or running",
+         [({}, jobs["active"])]),
+        ("raum_games", "gauge", "Live games in the store", [({}, len(games))]),
+        ("raum_event_subscribers", "gauge", "Open event stream subscriptions",
+         [({}, events["subscribers"])]),
+    ]
+    if "hits" in store:
+        families.append(("raum_game_store_cache_lookups_total", "counter",
+                         "Game store read-through cache lookups",
+                         [({"result": "hit"}, store["hits"]),
+                          ({"result": "miss"}, store["misses"])]))
+    return families
+
+
+metrics.collector(collect_metrics)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus のテキスト形式のメトリクス (metrics.py)"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+@app.route("/profiler", methods=["GET", "POST"])
+def profiler_settings():
+    """
+    サンプリングプロファイラ (profiler.py) の設定と、書き出したファイルの一覧。
+    POST の body: {"enabled": true, "slow_ms": 200, "interval_ms": 5} (どれも省略可)
+    """
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        enabled = data.get("enabled")
+        if enabled is not None and not isinstance(enabled, bool):
+            return jsonify({"error": "Invalid enabled"}), 400
+        options = {}
+        for key in ("slow_ms", "interval_ms"):
+            value = data.get(key)
+            if value is None:
+                continue
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+                return jsonify({"error": f"Invalid {key}"}), 400
+            options[key] = value / 1000
+        profiler.configure(enabled=enabled, slow_seconds=options.get("slow_ms"),
+                           interval=options.get("interval_ms"))
+    return jsonify(profiler.status())
+
+
 if __name__ == "__main__":
     # デバッグ用
-    app.run(host="0.0.0.0", port=5001, debug=True)
+    create_app().run(host="0.0.0.0", port=5001, debug=True)
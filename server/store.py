@@ -0,0 +1,548 @@
+"""
+ゲームの保存先。
+
+server.py はゲームを games に入れて game_id で引きます。games の実体は
+ここのどちらかのストアで、起動時に環境変数 RAUM_STORE で選びます。
+
+  - "memory" (既定):      プロセス内の dict。再起動すると消える
+  - "sqlite:<path>":      SQLite (WAL モード) のファイル。再起動しても残る。
+                          読み込みはキャッシュを信じるので、1 つのファイルは
+                          1 つのプロセスで開く
+
+ゲームは次の dict で表します (server.py の games の説明も参照)。
+
+    {"position": Position, "captured_pieces": {"white": [...], "black": [...]},
+     "ply": 手数, "moves": [record_move の差分, ...]}
+
+ストアは dict のように games[game_id] / game_id in games で引けます。
+ゲームを読み書きするときは lock(game_id) のロックを取り、その中で get し直します。
+ロックはゲームの dict とは別に持つので、キャッシュから読み直したゲームでも同じものです。
+局面を書き換えたら save(game_id, game, delta) で知らせます。
+
+放置されたゲームが溜まり続けないよう、どちらのストアも
+
+  - max_games:    ゲーム数の上限。超えたら一番長く使われていないものを消す
+  - idle_seconds: この秒数使われなかったゲームを消す (sweep で。
+                  start_sweeper がバックグラウンドで定期的に呼ぶ)
+
+で古いゲームを消し、消した game_id を on_evict(game_id) で知らせます。
+SQLite のストアでの「使われた」時刻は最後に書き込んだ時刻です。
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from board import Position, board_to_string
+
+# SQLite に書き出す間隔 (秒)。この間に来た書き込みはまとめて 1 トランザクションにする
+FLUSH_INTERVAL = 0.05
+
+# sweep を呼ぶ間隔 (秒)
+SWEEP_INTERVAL = 30
+
+def _sizeof(obj, seen):
+    """
+    obj と、その中の dict・list・tuple・属性を辿った sys.getsizeof の合計 (バイト)。
+    seen に入っている (もう数えた) オブジェクトは数えない
+    """
+    if obj is None or isinstance(obj, bool) or id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        children = [*obj.keys(), *obj.values()]
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        children = obj
+    elif hasattr(obj, "__dict__"):
+        children = vars(obj).values()
+    else:
+        slots = getattr(type(obj), "__slots__", ())
+        children = [getattr(obj, name) for name in slots if hasattr(obj, name)]
+    return size + sum(_sizeof(child, seen) for child in children)
+
+
+def estimate_game_size(game):
+    """
+    ゲーム 1 つのメモリ使用量 (バイト)。ゲームの dict の中身を辿って測る。
+    探索 (searcher) は置換表を全ゲームで共有するので、キラー手とヒストリーだけを数える
+    """
+    seen = set()
+    size = sys.getsizeof(game)
+    for key, value in game.items():
+        if key == "searcher":
+            size += _sizeof(value.killers, seen) + _sizeof(value.history, seen)
+        else:
+            size += _sizeof(key, seen) + _sizeof(value, seen)
+    return size
+
+
+def start_sweeper(store, interval=SWEEP_INTERVAL):
+    """store.sweep() を interval 秒ごとに呼ぶデーモンスレッドを起動する"""
+    def loop():
+        while True:
+            time.sleep(interval)
+            store.sweep()
+
+    thread = threading.Thread(target=loop, name="game-store-sweep", daemon=True)
+    thread.start()
+    return thread
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    game_id TEXT PRIMARY KEY,
+    board TEXT NOT NULL,            -- マス番号順の 125 文字
+    side_to_move TEXT NOT NULL,
+    ply INTEGER NOT NULL,
+    captured_white TEXT NOT NULL,   -- 白が取った駒を並べた文字列
+    captured_black TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS moves (
+    game_id TEXT NOT NULL,
+    ply INTEGER NOT NULL,
+    delta TEXT NOT NULL,            -- record_move の差分の JSON
+    PRIMARY KEY (game_id, ply)
+);
+"""
+
+
+class MemoryGameStore:
+    """
+    プロセス内の dict に置くストア。読み書きのたびにゲームを LRU の末尾に
+    動かすので、先頭から見れば一番長く使われていないゲームが分かる。
+    """
+
+    def __init__(self, max_games=None, idle_seconds=None, on_evict=None):
+        self.max_games = max_games
+        self.idle_seconds = idle_seconds
+        self.on_evict = on_evict
+        self._games = OrderedDict()  # game_id → game (使われた順)
+        self._last_used = {}  # game_id → time.monotonic()
+        self._locks = {}  # game_id → そのゲームのロック
+        self._lock = threading.Lock()
+        self.evicted_idle = 0
+        self.evicted_capacity = 0
+
+    def __contains__(self, game_id):
+        return game_id in self._games
+
+    def __getitem__(self, game_id):
+        game = self.get(game_id)
+        if game is None:
+            raise KeyError(game_id)
+        return game
+
+    def __len__(self):
+        return len(self._games)
+
+    def get(self, game_id):
+        with self._lock:
+            game = self._games.get(game_id)
+            if game is not None:
+                self._touch(game_id)
+            return game
+
+    def lock(self, game_id):
+        """game_id のゲームを読み書きするときに持つロック。ゲームがなければ None"""
+        with self._lock:
+            if game_id not in self._games:
+                return None
+            return self._locks.setdefault(game_id, threading.Lock())
+
+    def _touch(self, game_id):
+        self._games.move_to_end(game_id)
+        self._last_used[game_id] = time.monotonic()
+
+    def add(self, game_id, game):
+        evicted = []
+        with self._lock:
+            self._games[game_id] = game
+            self._touch(game_id)
+            while self.max_games is not None and len(self._games) > self.max_games:
+                evicted.append(self._pop_oldest())
+            self.evicted_capacity += len(evicted)
+        self._notify(evicted)
+
+    def save(self, game_id, game, delta=None):
+        with self._lock:
+            if game_id in self._games:
+                self._touch(game_id)
+
+    def _pop_oldest(self):
+        game_id, _ = self._games.popitem(last=False)
+        del self._last_used[game_id]
+        self._locks.pop(game_id, None)
+        return game_id
+
+    def _notify(self, game_ids):
+        if self.on_evict is not None:
+            for game_id in game_ids:
+                self.on_evict(game_id)
+
+    def sweep(self):
+        """idle_seconds より長く使われていないゲームを消す。消した数を返す"""
+        if self.idle_seconds is None:
+            return 0
+        limit = time.monotonic() - self.idle_seconds
+        evicted = []
+        with self._lock:
+            for game_id in self._games:
+                if self._last_used[game_id] >= limit:
+                    break
+                evicted.append(game_id)
+            for game_id in evicted:
+                del self._games[game_id]
+                del self._last_used[game_id]
+                self._locks.pop(game_id, None)
+            self.evicted_idle += len(evicted)
+        self._notify(evicted)
+        return len(evicted)
+
+    def delete(self, game_id):
+        with self._lock:
+            self._games.pop(game_id, None)
+            self._last_used.pop(game_id, None)
+            self._locks.pop(game_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._games.clear()
+            self._last_used.clear()
+            self._locks.clear()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def memory_usage(self):
+        """全ゲームのおおよそのメモリ使用量 (バイト)"""
+        with self._lock:
+            games = list(self._games.values())
+        return sum(estimate_game_size(game) for game in games)
+
+    def stats(self):
+        return {
+            "backend": "memory",
+            "games": len(self._games),
+            "max_games": self.max_games,
+            "idle_seconds": self.idle_seconds,
+            "evicted_idle": self.evicted_idle,
+            "evicted_capacity": self.evicted_capacity,
+        }
+
+
+class SQLiteGameStore:
+    """
+    SQLite に置くストア。
+
+      - 読み込み: 最近使ったゲームを cache_size 件までメモリに持つ (read-through)。
+        書き込みはすべてこのストアを通るので、キャッシュに当たればそのまま返す。
+        ロックを持たれている (リクエストが使っている) ゲームはキャッシュから
+        追い出さないので、使っている間に別の dict に読み直されることはない
+      - 書き込み: save はメモリの書き込み待ちに積むだけで、バックグラウンドの
+        スレッドが FLUSH_INTERVAL ごとにまとめて 1 トランザクションで書く。
+        クラッシュしても失うのは最後の FLUSH_INTERVAL 秒ぶんまで
+    """
+
+    def __init__(self, path, cache_size=1024, flush_interval=FLUSH_INTERVAL,
+                 max_games=None, idle_seconds=None, on_evict=None):
+        self.path = path
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.max_games = max_games
+        self.idle_seconds = idle_seconds
+        self.on_evict = on_evict
+        self.evicted_idle = 0
+        self.evicted_capacity = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        # ゲーム数。add のたびに数え直さなくても max_games を超えたと分かるように持つ
+        self._count = self._conn.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+        # 接続・キャッシュ・書き込み待ちはまとめてこのロックで守る。
+        # 書き出し中のゲームを「SQLite のほうが古い」と読み直さないよう、
+        # flush も書き終えるまでロックを持つ
+        self._lock = threading.RLock()
+        self._cache = OrderedDict()  # game_id → game
+        self._locks = {}  # game_id → そのゲームのロック (キャッシュから消えても残す)
+        self._pending = {}  # game_id → (games の行, [moves の行])
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.written_moves = 0
+
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="game-store-flush",
+                                         daemon=True)
+        self._flusher.start()
+
+    # -- 読み込み --
+    def __contains__(self, game_id):
+        return self.get(game_id) is not None
+
+    def __getitem__(self, game_id):
+        game = self.get(game_id)
+        if game is None:
+            raise KeyError(game_id)
+        return game
+
+    def __len__(self):
+        with self._lock:
+            self.flush()
+            return self._conn.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+
+    def get(self, game_id):
+        with self._lock:
+            game = self._cache.get(game_id)
+            if game is not None:
+                self._cache.move_to_end(game_id)
+                self.hits += 1
+                return game
+            self.misses += 1
+            if game_id in self._pending:
+                # キャッシュから追い出したゲームの書き込み待ちを先に書く
+                self.flush()
+            game = self._load(game_id)
+            if game is None:
+                self._cache.pop(game_id, None)
+            else:
+                self._remember(game_id, game)
+            return game
+
+    def lock(self, game_id):
+        """game_id のゲームを読み書きするときに持つロック。ゲームがなければ None"""
+        with self._lock:
+            lock = self._locks.get(game_id)
+            if lock is None and self._exists(game_id):
+                lock = self._locks[game_id] = threading.Lock()
+            return lock
+
+    def _exists(self, game_id):
+        if game_id in self._cache or game_id in self._pending:
+            return True
+        return self._conn.execute(
+            "SELECT 1 FROM games WHERE game_id = ?", (game_id,)).fetchone() is not None
+
+    def _load(self, game_id):
+        row = self._conn.execute(
+            "SELECT board, side_to_move, ply, captured_white, captured_black"
+            " FROM games WHERE game_id = ?", (game_id,)).fetchone()
+        if row is None:
+            return None
+        deltas = self._conn.execute(
+            "SELECT delta FROM moves WHERE game_id = ? ORDER BY ply",
+            (game_id,)).fetchall()
+        board, side_to_move, ply, captured_white, captured_black = row
+        return {
+            "position": Position.from_string(board, side_to_move),
+            "captured_pieces": {"white": list(captured_white),
+                                "black": list(captured_black)},
+            "ply": ply,
+            "moves": [json.loads(delta) for delta, in deltas],
+        }
+
+    def _remember(self, game_id, game):
+        self._cache[game_id] = game
+        self._cache.move_to_end(game_id)
+        excess = len(self._cache) - self.cache_size
+        if excess <= 0:
+            return
+        # 古いほうから追い出す。ロックを持たれているゲームは飛ばす
+        # (全部使われていれば cache_size を超えたままにする)
+        evict = []
+        for old_id in self._cache:
+            if len(evict) == excess:
+                break
+            lock = self._locks.get(old_id)
+            if lock is None or not lock.locked():
+                evict.append(old_id)
+        for old_id in evict:
+            del self._cache[old_id]
+
+    # -- 書き込み --
+    def add(self, game_id, game):
+        evicted = []
+        with self._lock:
+            if not self._exists(game_id):
+                self._count += 1
+            self._remember(game_id, game)
+            self._queue(game_id, game, None)
+            if self.max_games is not None and self._count > self.max_games:
+                # MemoryGameStore と同じく、超えたらすぐに一番古いゲームから消す
+                self.flush()
+                evicted = [old_id for old_id, in self._conn.execute(
+                    "SELECT game_id FROM games ORDER BY updated DESC LIMIT -1 OFFSET ?",
+                    (self.max_games,))]
+                self._delete_games(evicted)
+                self.evicted_capacity += len(evicted)
+        self._notify(evicted)
+
+    def save(self, game_id, game, delta=None):
+        """game が変わったことを知らせる。delta があれば手の記録にも足す"""
+        with self._lock:
+            self._queue(game_id, game, delta)
+
+    def _queue(self, game_id, game, delta):
+        position = game["position"]
+        row = (
+            game_id,
+            board_to_string(position.board),
+            position.side_to_move,
+            game["ply"],
+            "".join(game["captured_pieces"]["white"]),
+            "".join(game["captured_pieces"]["black"]),
+            time.time(),
+        )
+        _, move_rows = self._pending.get(game_id, (None, []))
+        # 待ったで戻した手はまだ書いていなければ書かない
+        move_rows = [move for move in move_rows if move[1] <= game["ply"]]
+        if delta is not None:
+            move_rows.append((game_id, delta["ply"], json.dumps(delta)))
+        self._pending[game_id] = (row, move_rows)
+
+    def delete(self, game_id):
+        with self._lock:
+            if self._exists(game_id):
+                self._pending.pop(game_id, None)
+                self._delete_games([game_id])
+
+    def _delete_games(self, game_ids):
+        """game_ids のゲームを SQLite とキャッシュから消す (書き込み待ちは書き出してあること)"""
+        if not game_ids:
+            return
+        rows = [(game_id,) for game_id in game_ids]
+        self._execute_many([
+            ("DELETE FROM games WHERE game_id = ?", rows),
+            ("DELETE FROM moves WHERE game_id = ?", rows),
+        ])
+        for game_id in game_ids:
+            self._cache.pop(game_id, None)
+            self._locks.pop(game_id, None)
+        self._count -= len(game_ids)
+
+    def _notify(self, game_ids):
+        if self.on_evict is not None:
+            for game_id in game_ids:
+                self.on_evict(game_id)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._pending.clear()
+            self._locks.clear()
+            self._count = 0
+            self._execute_many([("DELETE FROM games", [()]), ("DELETE FROM moves", [()])])
+
+    def flush(self):
+        """書き込み待ちをすべて SQLite に書く"""
+        with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            game_rows = [row for row, _ in pending.values()]
+            move_rows = [move for _, moves in pending.values() for move in moves]
+            # 待ったで戻した手 (今の手数より後) の記録を消してから書く
+            truncate_rows = [(row[0], row[3]) for row in game_rows]
+            self._execute_many([
+                ("INSERT OR REPLACE INTO games VALUES (?, ?, ?, ?, ?, ?, ?)", game_rows),
+                ("DELETE FROM moves WHERE game_id = ? AND ply > ?", truncate_rows),
+                ("INSERT OR REPLACE INTO moves VALUES (?, ?, ?)", move_rows),
+            ])
+            self.flushes += 1
+            self.written_moves += len(move_rows)
+
+    def sweep(self):
+        """
+        idle_seconds より長く書き込まれていないゲームと、max_games を超えた
+        古いゲームを消す。消した数を返す
+        (max_games は add でも守る。ここで消えるのは開いたときから多かった分)
+        """
+        limit = 0 if self.idle_seconds is None else time.time() - self.idle_seconds
+        with self._lock:
+            self.flush()
+            idle = [game_id for game_id, in self._conn.execute(
+                "SELECT game_id FROM games WHERE updated < ?", (limit,))]
+            capacity = []
+            if self.max_games is not None:
+                # 残るゲームのうち、新しいほうから max_games 件より後ろのもの
+                capacity = [game_id for game_id, in self._conn.execute(
+                    "SELECT game_id FROM games WHERE updated >= ?"
+                    " ORDER BY updated DESC LIMIT -1 OFFSET ?",
+                    (limit, self.max_games))]
+            evicted = idle + capacity
+            self._delete_games(evicted)
+            self.evicted_idle += len(idle)
+            self.evicted_capacity += len(capacity)
+        self._notify(evicted)
+        return len(evicted)
+
+    def _execute_many(self, statements):
+        """[(SQL, パラメータのリスト), ...] を 1 トランザクションで実行する"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, rows in statements:
+                self._conn.executemany(sql, rows)
+            self._conn.execute("COMMIT")
+        except sqlite3.Error:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self._closed.set()
+        self._flusher.join()
+        with self._lock:
+            self.flush()
+            self._conn.close()
+
+    def memory_usage(self):
+        """メモリに持っているゲーム (キャッシュ) のおおよそのメモリ使用量 (バイト)"""
+        with self._lock:
+            games = list(self._cache.values())
+        return sum(estimate_game_size(game) for game in games)
+
+    def stats(self):
+        with self._lock:
+            cached = len(self._cache)
+            pending = len(self._pending)
+            games = len(self)  # 書き込み待ちを書き出してから数える
+        lookups = self.hits + self.misses
+        return {
+            "backend": "sqlite",
+            "games": games,
+            "path": self.path,
+            "file_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            "max_games": self.max_games,
+            "idle_seconds": self.idle_seconds,
+            "evicted_idle": self.evicted_idle,
+            "evicted_capacity": self.evicted_capacity,
+            "cached": cached,
+            "pending": pending,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "flushes": self.flushes,
+            "written_moves": self.written_moves,
+        }
+
+
+def open_store(spec="memory", **options):
+    """
+    "memory" か "sqlite:<path>" からストアを作る。
+    options (max_games / idle_seconds / on_evict) はストアにそのまま渡す
+    """
+    if spec == "memory":
+        return MemoryGameStore(**options)
+    if spec.startswith("sqlite:"):
+        return SQLiteGameStore(spec[len("sqlite:"):], **options)
+    raise ValueError(f"Unknown game store: {spec}")
@@ -0,0 +1,390 @@
+"""
+駒の少ない終盤のデータベース (tablebase) の引き当て。
+
+キングと数枚の駒だけの局面 (K+Q 対 K、K+U+B 対 K など) について、
+どちらの手番でも「勝ち・引き分け・負け」と詰みまでの手数 (DTM, 手数は ply) を
+前もって全局面ぶん求めたファイルを引きます。ファイルは retrograde.py で作ります。
+
+    python retrograde.py KQvK KRvK KUBvK -o tablebases
+
+    tablebase = Tablebase("tablebases")
+    result = tablebase.probe(position)       # TablebaseResult か、載っていなければ None
+    move, result = tablebase.best_move(position)
+
+駒の組み合わせの名前は "K<白の駒>vK<黒の駒>" で、駒は QRUBN の順に並べ、
+駒の多い (強い) 側を白として持ちます。黒の側が強い局面は色を入れ替えて引きます。
+ポーンのない局面は 5x5x5 の立方体の 48 通りの回転・鏡映で動きが変わらないので、
+白のキングを 10 マス (DOMAIN) のどれかに移した形だけを持ちます。
+
+ファイルの形式 (ヘッダはビッグエンディアン):
+
+    32 バイト  ヘッダ: "RAUMTB1\\0"・組み合わせの名前 (16 バイト)・
+               駒の数 (1)・フラグ (1, bit 0: 勝ち負けのつく局面がある)・予備 (2)・局面の数 (4)
+    局面の数   白番の値 (1 局面 1 バイト)
+    局面の数   黒番の値
+
+値は 0: ありえない局面 (駒が重なる・手番でない側が王手されているなど)、1: 引き分け、
+2 + DTM: DTM が偶数なら手番側の負け (0 は詰み)、奇数なら手番側の勝ち。
+局面の番号は、対称の変換をした後のマス番号を
+(DOMAIN での白キングの番号, 黒キング, 白の駒..., 黒の駒...) の順に 125 進数で並べたもの。
+"""
+import itertools
+import mmap
+import os
+import struct
+import threading
+
+from board import EMPTY, KING, NUM_SQUARES, get_opponent_side, square_index
+
+MAGIC = b"RAUMTB1\0"
+HEADER = struct.Struct(">8s16sBBxxI")
+FLAG_DECISIVE = 1
+FILE_SUFFIX = ".rtb"
+
+# 値のバイト
+VALUE_INVALID = 0
+VALUE_DRAW = 1
+VALUE_DTM_BASE = 2
+MAX_DTM = 253
+
+# 駒の並べ順 (名前とファイル内の並び)
+PIECE_ORDER = "QRUBN"
+
+
+# -----------------------------------
+# 立方体の対称
+# -----------------------------------
+def _coords(square):
+    """マス番号 → (レベル, 列, 行)"""
+    return square // 25, square % 5, (square // 5) % 5
+
+
+def _symmetries():
+    """
+    48 通りの軸の入れ替え x 各軸の反転を、マス番号の置換表 (125 要素のリスト) で返す。
+    先頭は恒等変換
+    """
+    tables = []
+    for perm in itertools.permutations(range(3)):
+        for flips in itertools.product((False, True), repeat=3):
+            table = []
+            for square in range(NUM_SQUARES):
+                coords = _coords(square)
+                lvl, col, row = (4 - coords[p] if flip else coords[p]
+                                 for p, flip in zip(perm, flips))
+                table.append(square_index(lvl, col, row))
+            tables.append(table)
+    return tables
+
+
+SYMMETRIES = _symmetries()
+# 白キングを置くマス: (レベル, 列, 行) が 0 <= レベル <= 列 <= 行 <= 2
+DOMAIN = [square for square in range(NUM_SQUARES)
+          if (lambda c: c[0] <= c[1] <= c[2] <= 2)(_coords(square))]
+DOMAIN_INDEX = [DOMAIN.index(square) if square in DOMAIN else -1
+                for square in range(NUM_SQUARES)]
+# マスごとに、そのマスを DOMAIN に移す対称 (の番号)。DOMAIN のマスは恒等変換
+CANONICAL_SYMMETRY = [
+    next(g for g, table in enumerate(SYMMETRIES) if DOMAIN_INDEX[table[square]] >= 0)
+    for square in range(NUM_SQUARES)
+]
+# DOMAIN のマスごとに、そのマスを動かさない対称
+STABILIZERS = [[g for g, table in enumerate(SYMMETRIES) if table[square] == square]
+               for square in DOMAIN]
+
+
+# -----------------------------------
+# 駒の組み合わせ
+# -----------------------------------
+def _strength(pieces):
+    return len(pieces), [len(PIECE_ORDER) - PIECE_ORDER.index(p) for p in pieces]
+
+
+class Material:
+    """
+    駒の組み合わせ。white / black はキング以外の駒の文字 ("Q", "UB" など)。
+    types / colors はファイル内の駒の並び (白キング, 黒キング, 白の駒..., 黒の駒...)。
+    """
+
+    def __init__(self, white, black):
+        self.white = "".join(sorted(white.upper(), key=PIECE_ORDER.index))
+        self.black = "".join(sorted(black.upper(), key=PIECE_ORDER.index))
+        self.name = f"K{self.white}vK{self.black}"
+        self.types = ["K", "K"] + list(self.white) + list(self.black)
+        self.colors = (["white", "black"] + ["white"] * len(self.white)
+                       + ["black"] * len(self.black))
+        self.count = len(self.types)
+        self.size = len(DOMAIN) * NUM_SQUARES ** (self.count - 1)
+        # 同じ色・同じ種類の駒の並び [start, end)。マス番号の小さい順に持つ
+        self.groups = []
+        start = 2
+        for pieces in (self.white, self.black):
+            for _, run in itertools.groupby(pieces):
+                length = len(list(run))
+                if length > 1:
+                    self.groups.append((start, start + length))
+                start += length
+
+    @classmethod
+    def parse(cls, name):
+        """"KQvK" → Material。不正なら ValueError"""
+        white, sep, black = name.upper().partition("V")
+        if not sep or not white.startswith("K") or not black.startswith("K") \
+                or any(p not in PIECE_ORDER for p in white[1:] + black[1:]):
+            raise ValueError(f"Invalid material: {name}")
+        return cls(white[1:], black[1:])
+
+    @classmethod
+    def normalized(cls, white, black):
+        """(白の駒, 黒の駒) → (Material, 色を入れ替えたか)。強い側を白にする"""
+        if _strength(black) > _strength(white):
+            return cls(black, white), True
+        return cls(white, black), False
+
+    def __eq__(self, other):
+        return isinstance(other, Material) and self.name == other.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+    def __repr__(self):
+        return f"Material({self.name})"
+
+    def without(self, column):
+        """
+        column 番目の駒を取った後の (Material, 列の並び, 色を入れ替えたか)。
+        列の並びは、取った後の局面のマスを元の列から並べ直すための添字
+        """
+        white = list(range(2, 2 + len(self.white)))
+        black = list(range(2 + len(self.white), self.count))
+        if column in white:
+            white.remove(column)
+        else:
+            black.remove(column)
+        material, swapped = Material.normalized(
+            "".join(self.types[c] for c in white), "".join(self.types[c] for c in black))
+        if swapped:
+            return material, [1, 0] + black + white, True
+        return material, [0, 1] + white + black, False
+
+    def sub_materials(self):
+        """駒を 1 枚取った後の組み合わせ (キングだけのものは除く)"""
+        result = []
+        for column in range(2, self.count):
+            material, _, _ = self.without(column)
+            if material.count > 2 and material not in result:
+                result.append(material)
+        return result
+
+    def index(self, squares):
+        """ファイル内の並びのマス番号のリスト → 局面の番号"""
+        table = SYMMETRIES[CANONICAL_SYMMETRY[squares[0]]]
+        squares = [table[square] for square in squares]
+        for start, end in self.groups:
+            squares[start:end] = sorted(squares[start:end])
+        index = DOMAIN_INDEX[squares[0]]
+        for square in squares[1:]:
+            index = index * NUM_SQUARES + square
+        return index
+
+
+def position_material(board):
+    """
+    盤面の駒から (Material, ファイル内の並びのマス番号, 色を入れ替えたか) を返す。
+    キングが揃っていないかポーンがあれば None
+    """
+    pieces = {"white": [], "black": []}
+    kings = {}
+    for square, piece in enumerate(board):
+        if piece == EMPTY:
+            continue
+        side = "white" if piece < 96 else "black"
+        letter = chr(piece & 0xDF)
+        if piece & 0xDF == KING:
+            if side in kings:
+                return None
+            kings[side] = square
+        elif letter in PIECE_ORDER:
+            pieces[side].append((PIECE_ORDER.index(letter), square, letter))
+        else:
+            return None
+    if len(kings) != 2:
+        return None
+    for side in pieces:
+        pieces[side].sort()
+    material, swapped = Material.normalized(
+        "".join(p[2] for p in pieces["white"]), "".join(p[2] for p in pieces["black"]))
+    strong, weak = ("black", "white") if swapped else ("white", "black")
+    squares = ([kings[strong], kings[weak]]
+               + [p[1] for p in pieces[strong]] + [p[1] for p in pieces[weak]])
+    return material, squares, swapped
+
+
+# -----------------------------------
+# 引き当て
+# -----------------------------------
+class TablebaseResult:
+    """手番側から見た結果。wdl は "win" / "draw" / "loss"、dtm は詰みまでの手数 (ply)"""
+
+    __slots__ = ("wdl", "dtm")
+
+    def __init__(self, wdl, dtm=None):
+        self.wdl = wdl
+        self.dtm = dtm
+
+    @classmethod
+    def from_value(cls, value):
+        if value < VALUE_DTM_BASE:
+            return cls("draw")
+        dtm = value - VALUE_DTM_BASE
+        return cls("win" if dtm % 2 else "loss", dtm)
+
+    def to_dict(self):
+        return {"wdl": self.wdl, "dtm": self.dtm}
+
+
+class TableFile:
+    """1 つの組み合わせのファイルを mmap で開いたもの"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, name, count, flags, size = HEADER.unpack_from(self._data)
+        self.material = Material.parse(name.rstrip(b"\0").decode("ascii"))
+        if magic != MAGIC or count != self.material.count or size != self.material.size \
+                or len(self._data) != HEADER.size + 2 * size:
+            self._data.close()
+            raise ValueError(f"Invalid tablebase file: {path}")
+        self.decisive = bool(flags & FLAG_DECISIVE)
+
+    def value(self, index, side_to_move):
+        offset = HEADER.size + index
+        if side_to_move == "black":
+            offset += self.material.size
+        return self._data[offset]
+
+    def close(self):
+        self._data.close()
+
+
+def table_path(directory, material):
+    return os.path.join(directory, material.name + FILE_SUFFIX)
+
+
+class Tablebase:
+    """
+    directory にある tablebase ファイルをまとめて引く。ファイルは最初に
+    引いたときに開く。複数のスレッドから同時に引いてよい。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.names = set()
+        if directory and os.path.isdir(directory):
+            self.names = {name[:-len(FILE_SUFFIX)] for name in os.listdir(directory)
+                          if name.endswith(FILE_SUFFIX)}
+        # 載っている組み合わせの駒の数の最大 (キングを含む)。これより多い局面はすぐに諦める
+        self.max_pieces = 2
+        for name in self.names:
+            try:
+                self.max_pieces = max(self.max_pieces, Material.parse(name).count)
+            except ValueError:
+                pass
+        self._tables = {}
+        self._lock = threading.Lock()
+        self.probes = 0
+        self.hits = 0
+
+    def __bool__(self):
+        return bool(self.names)
+
+    def _table(self, material):
+        if material.name not in self.names:
+            return None
+        table = self._tables.get(material.name)
+        if table is None:
+            with self._lock:
+                table = self._tables.get(material.name)
+                if table is None:
+                    table = self._tables[material.name] = TableFile(
+                        table_path(self.directory, material))
+        return table
+
+    def probe(self, position):
+        """position の手番側から見た TablebaseResult。載っていなければ None"""
+        self.probes += 1
+        board = position.board
+        if len(board) - board.count(EMPTY) > self.max_pieces:
+            return None
+        found = position_material(board)
+        if found is None:
+            return None
+        material, squares, swapped = found
+        if material.count == 2:
+            # キングだけなら引き分け
+            self.hits += 1
+            return TablebaseResult("draw")
+        table = self._table(material)
+        if table is None:
+            return None
+        side_to_move = position.side_to_move
+        if swapped:
+            side_to_move = get_opponent_side(side_to_move)
+        value = table.value(material.index(squares), side_to_move)
+        if value == VALUE_INVALID:
+            return None
+        self.hits += 1
+        return TablebaseResult.from_value(value)
+
+    def best_move(self, position):
+        """
+        tablebase で最善の手と、position の結果を (move, TablebaseResult) で返す。
+        勝ちなら一番早く詰む手、負けなら一番長く粘る手、引き分けなら引き分けを保つ手。
+        position か指した後の局面のどれかが載っていなければ None
+        """
+        result = self.probe(position)
+        if result is None:
+            return None
+        best_move, best_rank = None, None
+        for move in position.generate_all_moves():
+            child = position.copy()
+            child.make_move(move)
+            child_result = self.probe(child)
+            if child_result is None:
+                return None
+            # 指した側から見た良さ: 相手の負け (早いほどよい) > 引き分け > 相手の勝ち (遅いほどよい)
+            if child_result.wdl == "loss":
+                rank = (2, -child_result.dtm)
+            elif child_result.wdl == "draw":
+                rank = (1, 0)
+            else:
+                rank = (0, child_result.dtm)
+            if best_rank is None or rank > best_rank:
+                best_move, best_rank = move, rank
+        if best_move is None:
+            return None
+        return best_move, result
+
+    def is_dead(self, position):
+        """
+        どちらも詰ませようのない局面か。その組み合わせのファイルに勝ち負けのつく
+        局面が 1 つもなければ、どう指しても詰みにならない
+        (詰みの 1 手前は必ず勝ちの局面になるので)
+        """
+        board = position.board
+        if len(board) - board.count(EMPTY) > self.max_pieces:
+            return False
+        found = position_material(board)
+        if found is None:
+            return False
+        material = found[0]
+        if material.count == 2:
+            return True
+        table = self._table(material)
+        return table is not None and not table.decisive
+
+    def stats(self):
+        return {"directory": self.directory, "tables": sorted(self.names),
+                "max_pieces": self.max_pieces,
+                "probes": self.probes, "hits": self.hits}
@@ -0,0 +1,94 @@
+"""
+千日手・50 手ルール・駒不足の判定 (draws.py) のテスト。
+
+    cd server && python -m pytest -q test_draws.py
+"""
+from board import EMPTY, NUM_SQUARES, SQUARE_INDEX, Position
+from draws import FIFTY_MOVE_PLIES, DrawTracker, insufficient_material
+
+# 初期配置から両者のナイトが出て戻る 4 手。2 回繰り返すと初期局面が 3 回目になる
+KNIGHT_SHUFFLE = [("Ab1", "Cc1"), ("Eb5", "Cc5"), ("Cc1", "Ab1"), ("Cc5", "Eb5")]
+
+
+def board_with(pieces):
+    """{"Aa1": "K", ...} の駒だけを置いた盤面"""
+    board = bytearray([EMPTY] * NUM_SQUARES)
+    for square, piece in pieces.items():
+        board[SQUARE_INDEX[square]] = ord(piece)
+    return board
+
+
+def play(position, tracker, from_sq, to_sq):
+    undo = position.make_move((SQUARE_INDEX[from_sq], SQUARE_INDEX[to_sq], None))
+    tracker.push(position.key, undo.moved_piece, undo.captured_piece)
+    return undo
+
+
+def test_threefold_repetition():
+    position = Position.initial()
+    tracker = DrawTracker(position)
+    for from_sq, to_sq in KNIGHT_SHUFFLE:
+        play(position, tracker, from_sq, to_sq)
+    assert tracker.repetitions(position.key) == 2
+    assert tracker.draw_reason(position) is None
+    for from_sq, to_sq in KNIGHT_SHUFFLE:
+        play(position, tracker, from_sq, to_sq)
+    assert tracker.draw_reason(position) == "threefold_repetition"
+
+
+def test_pop_undoes_push():
+    position = Position.initial()
+    tracker = DrawTracker(position)
+    undos = [play(position, tracker, *move) for move in KNIGHT_SHUFFLE * 2]
+    for undo in reversed(undos):
+        tracker.pop(position.key)
+        position.unmake_move(undo)
+    assert dict(tracker.counts) == {position.key: 1}
+    assert tracker.clocks == [0]
+    assert len(tracker.material) == 1
+
+
+def test_fifty_move_rule_counts_quiet_moves():
+    position = Position.initial()
+    tracker = DrawTracker(position)
+    for ply in range(FIFTY_MOVE_PLIES):
+        # キーを変えて千日手にはならないようにし、クロックだけを進める
+        tracker.push(ply + 1, ord("N"), EMPTY)
+    assert tracker.halfmove_clock == FIFTY_MOVE_PLIES
+    assert tracker.draw_reason(position) == "fifty_move_rule"
+
+
+def test_pawn_move_and_capture_reset_clock():
+    position = Position.initial()
+    tracker = DrawTracker(position)
+    tracker.push(1, ord("N"), EMPTY)
+    assert tracker.halfmove_clock == 1
+    tracker.push(2, ord("p"), EMPTY)
+    assert tracker.halfmove_clock == 0
+    tracker.push(3, ord("N"), EMPTY)
+    tracker.push(4, ord("R"), ord("b"))
+    assert tracker.halfmove_clock == 0
+    assert tracker.material[-1] == tracker.material[0] - 1
+
+
+def test_insufficient_material():
+    assert insufficient_material(board_with({"Aa1": "K", "Ee5": "k"}))
+    for piece in "NBUR":
+        assert insufficient_material(board_with({"Aa1": "K", "Ee5": "k", "Cc3": piece}))
+    assert not insufficient_material(board_with({"Aa1": "K", "Ee5": "k", "Cc3": "Q"}))
+    assert not insufficient_material(board_with({"Aa1": "K", "Ee5": "k", "Cc3": "P"}))
+    assert not insufficient_material(
+        board_with({"Aa1": "K", "Ee5": "k", "Cc3": "N", "Dd4": "n"}))
+
+
+def test_apply_move_reports_repetition_and_stops_the_game(client):
+    game_id = client.post("/new_game", json={}).get_json()["game_id"]
+    for from_sq, to_sq in KNIGHT_SHUFFLE * 2:
+        response = client.post("/apply_move",
+                               json={"game_id": game_id, "from": from_sq, "to": to_sq})
+        assert response.status_code == 200
+    assert response.get_json()["game_state"] == "threefold_repetition"
+
+    response = client.post("/apply_move", json={"game_id": game_id, "from": "Ab1", "to": "Cc1"})
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Game is over", "game_state": "threefold_repetition"}
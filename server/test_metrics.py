@@ -0,0 +1,15 @@
+"""
+GET /metrics を SQLite のストア (conftest.py) で取れるかのテスト。
+
+    cd server && python -m pytest -q test_metrics.py
+"""
+
+
+def test_metrics_with_sqlite_store(client):
+    assert client.post("/new_game", json={}).status_code == 200
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    lines = response.get_data(as_text=True).splitlines()
+    assert "raum_games 1" in lines
+    assert any(line.startswith("raum_game_store_cache_lookups_total") for line in lines)
@@ -0,0 +1,58 @@
+"""
+指し手生成のテスト (perft.py の --suite / --compare を pytest で回す)。
+
+    cd server && python -m pytest -q test_perft.py
+"""
+import pytest
+
+from bitboard import BitboardPosition
+from board import Position, compute_key, generate_all_moves_reference, is_check
+from perft import PERFT_POSITIONS, compare_moves, iter_compare_positions, perft
+
+SUITE_CASES = [
+    pytest.param(text, side_to_move, depth, nodes, id=f"{name}-d{depth}")
+    for name, text, side_to_move, expected in PERFT_POSITIONS
+    for depth, nodes in sorted(expected.items())
+]
+
+
+@pytest.mark.parametrize("text, side_to_move, depth, nodes", SUITE_CASES)
+def test_perft_suite(text, side_to_move, depth, nodes):
+    assert perft(Position.from_string(text, side_to_move), depth) == nodes
+
+
+@pytest.mark.parametrize("text, side_to_move, depth, nodes", SUITE_CASES)
+def test_perft_suite_reference(text, side_to_move, depth, nodes):
+    position = Position.from_string(text, side_to_move)
+    assert perft(position, depth, generate_all_moves_reference) == nodes
+
+
+@pytest.mark.parametrize("text, side_to_move, depth, nodes", SUITE_CASES)
+def test_perft_suite_bitboard(text, side_to_move, depth, nodes):
+    assert perft(BitboardPosition.from_string(text, side_to_move), depth) == nodes
+
+
+def test_generators_agree_on_random_positions():
+    # 固定の seed で、ランダムな盤面と初期配置からのランダム対局の局面を突き合わせる
+    checked = 0
+    for position in iter_compare_positions(200, seed=1):
+        board, side_to_move = position.board, position.side_to_move
+        assert position.key == compute_key(board, side_to_move)
+        assert BitboardPosition(bytearray(board), side_to_move).is_check() \
+            == is_check(board, side_to_move)
+        assert compare_moves(board, side_to_move) is None
+        checked += 1
+    assert checked > 400
+
+
+def test_make_unmake_restores_position():
+    name, text, side_to_move, expected = PERFT_POSITIONS[2]
+    position = Position.from_string(text, side_to_move)
+    board, key = bytes(position.board), position.key
+    for move in position.generate_all_moves():
+        undo = position.make_move(move)
+        assert position.key == compute_key(position.board, position.side_to_move)
+        position.unmake_move(undo)
+        assert bytes(position.board) == board
+        assert position.key == key
+        assert position.side_to_move == side_to_move
@@ -0,0 +1,127 @@
+"""
+ゲームのストア (store.py) の上限・放置ゲームの削除・キャッシュのテスト。
+
+    cd server && python -m pytest -q test_store.py
+"""
+import time
+
+import pytest
+
+from board import Position
+from store import MemoryGameStore, SQLiteGameStore, estimate_game_size
+
+
+def make_game():
+    return {"position": Position.initial(), "captured_pieces": {"white": [], "black": []},
+            "ply": 0, "moves": []}
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def open_store(request, tmp_path):
+    """options を渡してストアを開く関数。テストの終わりに閉じる"""
+    stores = []
+
+    def opener(**options):
+        if request.param == "memory":
+            store = MemoryGameStore(**options)
+        else:
+            store = SQLiteGameStore(str(tmp_path / "games.db"), **options)
+        stores.append(store)
+        return store
+
+    yield opener
+    for store in stores:
+        store.close()
+
+
+def add_games(store, count):
+    for i in range(count):
+        store.add(f"game-{i}", make_game())
+        # SQLite の「使われた」時刻 (updated) の順が付くようにずらす
+        time.sleep(0.002)
+
+
+def test_add_evicts_oldest_over_max_games(open_store):
+    evicted = []
+    store = open_store(max_games=3, on_evict=evicted.append)
+    add_games(store, 5)
+    assert len(store) == 3
+    assert evicted == ["game-0", "game-1"]
+    assert "game-0" not in store
+    assert "game-4" in store
+    assert store.stats()["evicted_capacity"] == 2
+
+
+def test_sweep_evicts_idle_games(open_store):
+    evicted = []
+    store = open_store(idle_seconds=0.05, on_evict=evicted.append)
+    add_games(store, 2)
+    time.sleep(0.1)
+    store.add("fresh", make_game())
+    assert store.sweep() == 2
+    assert sorted(evicted) == ["game-0", "game-1"]
+    assert len(store) == 1
+    assert store.stats()["evicted_idle"] == 2
+
+
+def test_save_keeps_game_in_use(open_store):
+    store = open_store(max_games=2)
+    add_games(store, 2)
+    store.save("game-0", store.get("game-0"))
+    time.sleep(0.002)
+    store.add("game-2", make_game())
+    assert "game-0" in store
+    assert "game-1" not in store
+
+
+def test_lock_is_kept_per_game_id(open_store):
+    store = open_store()
+    add_games(store, 1)
+    assert store.lock("missing") is None
+    assert store.lock("game-0") is store.lock("game-0")
+    store.delete("game-0")
+    assert store.lock("game-0") is None
+    assert len(store) == 0
+
+
+def test_sqlite_cache_does_not_evict_locked_game(tmp_path):
+    store = SQLiteGameStore(str(tmp_path / "games.db"), cache_size=2)
+    try:
+        store.add("a", make_game())
+        with store.lock("a"):
+            game = store.get("a")
+            add_games(store, 4)
+            assert store.get("a") is game
+            game["ply"] = 1
+            store.save("a", game)
+        add_games(store, 4)
+        reloaded = store.get("a")
+        assert reloaded is not game
+        assert reloaded["ply"] == 1
+    finally:
+        store.close()
+
+
+def test_sqlite_reopen_keeps_games(tmp_path):
+    path = str(tmp_path / "games.db")
+    store = SQLiteGameStore(path)
+    game = make_game()
+    store.add("a", game)
+    store.close()
+
+    store = SQLiteGameStore(path, max_games=1)
+    try:
+        assert store.get("a")["position"].board == game["position"].board
+        store.add("b", make_game())
+        assert len(store) == 1
+        assert "a" not in store
+    finally:
+        store.close()
+
+
+def test_estimate_game_size_grows_with_moves():
+    game = make_game()
+    empty = estimate_game_size(game)
+    game["moves"] = [{"ply": i, "from": "Ab1", "to": f"Cc{i}", "captured": None}
+                     for i in range(50)]
+    assert estimate_game_size(game) > empty + 50 * 100
@@ -0,0 +1,106 @@
+"""
+終盤の tablebase (retrograde.py で作り、tablebase.py で引く) のテスト。
+KQvK と KRvK を一時ディレクトリに作って引く (数秒かかる)。
+
+    cd server && python -m pytest -q test_tablebase.py
+"""
+import random
+
+import pytest
+
+from board import EMPTY, NUM_SQUARES, SQUARE_INDEX, Position, is_check
+from retrograde import build_tables
+from tablebase import Material, Tablebase
+
+
+@pytest.fixture(scope="module")
+def tablebase(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("tablebases"))
+    build_tables([Material.parse("KQvK"), Material.parse("KRvK")], directory, workers=1)
+    return Tablebase(directory)
+
+
+def position_with(pieces, side_to_move="white"):
+    board = bytearray([EMPTY] * NUM_SQUARES)
+    for square, piece in pieces.items():
+        board[SQUARE_INDEX[square]] = ord(piece)
+    return Position(board, side_to_move)
+
+
+def random_positions(pieces, count, seed=0):
+    """pieces ("KkQ" など) をランダムに置いた、手番でない側が王手されていない局面"""
+    rng = random.Random(seed)
+    while count:
+        board = bytearray([EMPTY] * NUM_SQUARES)
+        for piece, square in zip(pieces, rng.sample(range(NUM_SQUARES), len(pieces))):
+            board[square] = ord(piece)
+        position = Position(board, rng.choice(["white", "black"]))
+        opponent = "black" if position.side_to_move == "white" else "white"
+        if is_check(position.board, opponent):
+            continue
+        count -= 1
+        yield position
+
+
+def children(position):
+    for move in position.generate_all_moves():
+        child = position.copy()
+        child.make_move(move)
+        yield move, child
+
+
+@pytest.mark.parametrize("pieces", ["KkQ", "KkR"])
+def test_probe_is_consistent_with_successors(tablebase, pieces):
+    # 勝ちなら dtm - 1 で負ける手があり、負けならどの手も dtm - 1 以下で相手の勝ち
+    for position in random_positions(pieces, 300, seed=ord(pieces[-1])):
+        result = tablebase.probe(position)
+        assert result is not None
+        kids = [tablebase.probe(child) for _, child in children(position)]
+        if result.wdl == "win":
+            assert min(k.dtm for k in kids if k.wdl == "loss") == result.dtm - 1
+        elif result.wdl == "loss":
+            if result.dtm == 0:
+                assert not kids and position.is_check()
+            else:
+                assert all(k.wdl == "win" for k in kids)
+                assert max(k.dtm for k in kids) == result.dtm - 1
+        else:
+            assert not any(k.wdl == "loss" for k in kids)
+
+
+def test_best_move_wins_fastest(tablebase):
+    for position in random_positions("KkQ", 100, seed=3):
+        found = tablebase.best_move(position)
+        assert found is not None
+        move, result = found
+        child = position.copy()
+        child.make_move(move)
+        child_result = tablebase.probe(child)
+        if result.wdl == "win":
+            assert child_result.wdl == "loss"
+            assert child_result.dtm == result.dtm - 1
+        elif result.wdl == "loss" and result.dtm > 0:
+            assert child_result.dtm == result.dtm - 1
+
+
+def test_colours_are_symmetric(tablebase):
+    # 白と黒を入れ替えた局面 (ポーンがないので盤を裏返さなくてよい) は同じ結果
+    for position in random_positions("KkQ", 50, seed=5):
+        swapped = Position(bytearray(bytes(position.board).swapcase()),
+                           "black" if position.side_to_move == "white" else "white")
+        assert tablebase.probe(swapped).to_dict() == tablebase.probe(position).to_dict()
+
+
+def test_is_dead(tablebase):
+    assert tablebase.is_dead(position_with({"Aa1": "K", "Ee5": "k"}))
+    # 5x5x5 ではキングとルークだけでは詰ませられない (draws.insufficient_material と同じ)
+    assert tablebase.is_dead(position_with({"Aa1": "K", "Ee5": "k", "Cc3": "R"}))
+    assert not tablebase.is_dead(position_with({"Aa1": "K", "Ee5": "k", "Cc3": "Q"}))
+
+
+def test_probe_outside_tables(tablebase):
+    # 作っていない組み合わせと、駒の多すぎる局面は載っていない
+    assert tablebase.probe(position_with({"Aa1": "K", "Ee5": "k", "Cc3": "N"})) is None
+    assert tablebase.probe(Position.initial()) is None
+    assert not tablebase.is_dead(Position.initial())
+    assert not Tablebase(None)
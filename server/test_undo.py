@@ -0,0 +1,98 @@
+"""
+/undo・/redo (待ったとやり直し) のテスト。
+
+    cd server && python -m pytest -q test_undo.py
+"""
+import server
+
+# 3 手目で白のビショップが黒のポーンを取る
+OPENING = [("Ab1", "Cc1"), ("Da4", "Ca4"), ("Ba1", "Ea4")]
+
+
+def new_game(client):
+    response = client.post("/new_game", json={})
+    return response.get_json()
+
+
+def apply_moves(client, game_id, moves):
+    for from_sq, to_sq in moves:
+        response = client.post("/apply_move",
+                               json={"game_id": game_id, "from": from_sq, "to": to_sq})
+        assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def post(client, path, **body):
+    response = client.post(path, json=body)
+    return response.status_code, response.get_json()
+
+
+def test_undo_restores_board_and_captures(client):
+    initial = new_game(client)
+    game_id = initial["game_id"]
+    after_capture = apply_moves(client, game_id, OPENING)
+    assert after_capture["captured_pieces"]["white"] == ["p"]
+
+    status, body = post(client, "/undo", game_id=game_id)
+    assert status == 200
+    assert [delta["captured"] for delta in body["undone"]] == ["p"]
+    assert body["captured_pieces"] == {"white": [], "black": []}
+    assert body["ply"] == 2
+
+    status, body = post(client, "/undo", game_id=game_id, count=2)
+    assert status == 200
+    assert [delta["ply"] for delta in body["undone"]] == [2, 1]
+    assert body["board"] == initial["board"]
+    assert body["side_to_move"] == "white"
+
+
+def test_redo_replays_undone_moves(client):
+    game_id = new_game(client)["game_id"]
+    played = apply_moves(client, game_id, OPENING)
+    post(client, "/undo", game_id=game_id, count=3)
+
+    status, body = post(client, "/redo", game_id=game_id, count=3)
+    assert status == 200
+    assert [(delta["from"], delta["to"]) for delta in body["redone"]] == OPENING
+    assert body["board"] == played["board"]
+    assert body["captured_pieces"] == played["captured_pieces"]
+
+    status, body = post(client, "/redo", game_id=game_id)
+    assert status == 400
+    assert body == {"error": "Nothing to redo"}
+
+
+def test_new_move_clears_redo(client):
+    game_id = new_game(client)["game_id"]
+    apply_moves(client, game_id, OPENING[:2])
+    post(client, "/undo", game_id=game_id)
+    apply_moves(client, game_id, [("Eb5", "Cc5")])
+
+    status, body = post(client, "/redo", game_id=game_id)
+    assert status == 400
+    status, body = post(client, "/history", game_id=game_id)
+    assert body["redo"] == 0
+    assert [delta["to"] for delta in body["moves"]] == ["Cc1", "Cc5"]
+
+
+def test_undo_limits(client):
+    game_id = new_game(client)["game_id"]
+    apply_moves(client, game_id, OPENING[:1])
+    assert post(client, "/undo", game_id=game_id, count=2) == (400, {"error": "Nothing to undo"})
+    assert post(client, "/undo", game_id=game_id, count=0) == (400, {"error": "Invalid count"})
+    assert post(client, "/undo", game_id="missing") == (400, {"error": "Invalid game_id"})
+
+
+def test_undo_after_reload_from_store(client):
+    # ストアのキャッシュから消えて読み直したゲームは、待ったの記録を差分から作り直す
+    initial = new_game(client)
+    game_id = initial["game_id"]
+    apply_moves(client, game_id, OPENING[:2])
+    server.games.flush()
+    server.games._cache.clear()
+    apply_moves(client, game_id, OPENING[2:])
+
+    status, body = post(client, "/undo", game_id=game_id, count=3)
+    assert status == 200
+    assert body["board"] == initial["board"]
+    assert body["captured_pieces"] == {"white": [], "black": []}
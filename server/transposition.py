@@ -0,0 +1,170 @@
+"""
+探索用の置換表 (transposition table)。
+
+Zobrist キーごとに「その局面を何手の深さで読んだか・評価値・
+評価値の種類 (正確値 / 下限 / 上限)・最善手」を覚えておき、
+同じ局面に別の手順で着いたときに読み直しを省きます。
+
+メモリを食わないよう、エントリは Python のオブジェクトではなく
+array に 64bit 整数として詰めます (1 エントリ = キー 8 バイト + データ 8 バイト)。
+2 エントリで 1 つのバケツにし、
+
+  - スロット 0: 深く読んだ結果を優先して残す (depth-preferred)
+  - スロット 1: 常に上書きする (always-replace)
+
+という置き換え方をします。
+"""
+from array import array
+
+# 評価値の種類
+BOUND_NONE = 0
+BOUND_EXACT = 1
+BOUND_LOWER = 2  # 実際の値はこれ以上 (β カット)
+BOUND_UPPER = 3  # 実際の値はこれ以下 (α を超えなかった)
+
+ENTRY_BYTES = 16
+
+# データ部のビット配置
+_NO_SQUARE = 127
+_PROMOTIONS = ["", "Q", "N", "U", "R", "B"]
+_SCORE_OFFSET = 1 << 19
+_FROM_SHIFT, _TO_SHIFT, _PROMO_SHIFT = 0, 7, 14
+_BOUND_SHIFT, _DEPTH_SHIFT, _GEN_SHIFT, _SCORE_SHIFT = 17, 19, 26, 34
+
+
+def _pack(move, score, depth, bound, generation):
+    if move is None:
+        from_idx = to_idx = _NO_SQUARE
+        promo = 0
+    else:
+        from_idx, to_idx, promotion = move
+        promo = _PROMOTIONS.index(promotion.upper()) if promotion else 0
+    return (
+        from_idx << _FROM_SHIFT
+        | to_idx << _TO_SHIFT
+        | promo << _PROMO_SHIFT
+        | bound << _BOUND_SHIFT
+        | min(depth, 127) << _DEPTH_SHIFT
+        | (generation & 0xFF) << _GEN_SHIFT
+        | (score + _SCORE_OFFSET) << _SCORE_SHIFT
+    )
+
+
+def _unpack_move(data, side_to_move):
+    from_idx = data >> _FROM_SHIFT & 0x7F
+    if from_idx == _NO_SQUARE:
+        return None
+    promotion = _PROMOTIONS[data >> _PROMO_SHIFT & 0x7] or None
+    if promotion and side_to_move == "black":
+        promotion = promotion.lower()
+    return from_idx, data >> _TO_SHIFT & 0x7F, promotion
+
+
+class TTEntry:
+    """probe の結果"""
+
+    __slots__ = ("move", "score", "depth", "bound")
+
+    def __init__(self, move, score, depth, bound):
+        self.move = move
+        self.score = score
+        self.depth = depth
+        self.bound = bound
+
+
+class TranspositionTable:
+    """
+    固定サイズの置換表。size_mb から 2 のべき乗個のバケツを確保する。
+    プロセス内の全ゲームで 1 つを共有する想定で、探索ごとに
+    new_search() で世代を進めると、古い世代のエントリは深さに関係なく
+    上書きされやすくなる。
+
+    複数スレッドから同時に書かれても壊れた手を返さないよう、
+    probe は取り出した手が合法手に含まれるかを呼び出し側で確かめること。
+    """
+
+    def __init__(self, size_mb=32):
+        buckets = max(1, (size_mb * 1024 * 1024) // (2 * ENTRY_BYTES))
+        buckets = 1 << (buckets.bit_length() - 1)  # 2 のべき乗に切り下げ
+        self.size_mb = size_mb
+        self.mask = buckets - 1
+        self.keys = array("Q", bytes(8 * 2 * buckets))
+        self.data = array("Q", bytes(8 * 2 * buckets))
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.overwrites = 0  # 別の局面のエントリを上書きした回数 (衝突)
+        # キーの入っているスロットの数。stats で表全体を数え直さないよう store で数える
+        self.used = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def new_search(self):
+        self.generation = (self.generation + 1) & 0xFF
+
+    def clear(self):
+        self.keys = array("Q", bytes(8 * len(self.keys)))
+        self.data = array("Q", bytes(8 * len(self.data)))
+        self.generation = 0
+        self.used = 0
+
+    def probe(self, key, side_to_move):
+        """key のエントリがあれば TTEntry を、なければ None を返す"""
+        self.probes += 1
+        slot = (key & self.mask) << 1
+        keys = self.keys
+        if keys[slot] == key:
+            data = self.data[slot]
+        elif keys[slot + 1] == key:
+            data = self.data[slot + 1]
+        else:
+            return None
+        if data >> _BOUND_SHIFT & 0x3 == BOUND_NONE:
+            return None
+        self.hits += 1
+        return TTEntry(
+            _unpack_move(data, side_to_move),
+            (data >> _SCORE_SHIFT) - _SCORE_OFFSET,
+            data >> _DEPTH_SHIFT & 0x7F,
+            data >> _BOUND_SHIFT & 0x3,
+        )
+
+    def store(self, key, move, score, depth, bound):
+        self.stores += 1
+        slot = (key & self.mask) << 1
+        keys, data = self.keys, self.data
+        old = data[slot]
+        old_depth = old >> _DEPTH_SHIFT & 0x7F
+        old_generation = old >> _GEN_SHIFT & 0xFF
+        if (
+            keys[slot] == key
+            or old == 0
+            or depth >= old_depth
+            or old_generation != self.generation
+        ):
+            target = slot
+        else:
+            target = slot + 1
+        if data[target] and keys[target] != key:
+            self.overwrites += 1
+        if move is None and keys[target] == key:
+            # 最善手が分からない結果で、前に覚えた手を消さない
+            move = _unpack_move(data[target], "white")
+        self.used += (key != 0) - (keys[target] != 0)
+        keys[target] = key
+        data[target] = _pack(move, score, depth, bound, self.generation)
+
+    def stats(self):
+        return {
+            "size_mb": self.size_mb,
+            "entries": len(self.keys),
+            "used": self.used,
+            "probes": self.probes,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.probes if self.probes else 0.0,
+            "stores": self.stores,
+            "overwrites": self.overwrites,
+            "generation": self.generation,
+        }
@@ -0,0 +1,314 @@
+"""
+NumPy で多数の盤面をまとめて調べるバッチ版の利き・王手・指し手の計算。
+
+board.py は 1 枚の盤面の 1 つの駒ずつ Python のループで調べますが、
+ここでは N 枚の盤面を (N, 5, 5, 5) の int8 配列 (軸はレベル・行・列) にして、
+全盤面・全マスを配列のシフトで一度に計算します。
+一括解析や自己対局の棋譜の処理など、オフラインで大量の局面を扱うとき向けです。
+
+配列の値は駒の種類の番号で、白は正・黒は負、空マスは 0 です。
+
+    P=1  N=2  B=3  R=4  U=5  Q=6  K=7   (黒は -1 .. -7)
+
+走り駒の利きは、駒の位置を方向ごとに 1 マスずつずらしては空マスで絞る
+(空マスの上だけ伸ばす) のを 4 回繰り返して求めます。
+方向・跳びのパターンは board.py の QUEEN_DIRS などをそのまま使います。
+
+    arr = to_array([position.board for position in positions])
+    white = np.array([p.side_to_move == "white" for p in positions])
+    checks = is_check(arr, white)                 # (N,) bool
+    moves = pseudo_legal_moves(arr, white)        # (N, 125, 125) bool: [盤面, 元, 先]
+
+pseudo_legal_moves は自分のキングを取られる手を除いていません (疑似合法手)。
+"""
+import numpy as np
+
+from board import (
+    BISHOP_DIRS,
+    KING_DELTAS,
+    KING_TARGETS,
+    KNIGHT_DELTAS,
+    KNIGHT_TARGETS,
+    NUM_SQUARES,
+    PAWN_CAPTURE_DELTAS,
+    PAWN_CAPTURE_TARGETS,
+    PAWN_PASSIVE_DELTAS,
+    QUEEN_DIRS,
+    ROOK_DIRS,
+    UNICORN_DIRS,
+    in_range,
+    square_index,
+)
+
+PAWN, KNIGHT, BISHOP, ROOK, UNICORN, QUEEN, KING = range(1, 8)
+PIECE_CODES = {"P": PAWN, "N": KNIGHT, "B": BISHOP, "R": ROOK,
+               "U": UNICORN, "Q": QUEEN, "K": KING}
+
+# 駒の文字の ASCII コード → 配列の値、とその逆
+_FROM_ASCII = np.zeros(256, dtype=np.int8)
+_TO_ASCII = np.full(256, ord("."), dtype=np.uint8)  # int8 の値 (-7..7) を uint8 で引く
+for _letter, _code in PIECE_CODES.items():
+    _FROM_ASCII[ord(_letter)] = _code
+    _FROM_ASCII[ord(_letter.lower())] = -_code
+    _TO_ASCII[_code] = ord(_letter)
+    _TO_ASCII[-_code & 0xFF] = ord(_letter.lower())
+
+# 走り駒ごとの方向と、その方向に走れる駒の種類
+_SLIDERS = (
+    [(d, (ROOK, QUEEN)) for d in ROOK_DIRS]
+    + [(d, (BISHOP, QUEEN)) for d in BISHOP_DIRS]
+    + [(d, (UNICORN, QUEEN)) for d in UNICORN_DIRS]
+)
+
+# 昇格するマス (白: Level E の行 5, 黒: Level A の行 1)
+_PROMOTION_SQUARES = {True: np.zeros((5, 5, 5), dtype=bool),
+                      False: np.zeros((5, 5, 5), dtype=bool)}
+_PROMOTION_SQUARES[True][4, 4, :] = True
+_PROMOTION_SQUARES[False][0, 0, :] = True
+
+# is_check でキングのマスから逆に辿る表。盤外は番兵のマス _OFF (いつも空) にする
+_OFF = NUM_SQUARES
+
+
+def _padded_table(rows, width):
+    table = np.full((NUM_SQUARES, width), _OFF, dtype=np.intp)
+    for square, targets in enumerate(rows):
+        table[square, :len(targets)] = targets
+    return table
+
+
+def _line(square, d):
+    """square から方向 d に並ぶ盤内のマス (近い順)"""
+    lvl, col, row = square // 25, square % 5, (square // 5) % 5
+    squares = []
+    while in_range(lvl + d[0], col + d[1], row + d[2]):
+        lvl, col, row = lvl + d[0], col + d[1], row + d[2]
+        squares.append(square_index(lvl, col, row))
+    return squares
+
+
+# [マス, QUEEN_DIRS の方向, 近い順の 4 マス]
+_LINE_TABLE = np.stack([
+    _padded_table([_line(square, d) for square in range(NUM_SQUARES)], 4)
+    for d in QUEEN_DIRS
+], axis=1)
+# QUEEN_DIRS の方向ごとに、その方向に走れる駒 (クイーン以外)
+_LINE_PIECES = np.array(
+    [ROOK] * len(ROOK_DIRS) + [BISHOP] * len(BISHOP_DIRS) + [UNICORN] * len(UNICORN_DIRS),
+    dtype=np.int8,
+)
+_KNIGHT_TABLE = _padded_table(KNIGHT_TARGETS, 24)
+_KING_TABLE = _padded_table(KING_TARGETS, 26)
+# 手番側のキングを取れる相手のポーンのいるマス (board.is_square_attacked と同じ表)
+_PAWN_TABLE = {True: _padded_table(PAWN_CAPTURE_TARGETS["white"], 4),
+               False: _padded_table(PAWN_CAPTURE_TARGETS["black"], 4)}
+
+
+def to_array(boards):
+    """board.py の盤面 (bytearray / bytes / 125 文字の文字列) のリスト → (N, 5, 5, 5) int8"""
+    data = b"".join(
+        board.encode("ascii") if isinstance(board, str) else bytes(board)
+        for board in boards
+    )
+    if len(data) % NUM_SQUARES:
+        raise ValueError("Invalid board length")
+    codes = np.frombuffer(data, dtype=np.uint8)
+    return _FROM_ASCII[codes].reshape(-1, 5, 5, 5)
+
+
+def from_array(arr):
+    """to_array の逆。bytearray のリストを返す"""
+    data = _TO_ASCII[np.asarray(arr, dtype=np.int8).view(np.uint8)]
+    return [bytearray(row.tobytes()) for row in data.reshape(-1, NUM_SQUARES)]
+
+
+def _axis_slices(k):
+    """1 つの軸を k ずらすときの (書き込む側, 読む側) のスライス"""
+    if k > 0:
+        return slice(k, None), slice(None, -k)
+    if k < 0:
+        return slice(None, k), slice(-k, None)
+    return slice(None), slice(None)
+
+
+def shift(a, d):
+    """
+    盤面の配列 a (5, 5, 5, ...) の中身を d = (d_lvl, d_col, d_row) だけずらす
+    (board.py の方向と同じ並び)。盤外にはみ出た分は捨て、空いたところは 0。
+    """
+    out = np.zeros_like(a)
+    # 配列の軸はレベル・行・列の順
+    dst, src = zip(*(_axis_slices(k) for k in (d[0], d[2], d[1])))
+    out[dst] = a[src]
+    return out
+
+
+def _neg(d):
+    return (-d[0], -d[1], -d[2])
+
+
+def _scale(d, k):
+    return (d[0] * k, d[1] * k, d[2] * k)
+
+
+# 内部では盤面の番号を最後の軸にした (5, 5, 5, N) の配列で計算する。
+# こうするとシフトが N 個ずつ連続したメモリのコピーになり、ずっと速い
+def _planes(arr):
+    return np.ascontiguousarray(np.moveaxis(np.asarray(arr, dtype=np.int8), 0, -1))
+
+
+def _side_array(white, count):
+    """white (bool か (N,) の bool 配列) → (N,) の bool 配列"""
+    white = np.asarray(white, dtype=bool).reshape(-1)
+    return np.broadcast_to(white, (count,))
+
+
+def _relative(planes, white):
+    """白番の盤面はそのまま、黒番の盤面は符号を反転して、手番側の駒を正にする"""
+    return np.where(white, planes, -planes)
+
+
+def _attacks(planes, white):
+    """attack_maps の本体。planes は (5, 5, 5, N)、white は (N,)"""
+    rel = _relative(planes, white)
+    empty = planes == 0
+    attacked = np.zeros(planes.shape, dtype=bool)
+
+    for deltas, piece in ((KNIGHT_DELTAS, KNIGHT), (KING_DELTAS, KING)):
+        movers = rel == piece
+        for d in deltas:
+            attacked |= shift(movers, d)
+
+    # ポーンは白が +、黒が - 方向に取る
+    pawns = rel == PAWN
+    white_pawns, black_pawns = pawns & white, pawns & ~white
+    for d in PAWN_CAPTURE_DELTAS:
+        attacked |= shift(white_pawns, d) | shift(black_pawns, _neg(d))
+
+    for d, pieces in _SLIDERS:
+        ray = shift((rel == pieces[0]) | (rel == pieces[1]), d)
+        for _ in range(4):
+            attacked |= ray
+            ray = shift(ray & empty, d)
+    return attacked
+
+
+def attack_maps(arr, by_white):
+    """
+    by_white の側 (bool か盤面ごとの (N,) の bool 配列) の駒が利いているマスの
+    (N, 5, 5, 5) bool 配列
+    """
+    white = _side_array(by_white, len(arr))
+    return np.moveaxis(_attacks(_planes(arr), white), -1, 0)
+
+
+def is_check(arr, white_to_move):
+    """
+    各盤面で手番側のキングが王手されているかの (N,) bool 配列。
+    利きの地図は作らず、board.is_square_attacked と同じくキングのマスから
+    各方向・跳び先を逆に辿る (全盤面の分を 1 回の添字引きで集める)。
+    キングのない盤面は False
+    """
+    count = len(arr)
+    white = _side_array(white_to_move, count)
+    flat = np.asarray(arr, dtype=np.int8).reshape(count, NUM_SQUARES)
+    rel = np.zeros((count, NUM_SQUARES + 1), dtype=np.int8)
+    rel[:, :NUM_SQUARES] = np.where(white[:, None], flat, -flat)
+    kings = rel == KING
+    has_king = kings.any(axis=1)
+    king = kings.argmax(axis=1)
+    rows = np.arange(count)[:, None]
+
+    # 走り駒: 各方向で最初に当たった駒 (なければ 0) が、その方向に走れる相手の駒か
+    lines = rel[rows[:, :, None], _LINE_TABLE[king]]
+    first = np.take_along_axis(lines, (lines != 0).argmax(axis=2)[..., None], axis=2)[..., 0]
+    checked = ((first == -_LINE_PIECES) | (first == -QUEEN)).any(axis=1)
+    checked |= (rel[rows, _KNIGHT_TABLE[king]] == -KNIGHT).any(axis=1)
+    checked |= (rel[rows, _KING_TABLE[king]] == -KING).any(axis=1)
+    pawn_squares = np.where(white[:, None], _PAWN_TABLE[True][king], _PAWN_TABLE[False][king])
+    checked |= (rel[rows, pawn_squares] == -PAWN).any(axis=1)
+    return checked & has_king
+
+
+def _move_sets(planes, white):
+    """
+    疑似合法手を (ずらす量 d, 動かせる駒の元のマスの (5, 5, 5, N) bool 配列, ポーンか)
+    の組で順に返す。元のマスが s なら移動先は s + d
+    """
+    rel = _relative(planes, white)
+    empty = planes == 0
+    enemy = rel < 0
+    not_own = rel <= 0
+
+    for deltas, piece in ((KNIGHT_DELTAS, KNIGHT), (KING_DELTAS, KING)):
+        movers = rel == piece
+        for d in deltas:
+            # shift(x, -d) の s の値は、s + d のマスの x
+            yield d, movers & shift(not_own, _neg(d)), False
+
+    pawns = rel == PAWN
+    for color_pawns, sign in ((pawns & white, 1), (pawns & ~white, -1)):
+        for deltas, targets in ((PAWN_PASSIVE_DELTAS, empty),
+                                (PAWN_CAPTURE_DELTAS, enemy)):
+            for d in deltas:
+                d = _scale(d, sign)
+                yield d, color_pawns & shift(targets, _neg(d)), True
+
+    for d, pieces in _SLIDERS:
+        sliding = (rel == pieces[0]) | (rel == pieces[1])
+        for k in range(1, 5):
+            if not sliding.any():
+                break
+            step = _scale(d, k)
+            back = _neg(step)
+            yield step, sliding & shift(not_own, back), False
+            sliding = sliding & shift(empty, back)
+
+
+# ずらす量 d ごとの、盤内に収まる (元のマス番号, 先のマス番号) の配列
+_PAIRS = {}
+
+
+def _square_pairs(d):
+    pairs = _PAIRS.get(d)
+    if pairs is None:
+        squares = np.arange(NUM_SQUARES)
+        lvl, row, col = squares // 25, (squares // 5) % 5, squares % 5
+        lvl, col, row = lvl + d[0], col + d[1], row + d[2]
+        inside = (lvl >= 0) & (lvl < 5) & (col >= 0) & (col < 5) & (row >= 0) & (row < 5)
+        pairs = squares[inside], (lvl * 25 + row * 5 + col)[inside]
+        _PAIRS[d] = pairs
+    return pairs
+
+
+def pseudo_legal_moves(arr, white_to_move):
+    """
+    手番側の疑似合法手の (N, 125, 125) bool 配列。[i, from_idx, to_idx] が True なら
+    盤面 i で from_idx の駒を to_idx へ動かせる (昇格は 1 つにまとめる)。
+    1 盤面あたり 16KB 使うので、大量の盤面は分けて渡すこと
+    """
+    count = len(arr)
+    white = _side_array(white_to_move, count)
+    moves = np.zeros((count, NUM_SQUARES, NUM_SQUARES), dtype=bool)
+    for d, can, _ in _move_sets(_planes(arr), white):
+        src, dst = _square_pairs(d)
+        moves[:, src, dst] |= can.reshape(NUM_SQUARES, count)[src].T
+    return moves
+
+
+def count_pseudo_legal(arr, white_to_move):
+    """
+    手番側の疑似合法手の数の (N,) int 配列。
+    generate_all_moves と同じく、昇格は昇格先の駒 5 種類を別の手として数える
+    """
+    count = len(arr)
+    white = _side_array(white_to_move, count)
+    promotion = np.where(white, _PROMOTION_SQUARES[True][..., None],
+                         _PROMOTION_SQUARES[False][..., None])
+    # マスごとの手の数 (1 マスから出る手は 26 方向 x 4 + 昇格でも 255 に届かない)
+    totals = np.zeros((5, 5, 5, count), dtype=np.uint8)
+    for d, can, is_pawn in _move_sets(_planes(arr), white):
+        totals += can
+        if is_pawn:
+            totals += np.uint8(4) * (can & shift(promotion, _neg(d)))
+    return totals.sum(axis=(0, 1, 2), dtype=np.int64)